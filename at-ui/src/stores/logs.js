@@ -21,6 +21,10 @@ export const useLogsStore = defineStore('logs', {
         }
       })
       this.sockets.on('present-items', (data) => {
+        // log a progressively presented group once, with its final items
+        if (data.group_stage && data.group_stage !== "final") {
+          return
+        }
         this.addLog({
           type: "presentItems",
           userIntent: data.user_intent,
@@ -6,6 +6,7 @@ export const useProductsStore = defineStore('products', {
     count: 0,
     currentProductName: "",
     currentProductGroupID: null,
+    groupVersions: {},
     currentProductIconID: null,
     selectedProductID: null,
     modalOpen: false,
@@ -15,18 +16,23 @@ export const useProductsStore = defineStore('products', {
   actions: {
     setSockets(sockets) {
       this.sockets = sockets;
-        this.sockets.on('present-items', ({items}) => {
-          console.log("present-items: received: " + this.currentProductGroupID + ", items: " + items.length)
-          items.forEach(item => {
-            this.addProduct({
-              id: item.id,
-              index: this.count,
-              groupID: this.currentProductGroupID,
-              imageID: item.id,
-              name: item.name,
-              description: item.description,
-          })
-        })
+        this.sockets.on('present-items', ({items, group_id, group_version}) => {
+          // a group is presented in versions (retrieved, filtered, final): keep the latest one
+          const groupID = group_id ?? this.currentProductGroupID
+          console.log("present-items: received: " + groupID + ", version: " + group_version + ", items: " + items.length)
+          if (group_version !== undefined) {
+            if (group_version <= (this.groupVersions[groupID] ?? 0)) {
+              return
+            }
+            this.groupVersions[groupID] = group_version
+          }
+          this.replaceProducts(groupID, items.map(item => ({
+            id: item.id,
+            groupID: groupID,
+            imageID: item.id,
+            name: item.name,
+            description: item.description,
+          })))
       })
       this.sockets.on('set-product-group', ({group_id, item_category, group_icon_id, queries}) => {
 //        this.setProductGroup({productName: queries[0], group_id, group_icon_id});
@@ -40,6 +46,23 @@ export const useProductsStore = defineStore('products', {
       this.products.push(product)
       this.count++
     },
+    replaceProducts(groupID, groupProducts) {
+      // in place of the previous version of the group (at the end for a new group)
+      let position = this.products.findIndex(product => product.groupID === groupID)
+      if (position < 0) {
+        position = this.products.length
+      }
+      const otherProducts = this.products.filter(product => product.groupID !== groupID)
+      this.products = [
+        ...otherProducts.slice(0, position),
+        ...groupProducts,
+        ...otherProducts.slice(position),
+      ]
+      this.products.forEach((product, index) => {
+        product.index = index
+      })
+      this.count = this.products.length
+    },
     setCartOpen(open, productID) {
       if(productID) {
         const product = this.products.find(product => product.id === productID)
@@ -72,6 +95,7 @@ export const useProductsStore = defineStore('products', {
         this.currentProductGroupID = 0
         this.count = 0
       }
+      this.groupVersions = {}
     },
     mockProducts(count = 10) {
       for(let i = 0; i < count; i++) {
@@ -2,6 +2,8 @@
  * Shared consts and functions.
  */
 
+import { HOSTNAME } from "../services/shopsockets";
+
 /**
  * Constants
  */
@@ -49,8 +51,10 @@ export function arrayBufferToBase64(buffer) {
   }
   
 
+  // item images from the server (its thumbnail cache is shared with the search pipeline).
+  // They aren't sharpened by the CDN anymore, so the UI shows the images drawn on the boards.
   export const getImageUrl = (id, width, height) => {
-    return `https://u-mercari-images.mercdn.net/photos/${id}_1.jpg?w=${width}&h=${height}&fitcrop&sharpen`;
+    return `https://${HOSTNAME}/img/${id}?w=${width}&h=${height}`;
   };
 
 
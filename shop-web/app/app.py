@@ -15,8 +15,11 @@
 """
 This module provides a Quart web application that acts as a proxy
 for the Gemini API, handling WebSocket connections for text and audio.
+It also serves the item images to the UI from the thumbnail cache of the search pipeline.
 """
 
+import re
+import hashlib
 import logging
 import os
 
@@ -24,12 +27,19 @@ from quart import Quart, websocket, send_from_directory, Response, request, redi
 from quart_cors import cors
 
 from shop_agent.comm import start_user_session, send_message_to_agent_from_http
+from shop_utils.image_utils import load_item_image_async
 
 logging.basicConfig(level=logging.INFO)
 
 QUART_DEBUG_MODE: bool = os.environ.get("QUART_DEBUG_MODE") == "True"
 RESOURCES_URL: str = "https://cloud.google.com/vertex-ai/docs/vector-search/overview"
 
+# Item images: valid ids, sizes in px, and secs the browsers may use one before revalidating it
+ITEM_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+ITEM_IMAGE_DEFAULT_SIZE: int = 400
+ITEM_IMAGE_MAX_SIZE: int = 1000
+ITEM_IMAGE_MAX_AGE: int = 24 * 60 * 60
+
 
 #
 # Quart
@@ -86,6 +96,41 @@ async def send_content() -> Response:
     return Response()
 
 
+@app.route("/img/<item_id>")
+async def item_image(item_id: str) -> Response:
+    """
+    Serves an item image from the thumbnail cache shared with the search pipeline. On a miss,
+    it's downloaded from Mercari once for the concurrent requests (see image_fetcher.py).
+    Responds with a strong ETag (a hash of the image), and 304 if it matches If-None-Match.
+
+    Args:
+        item_id: the item ID.
+        w, h: the width and height in px (query params, 400 by default).
+    """
+    width = request.args.get("w", ITEM_IMAGE_DEFAULT_SIZE, type=int)
+    height = request.args.get("h", ITEM_IMAGE_DEFAULT_SIZE, type=int)
+    if not ITEM_ID_PATTERN.fullmatch(item_id) or not (
+        0 < width <= ITEM_IMAGE_MAX_SIZE and 0 < height <= ITEM_IMAGE_MAX_SIZE
+    ):
+        return Response("Invalid item image", status=400)
+
+    # Get the image from the cache or Mercari (the disk tier is read on the image pool)
+    image = await load_item_image_async(item_id, width, height)
+    if image is None:
+        return Response("Item image unavailable", status=502)
+
+    # Respond with the image, or not modified (the thumbnails are small and held whole in the
+    # cache, and the ETag hashes all the bytes, so the body isn't streamed in chunks)
+    etag = hashlib.blake2b(image, digest_size=16).hexdigest()
+    headers = {"Cache-Control": f"public, max-age={ITEM_IMAGE_MAX_AGE}"}
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304, headers=headers)
+    else:
+        response = Response(image, mimetype="image/jpeg", headers=headers)
+    response.set_etag(etag)
+    return response
+
+
 @app.websocket("/live")
 async def live() -> None:
     """
@@ -16,12 +16,15 @@
 This module provides Agent definitions for the shop_web app.
 """
 
-from typing import Dict, Any
+from typing import Dict, Any, Awaitable, Callable
 import os
+import copy
+import asyncio
 import logging
 import time
 import uuid
 import threading
+from collections import deque
 from json.decoder import JSONDecodeError
 
 import requests
@@ -46,7 +49,11 @@ from shop_utils.query import (
     filter_and_rerank_items,
     TOTAL_ITEM_COUNT,
 )
+from shop_utils.async_query import run_queries_async, filter_and_rerank_items_async
 from shop_utils.gemini import generate_item_categories
+from shop_utils.deadline import Deadline
+from shop_utils.executor import io_executor, search_executor, executor_stats
+from shop_utils.image_fetcher import image_fetcher
 
 logging.basicConfig(level=logging.INFO)
 
@@ -304,6 +311,7 @@ def get_root_agent(search_history: str = None):
         instruction=instruction,
         description=description,
         planning=False,
+        before_tool_callback=skip_summarization,
         tools=[
             google_search,
             find_shopping_items,
@@ -314,6 +322,20 @@ def get_root_agent(search_history: str = None):
     return root_agent
 
 
+# Tools running in the background (async generators): the framework replies "pending" first,
+# then sends the result to the model as a user message
+BACKGROUND_TOOLS = ("find_shopping_items", "deep_research")
+
+
+def skip_summarization(tool: Any, args: Dict[str, Any], tool_context: ToolContext) -> None:
+    """
+    Skips the summarization of the response of a background tool (set before the call, as the
+    framework builds the response before the tool runs)
+    """
+    if tool.name in BACKGROUND_TOOLS:
+        tool_context.actions.skip_summarization = True
+
+
 #
 # Show spinner tool
 #
@@ -376,27 +398,111 @@ class SearchConditions:
 
 FEATURED_ITEMS_COUNT = 5
 
+# Latency budget of a search (secs), after which the best results so far are presented
+SEARCH_DEADLINE = float(os.environ.get("SEARCH_DEADLINE", 10.0))
+
+# Present the retrieved items and each filtered batch before the final reranked order
+PROGRESSIVE_RESULTS = os.environ.get("PROGRESSIVE_RESULTS", "False") == "True"
+
+# Run the searches as tasks on the event loop of the agent (shop_utils/async_query.py)
+# instead of the search pool
+ASYNC_PIPELINE = os.environ.get("ASYNC_PIPELINE", "False") == "True"
+
+# References to the running deep research and category search tasks (the loop keeps weak
+# references only)
+background_tasks: set[asyncio.Task] = set()
+
+# Item fields used for ranking only (not sent to the UI)
+ITEM_SCORE_FIELDS = ("dense_dist", "sparse_dist", "rerank_score")
+
+# Time from the tool call to the first presented items (secs) of the recent searches
+TIME_TO_FIRST_ITEM_SAMPLES = 1000
+time_to_first_item_lock = threading.Lock()
+time_to_first_item_samples = deque(maxlen=TIME_TO_FIRST_ITEM_SAMPLES)
+
+
+def record_time_to_first_item(latency: float) -> dict[str, Any]:
+    """Records the time to first item of a search and returns the metrics"""
+    with time_to_first_item_lock:
+        time_to_first_item_samples.append(latency)
+        samples = sorted(time_to_first_item_samples)
+    return {
+        "time_to_first_item": latency,
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(int(len(samples) * 0.95), len(samples) - 1)],
+        "searches": len(samples),
+    }
+
 
-def find_items_worker(cond: SearchConditions) -> None:
+class ItemGroupPresenter:
     """
-    Find items from the e-commerce site using the list of queries.
+    Sends the items of an item group to the UI. Each message has the same group_id and an
+    increasing version, so that the UI can replace the items of the group with the latest
+    version: "retrieved" (raw retrieval hits), "filtered" (the Gemini-filtered batches so
+    far) and "final" (the reranked order).
     """
 
-    # Run queries
-    start_time = time.time()
-    items = run_queries(cond.queries, ["id", "name", "description"], cond.query_rows)
+    def __init__(self, cond: SearchConditions, deadline: Deadline, found_item_count: int):
+        self.cond = cond
+        self.deadline = deadline
+        self.found_item_count = found_item_count
+        self.group_id = "group_" + str(uuid.uuid4())[:8]
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def present(self, stage: str, items: list[Dict[str, Any]], elapsed_time: float) -> None:
+        """Sends a present items msg with the next version of the group"""
+        # copy the items, as the pipeline keeps updating them after the message is queued
+        items = [
+            {name: value for name, value in item.items() if name not in ITEM_SCORE_FIELDS}
+            for item in items
+        ]
+        with self.lock:
+            self.version += 1
+            present_item_msg = {
+                "group_id": self.group_id,
+                "group_version": self.version,
+                "group_stage": stage,
+                "group_icon_id": items[0]["id"] if len(items) > 0 else None,
+                "user_intent": self.cond.user_intent,
+                "item_category": self.cond.item_category,
+                "elapsed_time": elapsed_time,
+                "selected_item_count": len(items),
+                "found_item_count": self.found_item_count,
+                "total_item_count": TOTAL_ITEM_COUNT,
+                "items": items,
+            }
+            send_ui_command(
+                command=CMD_UI_PRESENT_ITEMS,
+                parameter=present_item_msg,
+                session_id=self.cond.session_id,
+            )
+            if self.version == 1:
+                logging.info(
+                    "find_items_worker(): %s: %s",
+                    stage,
+                    record_time_to_first_item(self.deadline.elapsed()),
+                )
+
+
+def start_item_group(
+    cond: SearchConditions, deadline: Deadline, items: list[Dict[str, Any]], elapsed_time: float
+) -> tuple[ItemGroupPresenter, Dict[str, Any], list[Dict[str, Any]]]:
+    """
+    Creates the presenter and the query message for the found items, and removes the items
+    found in the past. Returns the presenter, query message and new items.
+    """
     found_item_count = len(items)
-    elapsed_time = time.time() - start_time
 
-    # Generate random id for the item category group
-    group_id = "group_" + str(uuid.uuid4())[:8]
+    # Create the presenter with a random id for the item category group
+    presenter = ItemGroupPresenter(cond, deadline, found_item_count)
 
     # Pick one item image for the group icon
     group_icon_id = items[0]["id"] if len(items) > 0 else None
 
     # Package a query message
     query_msg = {
-        "group_id": group_id,
+        "group_id": presenter.group_id,
         "group_icon_id": group_icon_id,
         "user_intent": cond.user_intent,
         "item_category": cond.item_category,
@@ -416,50 +522,60 @@ def find_items_worker(cond: SearchConditions) -> None:
             items = new_items
             cond.found_item_ids.extend([item["id"] for item in items])
 
-    # Item curation
-    start_time = time.time()
-    items = filter_and_rerank_items(
-        user_intent=cond.user_intent,
-        item_category=cond.item_category,
-        user_uploaded_image=cond.user_uploaded_image,
-        items=items,
+    # Send the query message and the retrieved items first
+    if PROGRESSIVE_RESULTS:
+        send_ui_command(
+            command=CMD_UI_SHOW_QUERY_MSG,
+            parameter=query_msg,
+            session_id=cond.session_id,
+        )
+        logging.info(query_msg)
+        presenter.present(
+            "retrieved", [item for item in items if item["name"]], elapsed_time
+        )
+    return presenter, query_msg, items
+
+
+def finish_item_group(
+    cond: SearchConditions,
+    presenter: ItemGroupPresenter,
+    query_msg: Dict[str, Any],
+    items: list[Dict[str, Any]],
+    elapsed_time: float,
+) -> None:
+    """Presents the final items of the group and hides the spinner"""
+    logging.info(
+        "find_items_worker(): elapsed: %.2f sec, deadline remaining: %.2f sec, pools: %s, "
+        + "images: %s",
+        presenter.deadline.elapsed(),
+        presenter.deadline.remaining(),
+        executor_stats(),
+        image_fetcher.stats(),
+    )
+    # stages as (start, end) secs, and the image prefetch hidden behind the hydration and dedup
+    logging.info(
+        "find_items_worker(): stages: %s, prefetch overlap: %.2f sec",
+        presenter.deadline.stage_timings(),
+        presenter.deadline.stage_overlap("prefetch", ["features", "dedup", "cascade"]),
     )
-    elapsed_time = time.time() - start_time
 
-    # Pick the first item for the group icon and featured items
-    group_icon_id = items[0]["id"] if len(items) > 0 else None
+    # Pick the first item for the featured items
     if cond.featured_items is not None:
         with cond.lock:
             for i in range(0, min(FEATURED_ITEMS_COUNT, len(items))):
                 cond.featured_items.append(items[i])
 
-    # Package an present items msg
-    present_item_msg = {
-        "group_id": group_id,
-        "group_icon_id": group_icon_id,
-        "user_intent": cond.user_intent,
-        "item_category": cond.item_category,
-        "elapsed_time": elapsed_time,
-        "selected_item_count": len(items),
-        "found_item_count": found_item_count,
-        "total_item_count": TOTAL_ITEM_COUNT,
-        "items": items,
-    }
-
     # Send the query message
-    send_ui_command(
-        command=CMD_UI_SHOW_QUERY_MSG,
-        parameter=query_msg,
-        session_id=cond.session_id,
-    )
-    logging.info(query_msg)
+    if not PROGRESSIVE_RESULTS:
+        send_ui_command(
+            command=CMD_UI_SHOW_QUERY_MSG,
+            parameter=query_msg,
+            session_id=cond.session_id,
+        )
+        logging.info(query_msg)
 
     # Send the present items msg
-    send_ui_command(
-        command=CMD_UI_PRESENT_ITEMS,
-        parameter=present_item_msg,
-        session_id=cond.session_id,
-    )
+    presenter.present("final", items, elapsed_time)
 
     # Send the show spinner message
     send_ui_command(
@@ -469,9 +585,78 @@ def find_items_worker(cond: SearchConditions) -> None:
     )
 
 
-def find_shopping_items(
+def find_items_worker(cond: SearchConditions, deadline: Deadline) -> None:
+    """
+    Find items from the e-commerce site using the list of queries.
+    """
+
+    # Run queries
+    start_time = time.time()
+    items = run_queries(
+        cond.queries, ["id", "name", "description"], cond.query_rows, deadline
+    )
+    presenter, query_msg, items = start_item_group(
+        cond, deadline, items, time.time() - start_time
+    )
+
+    # Item curation (presenting each filtered batch as it completes)
+    start_time = time.time()
+
+    def present_filtered_items(filtered_items):
+        presenter.present("filtered", filtered_items, time.time() - start_time)
+
+    items = filter_and_rerank_items(
+        user_intent=cond.user_intent,
+        item_category=cond.item_category,
+        user_uploaded_image=cond.user_uploaded_image,
+        items=items,
+        deadline=deadline,
+        on_filtered=present_filtered_items if PROGRESSIVE_RESULTS else None,
+    )
+    finish_item_group(cond, presenter, query_msg, items, time.time() - start_time)
+
+
+async def find_items_in_executor(cond: SearchConditions, deadline: Deadline) -> None:
+    """Runs find_items_worker on the search pool"""
+    await asyncio.get_running_loop().run_in_executor(
+        search_executor, find_items_worker, cond, deadline
+    )
+
+
+async def find_items_async(cond: SearchConditions, deadline: Deadline) -> None:
+    """
+    Find items from the e-commerce site using the list of queries (on the event loop).
+    """
+
+    # Run queries
+    start_time = time.time()
+    items = await run_queries_async(
+        cond.queries, ["id", "name", "description"], cond.query_rows, deadline
+    )
+    presenter, query_msg, items = start_item_group(
+        cond, deadline, items, time.time() - start_time
+    )
+
+    # Item curation (presenting each filtered batch as it completes)
+    start_time = time.time()
+
+    def present_filtered_items(filtered_items):
+        presenter.present("filtered", filtered_items, time.time() - start_time)
+
+    items = await filter_and_rerank_items_async(
+        user_intent=cond.user_intent,
+        item_category=cond.item_category,
+        user_uploaded_image=cond.user_uploaded_image,
+        items=items,
+        deadline=deadline,
+        on_filtered=present_filtered_items if PROGRESSIVE_RESULTS else None,
+    )
+    finish_item_group(cond, presenter, query_msg, items, time.time() - start_time)
+
+
+async def find_shopping_items(
     user_intent: str, item_category: str, queries: list[str], tool_context: ToolContext
-) -> Dict[str, str]:
+):
     """
     Find shopping items from the e-commerce site with the specified user intent, item category and
     a list of queries.
@@ -485,14 +670,23 @@ def find_shopping_items(
             - "status": returns the following status:
                 - "success": successful execution
     """
-    tool_context.actions.skip_summarization = True
     session_id = tool_context.state[USER_SESSION_ID]
+    deadline = Deadline(SEARCH_DEADLINE)
 
     # Avoid duplicated calls during the deep research
-    if get_deep_research_status(session_id):
-        return {
-            "status": "success",
-        }
+    if not get_deep_research_status(session_id):
+        cond = build_search_conditions(user_intent, item_category, queries, session_id)
+        find_items = find_items_async if ASYNC_PIPELINE else find_items_in_executor
+        await find_items(cond, deadline)
+    yield {
+        "status": "success",
+    }
+
+
+def build_search_conditions(
+    user_intent: str, item_category: str, queries: list[str], session_id: str
+) -> SearchConditions:
+    """Build the search conditions of a find_shopping_items call (and add the search history)"""
 
     # Get user uploaded image
     user_uploaded_image = get_last_uploaded_image(session_id)
@@ -510,7 +704,7 @@ def find_shopping_items(
     query_rows = int(100 / len(queries))
 
     # Build a search condition
-    cond: SearchConditions = SearchConditions(
+    return SearchConditions(
         user_intent=user_intent,
         item_category=item_category,
         user_uploaded_image=user_uploaded_image,
@@ -519,51 +713,46 @@ def find_shopping_items(
         query_rows=query_rows,
     )
 
-    # Create a thread for find_items_worker
-    thread = threading.Thread(
-        target=find_items_worker,
-        args=(cond,),
-    )
-    thread.start()
-    thread.join()
-
-    # Return a pending status
-    return {
-        "status": "success",  # to be changed to "pending"
-    }
-
 
 #
 # deep_research tool
 #
 
 
-def deep_research_worker(cond: SearchConditions, item_categories: list[Dict[str, str]]) -> None:
-    """A worker thread for deep research"""
+async def deep_research_async(
+    cond: SearchConditions,
+    item_categories: list[Dict[str, str]],
+    find_items: Callable[[SearchConditions, Deadline], Awaitable[None]],
+) -> None:
+    """A task for deep research on the loop of the agent, running find_items per category"""
     # List of item IDs (for dedup)
     cond.found_item_ids = []
     cond.featured_items = []
     cond.lock = threading.Lock()
 
-    # Start finding items for each item category
-    threads = []
+    # Start finding items for each item category (with its own conditions, as the tasks
+    # read them after the next category started)
+    tasks = []
     for item_category in item_categories:
-        # Create a thread for find_items_worker
-        cond.item_category = item_category["item_category"]
-        cond.queries = item_category["queries"]
-        thread = threading.Thread(
-            target=find_items_worker,
-            args=(cond,),
-        )
-        thread.start()
-        threads.append(thread)
-        time.sleep(5)
-
-    # Wait until all threads ends
-    for thread in threads:
-        thread.join()
-    time.sleep(5)
-
+        category_cond = copy.copy(cond)
+        category_cond.item_category = item_category["item_category"]
+        category_cond.queries = item_category["queries"]
+        task = asyncio.create_task(find_items(category_cond, Deadline(SEARCH_DEADLINE)))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+        tasks.append(task)
+        await asyncio.sleep(5)
+
+    # Wait until all tasks ends (a failed category doesn't stop the others)
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, Exception):
+            logging.error("deep_research_async(): search failed", exc_info=result)
+    await asyncio.sleep(5)
+    present_concierge_pick(cond)
+
+
+def present_concierge_pick(cond: SearchConditions) -> None:
+    """Sends the Concierge's pick of the deep research, and notifies the agent"""
     # Build Concierge's pick
     group_id = "group_" + str(uuid.uuid4())[:8]
     group_icon_id = cond.featured_items[0]["id"]
@@ -612,7 +801,7 @@ def deep_research_worker(cond: SearchConditions, item_categories: list[Dict[str,
     set_deep_research_status(cond.session_id, False)
 
 
-def deep_research(user_intent: str, tool_context: ToolContext) -> Dict[str, str]:
+async def deep_research(user_intent: str, tool_context: ToolContext):
     """
     Executes a deep research on the items for the user intent.
 
@@ -624,23 +813,28 @@ def deep_research(user_intent: str, tool_context: ToolContext) -> Dict[str, str]
             - "status": returns the following status:
                 - "success": tool finished
     """
-    tool_context.actions.skip_summarization = True
     session_id = tool_context.state[USER_SESSION_ID]
     user_uploaded_image = get_last_uploaded_image(session_id)
 
     # Avoid duplicated calls from the agent
     if get_deep_research_status(session_id):
-        return {
+        yield {
             "status": "success",
         }
+        return
     set_deep_research_status(session_id, True)
 
-    # Generate item categories
+    # Generate item categories (on the I/O pool)
+    loop = asyncio.get_running_loop()
     try:
-        item_categories = generate_item_categories(user_intent, user_uploaded_image)
+        item_categories = await loop.run_in_executor(
+            io_executor, generate_item_categories, user_intent, user_uploaded_image
+        )
     except JSONDecodeError:
         # Try one more time
-        item_categories = generate_item_categories(user_intent, user_uploaded_image)
+        item_categories = await loop.run_in_executor(
+            io_executor, generate_item_categories, user_intent, user_uploaded_image
+        )
     item_categories_str = ", ".join([f"{ic['item_category']}" for ic in item_categories])
     logging.info(
         "present_item_categories_to_user(): sent to client: %s", item_categories_str
@@ -656,12 +850,11 @@ def deep_research(user_intent: str, tool_context: ToolContext) -> Dict[str, str]
         query_rows=10,
     )
 
-    # Start deep research worker thread
-    thread = threading.Thread(
-        target=deep_research_worker,
-        args=(cond, item_categories),
-    )
-    thread.start()
+    # Start deep research task on the loop of the agent
+    find_items = find_items_async if ASYNC_PIPELINE else find_items_in_executor
+    task = asyncio.create_task(deep_research_async(cond, item_categories, find_items))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
     logging.info("deep_research(): finished starting queries.")
 
     # Add search history
@@ -672,7 +865,7 @@ def deep_research(user_intent: str, tool_context: ToolContext) -> Dict[str, str]
     logging.info(search_history)
 
     # Return a status
-    return {
+    yield {
         "item_categories": item_categories_str,
         "status": "started",
     }
@@ -24,7 +24,6 @@ import asyncio
 import uuid
 import time
 import traceback
-import threading
 import re
 from typing import Any, Dict, AsyncGenerator, Optional, TypedDict
 
@@ -43,6 +42,7 @@ from agents.sessions.in_memory_session_service import InMemorySessionService
 from agents.events import Event
 from shop_utils.gemini import generate_image
 from shop_utils.query import fetch_feature_values
+from shop_utils.executor import io_executor
 
 
 logging.basicConfig(level=logging.INFO)
@@ -309,15 +309,11 @@ async def send_message_to_agent(
             user_sessions[session_id][USER_SESSION_IS_AUDIO] = data["parameter"]
             raise ValueError("Audio mode is changed to: " + str(data["parameter"]))
         elif data["command"] == CMD_AGENT_GENERATE_IMAGE:
-            # Start a thread with generate_image_worker
+            # Start generate_image_worker on the I/O pool
             item_id = data["parameter"]
             user_uploaded_image = get_last_uploaded_image(session_id)
             if user_uploaded_image:
-                thread = threading.Thread(
-                    target=generate_image_worker,
-                    args=(item_id, user_uploaded_image, session_id),
-                )
-                thread.start()
+                io_executor.submit(generate_image_worker, item_id, user_uploaded_image, session_id)
 
             # Let the agent selling the item to the user
             items = fetch_feature_values([{"id": item_id}], ["name", "description"])
@@ -0,0 +1,132 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Benchmarks concurrent searches on the threaded pipeline (query.py, a thread per session as on
+the search pool of find_shopping_items) against the asyncio pipeline (async_query.py, a task
+per session on one loop): session latency, max threads and peak RSS. Each mode is measured in
+a fresh subprocess.
+Requires access to the Vertex AI resources in query.py.
+
+Usage:
+    python3 -m shop_bench.bench_async_pipeline --sessions 50
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import subprocess
+
+from shop_bench.bench_utils import SAMPLE_QUERIES, ThreadCountSampler, get_rss_kb, percentile_ms
+from shop_utils.deadline import Deadline
+from shop_utils.query import run_queries, filter_and_rerank_items
+from shop_utils.async_query import run_queries_async, filter_and_rerank_items_async
+
+FEATURE_NAMES = ["id", "name", "description"]
+QUERIES_PER_SESSION = 4
+
+
+def get_session_queries(session: int) -> list[str]:
+    """Returns the queries of a session (rotating over the sample queries)"""
+    start = session * QUERIES_PER_SESSION
+    return [SAMPLE_QUERIES[(start + i) % len(SAMPLE_QUERIES)] for i in range(QUERIES_PER_SESSION)]
+
+
+def run_threaded(sessions: int, deadline: float) -> list[float]:
+    """Runs a search per session in a thread and returns the session latencies"""
+    latencies = [0.0] * sessions
+
+    def run_session(session):
+        start_time = time.perf_counter()
+        queries = get_session_queries(session)
+        session_deadline = Deadline(deadline)
+        items = run_queries(queries, FEATURE_NAMES, 100 // len(queries), session_deadline)
+        filter_and_rerank_items(queries[0], queries[0], items, None, session_deadline)
+        latencies[session] = time.perf_counter() - start_time
+
+    threads = [threading.Thread(target=run_session, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+async def run_async(sessions: int, deadline: float) -> list[float]:
+    """Runs a search per session as a task and returns the session latencies"""
+
+    async def run_session(session):
+        start_time = time.perf_counter()
+        queries = get_session_queries(session)
+        session_deadline = Deadline(deadline)
+        items = await run_queries_async(
+            queries, FEATURE_NAMES, 100 // len(queries), session_deadline
+        )
+        await filter_and_rerank_items_async(queries[0], queries[0], items, None, session_deadline)
+        return time.perf_counter() - start_time
+
+    return await asyncio.gather(*(run_session(i) for i in range(sessions)))
+
+
+def run_mode(mode: str, sessions: int, deadline: float) -> dict:
+    """Runs the sessions concurrently in the mode (run in a subprocess)"""
+    rss_before = get_rss_kb()
+    start_time = time.perf_counter()
+    with ThreadCountSampler() as sampler:
+        if mode == "threaded":
+            latencies = run_threaded(sessions, deadline)
+        else:
+            latencies = asyncio.run(run_async(sessions, deadline))
+    return {
+        "mode": mode,
+        "sessions": sessions,
+        "wall_sec": time.perf_counter() - start_time,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+        "max_threads": sampler.max_count,
+        "peak_rss_increase_mb": (sampler.max_rss_kb - rss_before) / 1024,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--deadline", type=float, default=10.0)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # in the subprocess
+        print(json.dumps(run_mode(args.mode, args.sessions, args.deadline)))
+    else:
+        for mode_name in ["threaded", "asyncio"]:
+            output = subprocess.run(
+                [sys.executable, "-m", "shop_bench.bench_async_pipeline"]
+                + ["--sessions", str(args.sessions), "--deadline", str(args.deadline)]
+                + ["--mode", mode_name],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                ", ".join(
+                    f"{k}: {v:.2f}" if isinstance(v, float) else f"{k}: {v}"
+                    for k, v in result.items()
+                )
+            )
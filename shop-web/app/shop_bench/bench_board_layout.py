@@ -0,0 +1,350 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Benchmarks the image board layouts of the multimodal filtering: for each layout and batch size,
+the Gemini calls per search, the image download (--cdn) and board render time, the request
+bytes, the Gemini and search latency (the boards of a search run in parallel), and the
+agreement of the selected items with the first layout (Jaccard, and the share of its
+selections kept).
+
+The candidates of the sample queries are sampled from a catalog snapshot (--catalog-dir) or
+generated, with generated tile images (or the CDN images with --cdn). Gemini is one of:
+    fake: latency modeled from the input and output tokens, deterministic selection (no
+          agreement), runs offline
+    live: calls Gemini (requires access to the Vertex AI resources in query.py), and saves the
+          responses to --record
+    replay: replays the responses saved by live (--record), with the same items and seed
+
+Usage:
+    python3 -m shop_bench.bench_board_layout --layouts 5x5@200 4x4@250 6x6@160 7x7@140
+    python3 -m shop_bench.bench_board_layout --gemini live --record ./board_layouts.jsonl \\
+        --catalog-dir ./catalog --cdn
+    python3 -m shop_bench.bench_board_layout --gemini replay --record ./board_layouts.jsonl \\
+        --catalog-dir ./catalog --cdn
+"""
+
+import io
+import json
+import time
+import hashlib
+import argparse
+from typing import Any
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from shop_bench.bench_utils import SAMPLE_QUERIES, percentile_ms
+from shop_utils.catalog import Catalog
+from shop_utils.image_utils import (
+    BoardLayout,
+    number_items,
+    submit_item_image_downloads,
+    render_item_image_board,
+)
+from shop_utils.item_selection import (
+    ITEM_SELECTION_CONFIG,
+    build_multimodal_contents,
+    select_items,
+)
+
+IMAGE_TOKENS_PER_TILE = 258  # Gemini image tokens per 768 x 768 tile (or a small image)
+IMAGE_TOKEN_TILE = 768
+SMALL_IMAGE_SIZE = 384  # images up to this size are a single tile
+OUTPUT_TOKENS_PER_ITEM = 4  # a selected item number in the JSON response
+
+
+def get_image_tokens(width: int, height: int) -> int:
+    """Returns the Gemini input tokens of an image"""
+    if width <= SMALL_IMAGE_SIZE and height <= SMALL_IMAGE_SIZE:
+        return IMAGE_TOKENS_PER_TILE
+    return IMAGE_TOKENS_PER_TILE * -(-width // IMAGE_TOKEN_TILE) * -(-height // IMAGE_TOKEN_TILE)
+
+
+def get_request_bytes(contents: list[Any]) -> int:
+    """Returns the bytes of the inline images and the prompts of the contents"""
+    return sum(
+        len(content.encode("utf-8")) if isinstance(content, str) else len(content.inline_data.data)
+        for content in contents
+    )
+
+
+def stable_hash(*values: str) -> int:
+    """Returns a hash of the values that doesn't change between runs"""
+    return int.from_bytes(hashlib.sha256("\n".join(values).encode("utf-8")).digest()[:8], "big")
+
+
+def generate_item_image(item_id: str, tile_size: int) -> bytes:
+    """Generates a JPEG tile image for the item (shapes with colors from the item id)"""
+    rng = np.random.default_rng(stable_hash(item_id))
+    image = Image.new("RGB", (400, 400), tuple(int(v) for v in rng.integers(128, 256, 3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(8):
+        x0, y0 = (int(v) for v in rng.integers(0, 300, 2))
+        x1, y1 = x0 + int(rng.integers(40, 200)), y0 + int(rng.integers(40, 200))
+        draw.ellipse((x0, y0, x1, y1), fill=tuple(int(v) for v in rng.integers(0, 256, 3)))
+    image = image.resize((tile_size, tile_size))
+    image_bytes = io.BytesIO()
+    image.save(image_bytes, format="JPEG", quality=85)
+    return image_bytes.getvalue()
+
+
+class FakeGemini:
+    """Selects the items by a hash of the query and item id, with a modeled latency"""
+
+    def __init__(
+        self,
+        select_rate: float,
+        base_ms: float,
+        input_token_ms: float,
+        output_token_ms: float,
+        sigma: float,
+        seed: int,
+    ):
+        self.select_rate = select_rate
+        self.base_ms = base_ms
+        self.input_token_ms = input_token_ms
+        self.output_token_ms = output_token_ms
+        self.sigma = sigma
+        self.rng = np.random.default_rng(seed)
+
+    def select(self, query, layout, items, contents) -> tuple[list[dict[str, Any]], float]:
+        """Returns the selected items and the latency in secs"""
+        selected_items = [
+            item
+            for item in items
+            if stable_hash(query, item["id"]) % 1000 < self.select_rate * 1000
+        ]
+        prompt_bytes = sum(len(content) for content in contents if isinstance(content, str))
+        input_tokens = get_image_tokens(*layout.size) + prompt_bytes // 4
+        output_tokens = OUTPUT_TOKENS_PER_ITEM * len(selected_items)
+        latency_ms = (
+            self.base_ms
+            + self.input_token_ms * input_tokens
+            + self.output_token_ms * output_tokens
+        ) * self.rng.lognormal(0, self.sigma)
+        return selected_items, latency_ms / 1000
+
+
+class LiveGemini:
+    """Calls Gemini and saves the responses"""
+
+    def __init__(self, record_path: str):
+        # pylint: disable=import-outside-toplevel
+        from shop_utils.query import GEMINI_MODEL, gemini_client
+
+        self.model = GEMINI_MODEL
+        self.client = gemini_client
+        self.record_file = open(record_path, "a", encoding="utf-8") if record_path else None
+
+    def select(self, query, layout, items, contents) -> tuple[list[dict[str, Any]], float]:
+        """Returns the selected items and the latency in secs"""
+        start_time = time.perf_counter()
+        response = self.client.models.generate_content(
+            model=self.model, contents=contents, config=ITEM_SELECTION_CONFIG
+        )
+        latency = time.perf_counter() - start_time
+        selected_items = select_items(items, response.text)
+        if self.record_file:
+            record = {
+                "layout": str(layout),
+                "query": query,
+                "ids": [item["id"] for item in items],
+                "selected": [item["id"] for item in selected_items],
+                "latency": latency,
+            }
+            self.record_file.write(json.dumps(record) + "\n")
+            self.record_file.flush()
+        return selected_items, latency
+
+
+class RecordedGemini:
+    """Replays the responses saved by LiveGemini (the last one of each request)"""
+
+    def __init__(self, record_path: str):
+        self.records = {}
+        with open(record_path, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                key = (record["layout"], record["query"], tuple(record["ids"]))
+                self.records[key] = record
+        self.missing_count = 0
+
+    def select(self, query, layout, items, contents) -> tuple[list[dict[str, Any]], float]:
+        """Returns the selected items and the latency in secs (none if not recorded)"""
+        record = self.records.get((str(layout), query, tuple(item["id"] for item in items)))
+        if record is None:
+            self.missing_count += 1
+            return [], 0.0
+        selected_ids = set(record["selected"])
+        return [item for item in items if item["id"] in selected_ids], record["latency"]
+
+
+def sample_items(query: str, size: int, catalog, catalog_ids, rng) -> list[dict[str, Any]]:
+    """Returns the candidate items of a query from the catalog (or generated)"""
+    if catalog is not None:
+        sample_ids = [catalog_ids[i] for i in rng.choice(len(catalog_ids), size, replace=False)]
+        return list(catalog.fetch(sample_ids, ["name", "description"]).values())
+    return [
+        {
+            "id": f"m{stable_hash(query, str(i)) % 10**11:011d}",
+            "name": f"{query} {i}",
+            "description": f"{query} in good condition, item {i}. " * 5,
+        }
+        for i in range(size)
+    ]
+
+
+def get_item_images(
+    items: list[dict[str, Any]], layout: BoardLayout, use_cdn: bool
+) -> list[bytes]:
+    """Numbers the items and downloads (or generates) their images"""
+    if use_cdn:
+        return submit_item_image_downloads(items, layout).result()
+    number_items(items)
+    return [generate_item_image(item["id"], layout.tile_size) for item in items]
+
+
+def run_benchmark(
+    layout: BoardLayout, batch_size: int, queries, gemini, use_cdn: bool
+) -> dict[str, set[str]]:
+    """Filters the candidates of the queries with the layout, prints the stats, and returns
+    the selected ids by query"""
+    download_times, render_times, request_bytes, gemini_latencies = [], [], [], []
+    search_latencies, calls = [], []
+    selected_ids = {}
+    for query, items in queries:
+        batches = [items[i : i + batch_size] for i in range(0, len(items), batch_size)]
+        batch_latencies = []
+        selected_ids[query] = set()
+        for batch in batches:
+            batch = [dict(item) for item in batch]
+            start_time = time.perf_counter()
+            item_images = get_item_images(batch, layout, use_cdn)
+            download_time = time.perf_counter() - start_time if use_cdn else 0.0
+            start_time = time.perf_counter()
+            item_image_board = render_item_image_board(batch, item_images, layout)
+            contents = build_multimodal_contents(
+                query, query, batch, item_image_board, None, layout.mime_type
+            )
+            render_time = time.perf_counter() - start_time
+            selected_items, latency = gemini.select(query, layout, batch, contents)
+            selected_ids[query].update(item["id"] for item in selected_items)
+            download_times.append(download_time)
+            render_times.append(render_time)
+            request_bytes.append(get_request_bytes(contents))
+            gemini_latencies.append(latency)
+            batch_latencies.append(download_time + render_time + latency)
+        calls.append(len(batches))
+        search_latencies.append(max(batch_latencies))
+    print(
+        f"layout: {layout}, batch: {batch_size}, board: {layout.size[0]}x{layout.size[1]}, "
+        + f"calls/search: {np.mean(calls):.2f}, "
+        + f"download p50: {percentile_ms(download_times, 50):.0f} ms, "
+        + f"render p50: {percentile_ms(render_times, 50):.1f} ms, "
+        + f"request p50: {np.median(request_bytes) / 1024:.1f} KB, "
+        + f"bytes/search: {sum(request_bytes) / len(queries) / 1024:.1f} KB, "
+        + f"gemini p50: {percentile_ms(gemini_latencies, 50):.0f} ms, "
+        + f"p99: {percentile_ms(gemini_latencies, 99):.0f} ms, "
+        + f"search p50: {percentile_ms(search_latencies, 50):.0f} ms, "
+        + f"p99: {percentile_ms(search_latencies, 99):.0f} ms"
+    )
+    return selected_ids
+
+
+def print_agreement(
+    layout: BoardLayout, selected_ids: dict[str, set[str]], base_ids: dict[str, set[str]]
+) -> None:
+    """Prints the agreement of the selected ids with the ones of the first layout"""
+    jaccards, kept = [], []
+    for query, base in base_ids.items():
+        selected = selected_ids[query]
+        union = base | selected
+        jaccards.append(len(base & selected) / len(union) if union else 1.0)
+        kept.append(len(base & selected) / len(base) if base else 1.0)
+    print(
+        f"    agreement with the first layout: jaccard: {np.mean(jaccards):.3f}, "
+        + f"kept: {np.mean(kept):.3f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--layouts",
+        nargs="+",
+        default=["5x5@200", "4x4@250", "6x6@160", "7x7@140"],
+        help="<columns>x<rows>@<tile px>[q<JPEG quality>], the first one is the baseline",
+    )
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", help="items per call of each layout (capacity)"
+    )
+    parser.add_argument("--gemini", default="fake", choices=["fake", "live", "replay"])
+    parser.add_argument("--record", help="JSON lines of the live responses")
+    parser.add_argument("--items", type=int, default=100, help="candidates per query")
+    parser.add_argument("--queries", type=int, default=len(SAMPLE_QUERIES))
+    parser.add_argument("--rounds", type=int, default=5, help="rounds of the queries (fake)")
+    parser.add_argument("--catalog-dir")
+    parser.add_argument("--cdn", action="store_true", help="download the item images")
+    parser.add_argument("--select-rate", type=float, default=0.3)
+    parser.add_argument("--base-ms", type=float, default=500.0)
+    parser.add_argument("--input-token-ms", type=float, default=0.1)
+    parser.add_argument("--output-token-ms", type=float, default=5.0)
+    parser.add_argument("--sigma", type=float, default=0.3, help="lognormal latency jitter")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    layouts = [BoardLayout.parse(spec) for spec in args.layouts]
+    batch_sizes = args.batch_sizes or [layout.capacity for layout in layouts]
+    if args.gemini == "fake":
+        bench_gemini = FakeGemini(
+            args.select_rate,
+            args.base_ms,
+            args.input_token_ms,
+            args.output_token_ms,
+            args.sigma,
+            args.seed,
+        )
+    elif args.gemini == "live":
+        bench_gemini = LiveGemini(args.record)
+    else:
+        bench_gemini = RecordedGemini(args.record)
+
+    # sample the candidates once, so all layouts (and a replay) filter the same items
+    bench_rng = np.random.default_rng(args.seed)
+    bench_catalog, bench_catalog_ids = None, None
+    if args.catalog_dir:
+        bench_catalog = Catalog(args.catalog_dir)
+        bench_catalog_ids = [
+            item_id.decode("utf-8") for item_id in bench_catalog.sorted_ids[:1000000]
+        ]
+    rounds = args.rounds if args.gemini == "fake" else 1
+    bench_queries = [
+        (query, sample_items(query, args.items, bench_catalog, bench_catalog_ids, bench_rng))
+        for query in SAMPLE_QUERIES[: args.queries]
+    ] * rounds
+
+    base_selected_ids = None
+    for bench_layout, bench_batch_size in zip(layouts, batch_sizes):
+        bench_batch_size = min(bench_batch_size, bench_layout.capacity)
+        layout_selected_ids = run_benchmark(
+            bench_layout, bench_batch_size, bench_queries, bench_gemini, args.cdn
+        )
+        if base_selected_ids is None:
+            base_selected_ids = layout_selected_ids
+        elif args.gemini != "fake":
+            print_agreement(bench_layout, layout_selected_ids, base_selected_ids)
+    if args.gemini == "replay" and bench_gemini.missing_count:
+        print(f"requests not recorded: {bench_gemini.missing_count}")
@@ -0,0 +1,221 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Benchmarks the image board rendering on generated item images (--source-size px JPEGs, as
+returned by the CDN, or larger to exercise the draft mode decoding). For each layout, prints
+the CPU time per board on one thread, the boards per sec with --concurrency threads, and the
+encoded board size:
+
+    baseline: a tile image per item with the label drawn by ImageDraw, pasted on a new board
+        and JPEG encoded (as before the renderer, with the item images fit in the tiles)
+    renderer: draft mode decoding, label sprites and a reused canvas (render_board)
+    processes: the renderer on --processes render processes (boards/sec only, the CPU time
+        is spent in the workers)
+
+With --check, compares the boards of the baseline and the renderer at quality 95 instead, on
+square and non-square (landscape and portrait) item images, and fails if they differ by more
+than --max-diff on average (8-bit levels).
+
+Usage:
+    python3 -m shop_bench.bench_board_render --layouts 5x5@200q75 5x5@200q75/webp
+    python3 -m shop_bench.bench_board_render --check
+"""
+
+import io
+import sys
+import time
+import argparse
+import dataclasses
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageOps
+
+from shop_bench.bench_board_layout import generate_item_image
+from shop_utils.image_utils import (
+    BoardLayout,
+    BOARD_BG_COLOR,
+    PLACEHOLDER_COLOR,
+    get_label_font,
+    render_board,
+)
+
+MODES = ["baseline", "renderer", "processes"]
+CHECK_SOURCE_SIZES = [(200, 200), (300, 200), (200, 320), (800, 450)]  # (width, height) px
+
+
+def draw_item_tile_baseline(item_number: str, item_image_bytes: bytes, layout: BoardLayout):
+    """Draws an item tile (as draw_item_tile did before the renderer)"""
+    tile_size = (layout.tile_size, layout.tile_size)
+    if item_image_bytes:
+        item_image = Image.open(io.BytesIO(item_image_bytes)).convert("RGB")
+        if item_image.size != tile_size:
+            image_tile = Image.new("RGB", tile_size, BOARD_BG_COLOR)
+            item_image = ImageOps.contain(item_image, tile_size)
+            image_tile.paste(
+                item_image,
+                ((tile_size[0] - item_image.width) // 2, (tile_size[1] - item_image.height) // 2),
+            )
+            item_image = image_tile
+    else:
+        item_image = Image.new("RGB", tile_size, PLACEHOLDER_COLOR)
+    label_font = get_label_font(layout.tile_size)
+    label_scale = label_font.size / 32
+    label_bg = Image.new("RGB", (round(60 * label_scale), round(40 * label_scale)), (230, 230, 230))
+    item_image.paste(label_bg, (0, 0))
+    draw = ImageDraw.Draw(item_image)
+    draw.text((0, 0), f"#{item_number}", font=label_font, fill=(0, 0, 0))
+    return item_image
+
+
+def render_board_baseline(
+    item_numbers: list[str], item_images: list[bytes], layout: BoardLayout
+) -> bytes:
+    """Draws the tiles, pastes them on a new board and encodes it (as before the renderer)"""
+    image_tiles = [
+        draw_item_tile_baseline(item_number, item_image_bytes, layout)
+        for item_number, item_image_bytes in zip(item_numbers, item_images)
+    ]
+    image_board = Image.new("RGB", layout.size, BOARD_BG_COLOR)
+    for y in range(0, layout.rows):
+        for x in range(0, layout.columns):
+            if len(image_tiles) > 0:
+                image_board.paste(image_tiles.pop(0), (x * layout.tile_size, y * layout.tile_size))
+    image_bytes = io.BytesIO()
+    image_board.save(image_bytes, format="JPEG", quality=layout.quality)
+    return image_bytes.getvalue()
+
+
+def generate_boards(layout: BoardLayout, args) -> list[list[bytes]]:
+    """Generates the item images of args.boards distinct boards"""
+    return [
+        [
+            generate_item_image(f"m{board_index:06d}{i:04d}", args.source_size or layout.tile_size)
+            for i in range(layout.capacity)
+        ]
+        for board_index in range(args.boards)
+    ]
+
+
+def generate_source_image(item_id: str, size: tuple[int, int]) -> bytes:
+    """Generates a JPEG item image of the size (width, height)"""
+    image = Image.open(io.BytesIO(generate_item_image(item_id, max(size)))).resize(size)
+    image_bytes = io.BytesIO()
+    image.save(image_bytes, format="JPEG", quality=85)
+    return image_bytes.getvalue()
+
+
+def check_boards(layout: BoardLayout, args) -> bool:
+    """
+    Compares the boards of the baseline and the renderer on each source size, and returns
+    whether they all match (mean difference up to args.max_diff)
+    """
+    layout = dataclasses.replace(layout, quality=95, image_format="JPEG", subsampling="4:2:0")
+    item_numbers = [str(i) for i in range(layout.capacity)]
+    matched = True
+    for size in CHECK_SOURCE_SIZES:
+        item_images = [
+            generate_source_image(f"m{i:010d}", size) for i in range(layout.capacity - 1)
+        ] + [None]  # and a placeholder
+        boards = [
+            np.asarray(Image.open(io.BytesIO(render(item_numbers, item_images, layout))))
+            for render in (render_board_baseline, render_board)
+        ]
+        diff = np.abs(boards[0].astype(np.int16) - boards[1].astype(np.int16))
+        matched = matched and diff.mean() <= args.max_diff
+        print(
+            f"{str(layout):>18} {size[0]}x{size[1]}: mean diff: {diff.mean():.3f}, "
+            + f"max diff: {diff.max()}, {'ok' if diff.mean() <= args.max_diff else 'MISMATCH'}"
+        )
+    return matched
+
+
+def run_benchmark(layout: BoardLayout, args, process_pool: ProcessPoolExecutor) -> None:
+    """Renders the boards in each mode and prints the stats"""
+    boards = generate_boards(layout, args)
+    item_numbers = [str(i) for i in range(layout.capacity)]
+    render_functions = {"baseline": render_board_baseline, "renderer": render_board}
+    for mode in args.modes:
+        if mode == "baseline" and (layout.image_format != "JPEG" or layout.subsampling != "4:2:0"):
+            continue  # the baseline only encodes the default JPEG
+        cpu_times, board_bytes = [], []
+        if mode != "processes":
+            for item_images in boards:
+                start_time = time.process_time()
+                board_data = render_functions[mode](item_numbers, item_images, layout)
+                cpu_times.append(time.process_time() - start_time)
+                board_bytes.append(len(board_data))
+
+        if mode == "processes":
+            # start the workers and their canvases
+            warm_futures = [
+                process_pool.submit(render_board, item_numbers, boards[0], layout)
+                for _ in range(args.processes)
+            ]
+            wait(warm_futures)
+        start_time = time.perf_counter()
+        if mode == "processes":
+            futures = [
+                process_pool.submit(render_board, item_numbers, item_images, layout)
+                for item_images in boards
+            ]
+            board_bytes = [len(future.result()) for future in futures]
+        else:
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                list(
+                    executor.map(
+                        lambda item_images: render_functions[mode](
+                            item_numbers, item_images, layout
+                        ),
+                        boards,
+                    )
+                )
+        throughput = len(boards) / (time.perf_counter() - start_time)
+
+        cpu_time = f"{np.mean(cpu_times) * 1000:.1f} ms" if cpu_times else "-"
+        print(
+            f"{str(layout):>18} {mode:>9}: cpu/board: {cpu_time}, "
+            + f"boards/sec: {throughput:.1f}, "
+            + f"board p50: {np.median(board_bytes) / 1024:.1f} KB"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--layouts",
+        nargs="+",
+        default=["5x5@200q75", "5x5@200q75/jpeg444", "5x5@200q60", "5x5@200q75/webp"],
+    )
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--boards", type=int, default=50)
+    parser.add_argument("--source-size", type=int, default=0, help="px (0: the tile size)")
+    parser.add_argument("--concurrency", type=int, default=4, help="threads rendering boards")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--check", action="store_true", help="compare baseline and renderer")
+    parser.add_argument("--max-diff", type=float, default=1.0, help="mean diff for --check")
+    args = parser.parse_args()
+
+    if args.check:
+        results = [check_boards(BoardLayout.parse(layout), args) for layout in args.layouts]
+        sys.exit(0 if all(results) else 1)
+
+    with ProcessPoolExecutor(
+        args.processes, mp_context=multiprocessing.get_context("forkserver")
+    ) as render_pool:
+        for bench_layout in args.layouts:
+            run_benchmark(BoardLayout.parse(bench_layout), args, render_pool)
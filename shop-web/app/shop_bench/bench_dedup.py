@@ -0,0 +1,127 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks the LSH near-duplicate detector against comparing all pairs with Levenshtein
+distance (the original dedup_items), and reports how often the two agree. Descriptions are
+sampled from a catalog snapshot (--catalog-dir) or generated, and near-duplicates are added
+by re-posting descriptions with a few random character edits.
+
+Usage:
+    python3 -m shop_bench.bench_dedup --sizes 100 1000 10000 --catalog-dir ./catalog
+"""
+
+import time
+import random
+import string
+import argparse
+
+from shop_utils.catalog import Catalog
+from shop_utils.dedup import (
+    DEFAULT_MAX_DIST,
+    NearDuplicateDetector,
+    dedup_texts_bruteforce,
+    normalize_description,
+)
+
+DUPLICATE_RATE = 0.3
+MAX_EDITS = 2 * DEFAULT_MAX_DIST  # half of the re-posts are within the default distance
+
+
+def generate_descriptions(count: int, rng: random.Random) -> list[str]:
+    """Generates descriptions from random words (10% short ones)"""
+    words = [
+        "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+        for _ in range(5000)
+    ]
+    descriptions = []
+    for _ in range(count):
+        word_count = rng.randint(1, 4) if rng.random() < 0.1 else rng.randint(10, 80)
+        descriptions.append(" ".join(rng.choice(words) for _ in range(word_count)))
+    return descriptions
+
+
+def edit_text(text: str, edits: int, rng: random.Random) -> str:
+    """Applies random character insertions, deletions and substitutions"""
+    chars = list(text)
+    for _ in range(edits):
+        pos = rng.randint(0, len(chars))
+        op = rng.choice(["insert", "delete", "substitute"]) if pos < len(chars) else "insert"
+        if op == "insert":
+            chars.insert(pos, rng.choice(string.ascii_lowercase))
+        elif op == "delete":
+            del chars[pos]
+        else:
+            chars[pos] = rng.choice(string.ascii_lowercase)
+    return "".join(chars)
+
+
+def add_duplicates(descriptions: list[str], rng: random.Random) -> list[str]:
+    """Replaces DUPLICATE_RATE of the descriptions with edited re-posts of earlier ones"""
+    result = list(descriptions)
+    for i in range(1, len(result)):
+        if rng.random() < DUPLICATE_RATE:
+            result[i] = edit_text(result[rng.randrange(i)], rng.randint(0, MAX_EDITS), rng)
+    return result
+
+
+def run_benchmark(texts: list[str], detector: NearDuplicateDetector, max_bruteforce: int) -> None:
+    """Runs both implementations and prints the latency and agreement"""
+    start_time = time.perf_counter()
+    lsh_kept = detector.dedup(texts)
+    lsh_time = time.perf_counter() - start_time
+    line = f"items: {len(texts)}, lsh: {lsh_time * 1000:.1f} ms, kept: {len(lsh_kept)}"
+
+    if len(texts) <= max_bruteforce:
+        start_time = time.perf_counter()
+        bruteforce_kept = dedup_texts_bruteforce(texts, detector.max_dist)
+        bruteforce_time = time.perf_counter() - start_time
+        lsh_set, bruteforce_set = set(lsh_kept), set(bruteforce_kept)
+        agreed = sum((i in lsh_set) == (i in bruteforce_set) for i in range(len(texts)))
+        line += (
+            f", bruteforce: {bruteforce_time * 1000:.1f} ms, kept: {len(bruteforce_kept)}"
+            + f", speedup: {bruteforce_time / lsh_time:.1f}x"
+            + f", agreement: {agreed / len(texts) * 100:.2f}%"
+            + f", missed duplicates: {len(lsh_set - bruteforce_set)}"
+            + f", extra duplicates: {len(bruteforce_set - lsh_set)}"
+        )
+    print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 200, 1000, 10000])
+    parser.add_argument("--max-dist", type=int, default=DEFAULT_MAX_DIST)
+    parser.add_argument("--max-bruteforce", type=int, default=2000)
+    parser.add_argument("--catalog-dir")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    bench_rng = random.Random(args.seed)
+    bench_detector = NearDuplicateDetector(max_dist=args.max_dist)
+    if args.catalog_dir:
+        catalog = Catalog(args.catalog_dir)
+        catalog_ids = [item_id.decode("utf-8") for item_id in catalog.sorted_ids[:1000000]]
+    for size in args.sizes:
+        if args.catalog_dir:
+            sample = catalog.fetch(bench_rng.sample(catalog_ids, size), ["description"])
+            base_descriptions = [features["description"] for features in sample.values()]
+        else:
+            base_descriptions = generate_descriptions(size, bench_rng)
+        descriptions = add_duplicates(base_descriptions, bench_rng)
+        run_benchmark(
+            [normalize_description(desc) for desc in descriptions],
+            bench_detector,
+            args.max_bruteforce,
+        )
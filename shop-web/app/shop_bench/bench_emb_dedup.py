@@ -0,0 +1,93 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Benchmarks the embedding-similarity dedup stage (dedup_by_embeddings) for typical candidate
+counts: latency percentiles, cost per compared pair and the number of kept items. Embeddings
+are sampled from a catalog snapshot (--catalog-dir) or generated, and near-duplicates are
+added by re-posting embeddings with a little noise.
+
+Usage:
+    python3 -m shop_bench.bench_emb_dedup --sizes 100 200 500 1000 --catalog-dir ./catalog
+"""
+
+import time
+import argparse
+
+import numpy as np
+
+from shop_bench.bench_utils import percentile_ms
+from shop_utils.catalog import Catalog
+from shop_utils.dedup import DEFAULT_MIN_COSINE, dedup_by_embeddings
+
+DUPLICATE_RATE = 0.3
+DUPLICATE_NOISE = 0.05  # relative noise of a re-post (cosine ~0.999)
+
+
+def add_duplicates(embs: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Replaces DUPLICATE_RATE of the embeddings with noisy copies of earlier ones"""
+    result = embs.copy()
+    for i in range(1, len(result)):
+        if rng.random() < DUPLICATE_RATE:
+            source = result[rng.integers(i)]
+            noise = rng.standard_normal(len(source)) * np.linalg.norm(source) / len(source) ** 0.5
+            result[i] = source + DUPLICATE_NOISE * noise
+    return result
+
+
+def run_benchmark(embs: np.ndarray, min_cosine: float, rounds: int) -> None:
+    """Runs dedup_by_embeddings and prints the latency"""
+    found = np.ones(len(embs), dtype=bool)
+    latencies = []
+    for _ in range(rounds):
+        start_time = time.perf_counter()
+        kept = dedup_by_embeddings(embs, found, min_cosine)
+        latencies.append(time.perf_counter() - start_time)
+    pair_count = len(embs) * (len(embs) - 1) // 2
+    print(
+        f"items: {len(embs)}, dim: {embs.shape[1]}, "
+        + f"p50: {percentile_ms(latencies, 50):.2f} ms, "
+        + f"p95: {percentile_ms(latencies, 95):.2f} ms, "
+        + f"per pair: {np.median(latencies) / max(pair_count, 1) * 1e9:.1f} ns, "
+        + f"kept: {len(kept)}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 200, 500, 1000])
+    parser.add_argument("--dims", type=int, nargs="+", default=[768, 1408])
+    parser.add_argument("--min-cosine", type=float, default=DEFAULT_MIN_COSINE)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--catalog-dir")
+    parser.add_argument("--column", default="mm")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    bench_rng = np.random.default_rng(args.seed)
+    if args.catalog_dir:
+        catalog = Catalog(args.catalog_dir)
+        catalog_embs, catalog_mask = catalog.embeddings[args.column]
+        catalog_rows = np.flatnonzero(catalog_mask[:1000000])
+    for size in args.sizes:
+        if args.catalog_dir:
+            sample_rows = np.sort(bench_rng.choice(catalog_rows, size, replace=False))
+            base_embs_list = [np.asarray(catalog_embs[sample_rows], dtype=np.float32)]
+        else:
+            base_embs_list = [
+                bench_rng.standard_normal((size, dim)).astype(np.float32) for dim in args.dims
+            ]
+        for base_embs in base_embs_list:
+            run_benchmark(add_duplicates(base_embs, bench_rng), args.min_cosine, args.rounds)
@@ -0,0 +1,158 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks FeatureFetcher with one request for all keys, chunked requests over one stream,
+and chunked requests over parallel streams. The Feature Store is replaced by a local gRPC
+server that answers StreamingFetchFeatureValues with a latency of base + per key.
+With --catalog-dir, the local catalog snapshot (shop_utils/catalog.py) is measured as well.
+
+Usage:
+    python3 -m shop_bench.bench_feature_store --keys 100 500 2000
+"""
+
+import time
+import random
+import argparse
+from typing import Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+import numpy as np
+from google.cloud.aiplatform_v1beta1 import FeatureOnlineStoreServiceClient
+from google.cloud.aiplatform_v1beta1.services.feature_online_store_service.transports.grpc import (
+    FeatureOnlineStoreServiceGrpcTransport,
+)
+from google.cloud.aiplatform_v1beta1.types import (
+    feature_online_store_service as feature_online_store_service_pb2,
+)
+
+from shop_utils.feature_store import FeatureFetcher
+from shop_utils.catalog import Catalog
+
+SERVICE_NAME = "google.cloud.aiplatform.v1beta1.FeatureOnlineStoreService"
+FEATURE_NAMES = ["name", "description"]
+FEATURE_VIEW_PATH = "projects/bench/locations/local/featureOnlineStores/bench/featureViews/bench"
+
+
+def start_server(base_ms: float, per_key_ms: float) -> tuple[grpc.Server, str]:
+    """Starts a local StreamingFetchFeatureValues stand-in and returns (server, address)"""
+
+    def streaming_fetch_feature_values(request_iterator, context):
+        # answer the requests of a stream one by one, like a bidirectional stream
+        for request in request_iterator:
+            time.sleep((base_ms + per_key_ms * len(request.data_keys)) / 1000)
+            yield feature_online_store_service_pb2.StreamingFetchFeatureValuesResponse(
+                data=[
+                    {
+                        "data_key": {"key": data_key.key},
+                        "key_values": {
+                            "features": [
+                                {
+                                    "name": name,
+                                    "value": {"string_value": f"{name} of {data_key.key}"},
+                                }
+                                for name in FEATURE_NAMES
+                            ]
+                        },
+                    }
+                    for data_key in request.data_keys
+                ]
+            )
+
+    server = grpc.server(ThreadPoolExecutor(max_workers=32))
+    server.add_generic_rpc_handlers(
+        (
+            grpc.method_handlers_generic_handler(
+                SERVICE_NAME,
+                {
+                    "StreamingFetchFeatureValues": grpc.stream_stream_rpc_method_handler(
+                        streaming_fetch_feature_values,
+                        request_deserializer=(
+                            feature_online_store_service_pb2.StreamingFetchFeatureValuesRequest.deserialize
+                        ),
+                        response_serializer=(
+                            feature_online_store_service_pb2.StreamingFetchFeatureValuesResponse.serialize
+                        ),
+                    )
+                },
+            ),
+        )
+    )
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    return server, f"127.0.0.1:{port}"
+
+
+def run_benchmark(
+    label: str, fetcher: Any, key_count: int, rounds: int, item_ids: Optional[list[str]] = None
+) -> None:
+    """Fetches key_count items for the rounds and prints the latency stats"""
+    latencies = []
+    first_chunk_latencies = []
+    for r in range(rounds):
+        if item_ids:
+            items = [{"id": item_id} for item_id in random.sample(item_ids, key_count)]
+        else:
+            items = [{"id": f"item_{r}_{i}"} for i in range(key_count)]
+        start_time = time.perf_counter()
+        first_chunk_latency = None
+        fetched_count = 0
+        for items_with_features in fetcher.iter_feature_values(items, FEATURE_NAMES):
+            if first_chunk_latency is None:
+                first_chunk_latency = time.perf_counter() - start_time
+            fetched_count += len(items_with_features)
+        latencies.append(time.perf_counter() - start_time)
+        first_chunk_latencies.append(first_chunk_latency)
+        assert fetched_count == key_count, fetched_count
+    print(
+        f"{label}: keys: {key_count}, "
+        + f"p50: {np.percentile(latencies, 50) * 1000:.0f} ms, "
+        + f"p99: {np.percentile(latencies, 99) * 1000:.0f} ms, "
+        + f"first chunk p50: {np.percentile(first_chunk_latencies, 50) * 1000:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--chunk-size", type=int, default=100)
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--base-ms", type=float, default=20.0)
+    parser.add_argument("--per-key-ms", type=float, default=0.2)
+    parser.add_argument("--catalog-dir")
+    args = parser.parse_args()
+
+    bench_server, address = start_server(args.base_ms, args.per_key_ms)
+    client = FeatureOnlineStoreServiceClient(
+        transport=FeatureOnlineStoreServiceGrpcTransport(channel=grpc.insecure_channel(address))
+    )
+    configs = {
+        "single request": (1 << 30, 1),
+        "chunked, 1 stream": (args.chunk_size, 1),
+        f"chunked, {args.streams} streams": (args.chunk_size, args.streams),
+    }
+    for keys in args.keys:
+        for config_label, (chunk_size, streams) in configs.items():
+            fetcher = FeatureFetcher(
+                client, FEATURE_VIEW_PATH, chunk_size=chunk_size, max_streams=streams
+            )
+            run_benchmark(config_label, fetcher, keys, args.rounds)
+    if args.catalog_dir:
+        catalog = Catalog(args.catalog_dir)
+        catalog_ids = [item_id.decode("utf-8") for item_id in catalog.sorted_ids[:1000000]]
+        for keys in args.keys:
+            run_benchmark("catalog", catalog, keys, args.rounds, catalog_ids)
+    bench_server.stop(None)
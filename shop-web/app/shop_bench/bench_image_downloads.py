@@ -0,0 +1,229 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Benchmarks the item image downloads of a board against a local CDN stand-in with injected
+latency: a connection setup delay (TCP and TLS handshakes), lognormal response times and a
+share of stragglers. For each mode, prints the board build time (downloads and drawing)
+p50/p99, the missing tiles, the requests and the connections per board:
+
+    baseline: a thread and a new connection per image, waiting for the slowest one
+    pooled: the image fetcher with keep-alive connections, without hedging or deadline
+    hedged: the image fetcher with hedged requests, without deadline
+    deadline: the image fetcher with hedged requests and the board deadline
+
+The stand-in runs in a subprocess (so its threads don't share the GIL with the downloads) and
+serves HTTP/1.1, so HTTP/2 isn't measured (--http2 measures the httpx client over HTTP/1.1).
+
+Usage:
+    python3 -m shop_bench.bench_image_downloads --boards 200 --straggler-rate 0.02
+"""
+
+import io
+import sys
+import time
+import random
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+from PIL import Image
+
+from shop_bench.bench_utils import percentile_ms
+from shop_utils import image_utils
+from shop_utils.image_utils import (
+    DEFAULT_BOARD_LAYOUT,
+    IMAGE_LOADING_TIMEOUT,
+    BOARD_IMAGE_TIMEOUT,
+    number_items,
+    item_image_url,
+    render_item_image_board,
+)
+from shop_utils.executor import InstrumentedExecutor
+from shop_utils.image_fetcher import ImageFetcher, IMAGE_HEDGE_PERCENTILE
+
+MODES = ["baseline", "pooled", "hedged", "deadline"]
+
+
+class CdnStandIn(ThreadingHTTPServer):
+    """
+    Serves a JPEG for any path with the injected latency, and the number of connections that
+    requested an image for /connections
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024  # the default backlog of 5 delays new connections by secs
+
+    def __init__(self, args):
+        super().__init__(("127.0.0.1", 0), CdnRequestHandler)
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.rng_lock = threading.Lock()
+        self.connections = 0
+        image = Image.new("RGB", (DEFAULT_BOARD_LAYOUT.tile_size,) * 2, (180, 120, 60))
+        image_bytes = io.BytesIO()
+        image.save(image_bytes, format="JPEG")
+        self.image_bytes = image_bytes.getvalue()
+
+    def get_delay(self) -> float:
+        """Returns the secs to wait before the response"""
+        with self.rng_lock:
+            delay = self.rng.lognormvariate(0, self.args.sigma) * self.args.latency_ms
+            if self.rng.random() < self.args.straggler_rate:
+                delay += self.args.straggler_ms
+        return delay / 1000
+
+
+class CdnRequestHandler(BaseHTTPRequestHandler):
+    """Handles the requests of a connection"""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # no delayed ACK stalls between the headers and the body
+
+    def setup(self):
+        super().setup()
+        self.counted = False
+        time.sleep(self.server.args.connect_ms / 1000)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Responds with the image after the delay"""
+        if self.path == "/connections":
+            self.send_body(str(self.server.connections).encode("utf-8"), "text/plain")
+            return
+        if not self.counted:
+            self.counted = True
+            with self.server.rng_lock:
+                self.server.connections += 1
+        time.sleep(self.server.get_delay())
+        try:
+            self.send_body(self.server.image_bytes, "image/jpeg")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # cancelled hedge or missed deadline
+
+    def send_body(self, body: bytes, content_type: str):
+        """Sends the response"""
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+def load_image_baseline(url: str) -> bytes:
+    """Downloads the image with a new connection (as load_item_image did before the fetcher)"""
+    try:
+        response = requests.get(url, stream=True, timeout=IMAGE_LOADING_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+    except requests.exceptions.RequestException:
+        return None
+
+
+def build_board(mode: str, board_index: int, args, fetcher: ImageFetcher) -> tuple[float, int]:
+    """Downloads the images and draws the board, and returns the secs and missing tiles"""
+    items = [{"id": f"m{board_index:06d}{i:04d}"} for i in range(args.items)]
+    start_time = time.perf_counter()
+    tile_size = DEFAULT_BOARD_LAYOUT.tile_size
+    urls = [item_image_url(item_id, tile_size, tile_size) for item_id in number_items(items)]
+    if mode == "baseline":
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            item_images = list(executor.map(load_image_baseline, urls))
+    else:
+        timeout = args.board_timeout if mode == "deadline" else IMAGE_LOADING_TIMEOUT * 2
+        item_images = fetcher.submit(urls, timeout).result()
+    render_item_image_board(items, item_images, DEFAULT_BOARD_LAYOUT)
+    return time.perf_counter() - start_time, sum(image is None for image in item_images)
+
+
+def get_connections() -> int:
+    """Returns the number of connections the stand-in served images on"""
+    return int(requests.get(f"{image_utils.IMAGE_CDN_URL}/connections", timeout=5).text)
+
+
+def run_benchmark(mode: str, args) -> None:
+    """Builds the boards (args.concurrency at a time) and prints the stats"""
+    fetcher = ImageFetcher(
+        executor=InstrumentedExecutor(f"image_{mode}", args.max_concurrency),
+        max_connections=args.max_concurrency,
+        http2=args.http2,
+        hedge_percentile=args.hedge_percentile if mode in ("hedged", "deadline") else None,
+    )
+    connections = get_connections()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(
+            executor.map(
+                lambda board_index: build_board(mode, board_index, args, fetcher),
+                range(args.boards),
+            )
+        )
+    connections = get_connections() - connections
+    latencies = [latency for latency, _ in results]
+    stats = fetcher.stats()
+    requests_per_board = args.items if mode == "baseline" else stats["requests"] / args.boards
+    print(
+        f"{mode:>8}: boards: {args.boards}, "
+        + f"p50: {percentile_ms(latencies, 50):.0f} ms, "
+        + f"p99: {percentile_ms(latencies, 99):.0f} ms, "
+        + f"max: {max(latencies) * 1000:.0f} ms, "
+        + f"missing/board: {np.mean([missing for _, missing in results]):.2f}, "
+        + f"requests/board: {requests_per_board:.1f}, "
+        + f"hedged/board: {stats['hedged'] / args.boards:.2f}, "
+        + f"connections/board: {connections / args.boards:.2f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--boards", type=int, default=200)
+    parser.add_argument("--items", type=int, default=DEFAULT_BOARD_LAYOUT.capacity)
+    parser.add_argument("--concurrency", type=int, default=4, help="boards built at a time")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="requests in flight")
+    parser.add_argument("--http2", action="store_true", help="httpx client (HTTP/1.1 here)")
+    parser.add_argument("--connect-ms", type=float, default=30.0)
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="median response time")
+    parser.add_argument("--sigma", type=float, default=0.5, help="lognormal response jitter")
+    parser.add_argument("--straggler-rate", type=float, default=0.02)
+    parser.add_argument("--straggler-ms", type=float, default=1500.0)
+    parser.add_argument("--hedge-percentile", type=float, default=IMAGE_HEDGE_PERCENTILE)
+    parser.add_argument("--board-timeout", type=float, default=BOARD_IMAGE_TIMEOUT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--serve", action="store_true", help="run the stand-in (subprocess)")
+    args = parser.parse_args()
+
+    if args.serve:
+        cdn_server = CdnStandIn(args)
+        print(cdn_server.server_address[1], flush=True)
+        cdn_server.serve_forever()
+    else:
+        # start the stand-in with the same args, and read its port
+        with subprocess.Popen(
+            [sys.executable, "-m", "shop_bench.bench_image_downloads", "--serve"] + sys.argv[1:],
+            stdout=subprocess.PIPE,
+            text=True,
+        ) as cdn_process:
+            try:
+                image_utils.IMAGE_CDN_URL = f"http://127.0.0.1:{int(cdn_process.stdout.readline())}"
+                for bench_mode in args.modes:
+                    run_benchmark(bench_mode, args)
+            finally:
+                cdn_process.terminate()
@@ -0,0 +1,79 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Benchmarks the local lexical scorer used as the text_rerank fallback: latency percentiles
+for typical candidate counts. Items are sampled from a catalog snapshot (--catalog-dir) or
+generated, and the idf comes from the compact TF-IDF encoder (--encoder-dir) if available.
+
+Usage:
+    python3 -m shop_bench.bench_lexical_scorer --sizes 100 200 500 1000 --catalog-dir ./catalog
+"""
+
+import os
+import time
+import random
+import argparse
+
+from shop_bench.bench_dedup import generate_descriptions
+from shop_bench.bench_utils import SAMPLE_QUERIES, percentile_ms
+from shop_utils.catalog import Catalog
+from shop_utils.lexical_scorer import LexicalScorer
+from shop_utils.sparse_encoder import SparseEncoder
+
+
+def run_benchmark(scorer: LexicalScorer, items: list[dict], rounds: int) -> None:
+    """Scores the items for each sample query and prints the latency"""
+    latencies = []
+    for i in range(rounds):
+        start_time = time.perf_counter()
+        scorer.score(SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)], items)
+        latencies.append(time.perf_counter() - start_time)
+    print(
+        f"items: {len(items)}, p50: {percentile_ms(latencies, 50):.2f} ms, "
+        + f"p95: {percentile_ms(latencies, 95):.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 200, 500, 1000])
+    parser.add_argument("--rounds", type=int, default=100)
+    parser.add_argument("--catalog-dir")
+    parser.add_argument("--encoder-dir", default="./shop_utils/mercari3m_tfidf")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    bench_rng = random.Random(args.seed)
+    if os.path.exists(args.encoder_dir):
+        bench_scorer = LexicalScorer.from_sparse_encoder(SparseEncoder(args.encoder_dir))
+    else:
+        bench_scorer = LexicalScorer(lambda term: -1, None)
+    if args.catalog_dir:
+        catalog = Catalog(args.catalog_dir)
+        catalog_ids = [item_id.decode("utf-8") for item_id in catalog.sorted_ids[:1000000]]
+    for size in args.sizes:
+        if args.catalog_dir:
+            sample = catalog.fetch(bench_rng.sample(catalog_ids, size), ["name", "description"])
+            bench_items = list(sample.values())
+        else:
+            bench_items = [
+                {"id": str(i), "name": " ".join(desc.split()[:5]), "description": desc}
+                for i, desc in enumerate(generate_descriptions(size, bench_rng))
+            ]
+        for item in bench_items:
+            item["dense_dist"] = bench_rng.random()
+            item["sparse_dist"] = bench_rng.random()
+        run_benchmark(bench_scorer, bench_items, args.rounds)
@@ -0,0 +1,83 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks the local IVF index: query latency and recall against an exact scan.
+
+Usage:
+    python3 -m shop_bench.bench_local_index --index-dir ./local_index/text
+"""
+
+import time
+import argparse
+
+import numpy as np
+
+from shop_bench.bench_utils import percentile_ms
+from shop_utils.local_index import LocalIndex, ASSIGN_BATCH_SIZE
+
+
+def exact_search(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Returns the rows of the exact top k for each query with a full scan"""
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_rows = np.zeros((len(queries), k), dtype=np.int64)
+    for i in range(0, len(vectors), ASSIGN_BATCH_SIZE):
+        chunk = np.asarray(vectors[i : i + ASSIGN_BATCH_SIZE], dtype=np.float32)
+        scores = np.concatenate([best_scores, queries @ chunk.T], axis=1)
+        rows = np.concatenate(
+            [best_rows, np.broadcast_to(np.arange(i, i + len(chunk)), (len(queries), len(chunk)))],
+            axis=1,
+        )
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_rows = np.take_along_axis(rows, top, axis=1)
+    return best_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index-dir", required=True)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[8, 16, 32, 64])
+    parser.add_argument("--noise", type=float, default=0.05)
+    args = parser.parse_args()
+
+    # Use perturbed catalog vectors as queries
+    index = LocalIndex(args.index_dir)
+    rng = np.random.default_rng(0)
+    query_rows = rng.choice(len(index.vectors), args.queries, replace=False)
+    queries = np.asarray(index.vectors[np.sort(query_rows)], dtype=np.float32)
+    queries += rng.normal(0, args.noise, queries.shape).astype(np.float32)
+
+    print("running exact search...")
+    exact_ids = [
+        {index.ids[row].decode("utf-8") for row in rows}
+        for rows in exact_search(index.vectors, queries, args.k)
+    ]
+
+    for nprobe in args.nprobe:
+        index.nprobe = min(nprobe, len(index.centroids))
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, exact_ids):
+            start_time = time.perf_counter()
+            neighbors = index.search(query, args.k)
+            latencies.append(time.perf_counter() - start_time)
+            hits += len(expected & {item_id for item_id, _ in neighbors})
+        print(
+            f"nprobe: {nprobe}, recall@{args.k}: {hits / (args.k * len(queries)):.3f}, "
+            + f"p50: {percentile_ms(latencies, 50):.2f} ms, "
+            + f"p99: {percentile_ms(latencies, 99):.2f} ms"
+        )
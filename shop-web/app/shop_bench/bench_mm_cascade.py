@@ -0,0 +1,94 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Benchmarks the embedding cascade before multimodal filtering for the sample queries: Gemini
+boards per search with and without the cascade for each pair of cosine bands. With --check,
+all items are also filtered with Gemini to measure the agreement of the bands: the share of
+accepted items Gemini selected, and the share of Gemini's selections the cascade rejected.
+Requires access to the Vertex AI resources in query.py.
+
+Usage:
+    python3 -m shop_bench.bench_mm_cascade --source catalog --bands 0.3:0.1 0.25:0.12 --check
+"""
+
+import argparse
+
+import numpy as np
+
+from shop_bench.bench_utils import SAMPLE_QUERIES
+from shop_utils.cascade import score_by_embeddings, partition_by_scores
+from shop_utils.query import (
+    MM_BATCH_SIZE,
+    run_queries,
+    dedup_items,
+    get_mm_embedding,
+    get_item_embeddings,
+    multimodal_filtering,
+)
+
+FEATURE_NAMES = ["id", "name", "description"]
+
+
+def get_boards(item_count: int) -> int:
+    """Returns the Gemini boards of MM_BATCH_SIZE items for the items"""
+    return -(-item_count // MM_BATCH_SIZE)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default="catalog", choices=["catalog", "vvs"])
+    parser.add_argument("--bands", nargs="+", default=["0.3:0.1"], help="accept:reject cosines")
+    parser.add_argument("--queries", type=int, default=len(SAMPLE_QUERIES))
+    parser.add_argument("--query-rows", type=int, default=100)
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    bands = [tuple(float(v) for v in band.split(":")) for band in args.bands]
+    totals = {band: np.zeros(6) for band in bands}
+    for query in SAMPLE_QUERIES[: args.queries]:
+        items = run_queries([query], FEATURE_NAMES, args.query_rows)
+        items = dedup_items([item for item in items if item["name"] and item["name"].strip()])
+        embs, found = get_item_embeddings([item["id"] for item in items], args.source)
+        scores = score_by_embeddings(embs, found, np.array([get_mm_embedding(query)]))
+        selected_ids = set()
+        if args.check:
+            selected_ids = {item["id"] for item in multimodal_filtering(query, query, items, None)}
+        for band in bands:
+            accepted, rejected, uncertain = partition_by_scores(scores, *band)
+            accepted_ids = {items[i]["id"] for i in accepted}
+            rejected_ids = {items[i]["id"] for i in rejected}
+            totals[band] += [
+                get_boards(len(items)),
+                get_boards(len(uncertain)),
+                len(accepted_ids),
+                len(accepted_ids & selected_ids),
+                len(selected_ids),
+                len(rejected_ids & selected_ids),
+            ]
+        print(f"{query}: items: {len(items)}, found embeddings: {found.sum()}")
+
+    for band, (boards, gemini_boards, accepted, agreed, selected, missed) in totals.items():
+        line = (
+            f"accept: {band[0]}, reject: {band[1]}, Gemini boards/search: "
+            + f"{boards / args.queries:.2f} -> {gemini_boards / args.queries:.2f} "
+            + f"({boards / max(gemini_boards, 1):.1f}x fewer)"
+        )
+        if args.check:
+            line += (
+                f", accepted selected by Gemini: {agreed / max(accepted, 1) * 100:.1f}%, "
+                + f"Gemini selections rejected: {missed / max(selected, 1) * 100:.1f}%"
+            )
+        print(line)
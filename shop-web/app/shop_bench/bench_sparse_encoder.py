@@ -0,0 +1,103 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks the joblib TfidfVectorizer against the compact SparseEncoder:
+startup time, RSS increase and per-query encode latency. Each backend is
+measured in a fresh subprocess.
+
+Usage:
+    python3 -m shop_bench.bench_sparse_encoder
+"""
+
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+from shop_bench.bench_utils import SAMPLE_QUERIES, get_rss_kb
+
+
+def run_backend(backend: str, path: str, rounds: int) -> dict:
+    """Loads the backend and measures it (run in a subprocess)"""
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    rss_before = get_rss_kb()
+    start_time = time.perf_counter()
+    if backend == "joblib":
+        import joblib  # pylint: disable=import-outside-toplevel
+
+        vectorizer = joblib.load(path)
+        encode = vectorizer.transform
+    else:
+        from shop_utils.sparse_encoder import SparseEncoder  # pylint: disable=import-outside-toplevel
+
+        encode = SparseEncoder(path).transform
+    startup_time = time.perf_counter() - start_time
+    rss_after = get_rss_kb()
+
+    # per-query latency
+    latencies = []
+    for _ in range(rounds):
+        for query in SAMPLE_QUERIES:
+            start_time = time.perf_counter()
+            encode([query])
+            latencies.append(time.perf_counter() - start_time)
+
+    # batch latency
+    start_time = time.perf_counter()
+    for _ in range(rounds):
+        encode(SAMPLE_QUERIES)
+    batch_time = (time.perf_counter() - start_time) / rounds
+
+    return {
+        "backend": backend,
+        "startup_sec": startup_time,
+        "rss_increase_mb": (rss_after - rss_before) / 1024,
+        "query_p50_us": float(np.percentile(latencies, 50) * 1e6),
+        "query_p99_us": float(np.percentile(latencies, 99) * 1e6),
+        f"batch_{len(SAMPLE_QUERIES)}_ms": batch_time * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectorizer", default="./shop_utils/mercari3m_vectorizer.joblib")
+    parser.add_argument("--encoder-dir", default="./shop_utils/mercari3m_tfidf")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        # in the subprocess
+        backend_path = args.vectorizer if args.backend == "joblib" else args.encoder_dir
+        print(json.dumps(run_backend(args.backend, backend_path, args.rounds)))
+    else:
+        for backend_name in ["joblib", "encoder"]:
+            output = subprocess.run(
+                [sys.executable, "-m", "shop_bench.bench_sparse_encoder"]
+                + ["--vectorizer", args.vectorizer, "--encoder-dir", args.encoder_dir]
+                + ["--rounds", str(args.rounds), "--backend", backend_name],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                ", ".join(
+                    f"{k}: {v:.2f}" if isinstance(v, float) else f"{k}: {v}"
+                    for k, v in result.items()
+                )
+            )
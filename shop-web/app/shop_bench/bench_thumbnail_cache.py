@@ -0,0 +1,98 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Benchmarks the thumbnail cache on simulated boards: each board looks up --board-size items
+drawn from --items items with a Zipf popularity (--zipf), and stores the missing ones (random
+bytes of --image-kb). Prints the hit ratios of the hot and disk tiers, the lookup latency of
+each tier, and the disk bytes against the bound. The second run reopens the disk tier with an
+empty hot tier, as after a restart.
+
+Usage:
+    python3 -m shop_bench.bench_thumbnail_cache --boards 2000 --items 100000 --zipf 1.1
+"""
+
+import os
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from shop_bench.bench_utils import percentile_ms
+from shop_utils.cache import TTLCache, BlobCache
+from shop_utils.image_fetcher import THUMBNAIL_TTL
+
+
+def run_benchmark(label: str, cache_dir: str, args, rng: np.random.Generator) -> None:
+    """Runs the boards against the cache tiers over the cache dir, and prints the stats"""
+    disk_cache = BlobCache(cache_dir, args.disk_mb * 1024 * 1024, THUMBNAIL_TTL)
+    cache = TTLCache(
+        name="thumbnail",
+        max_bytes=args.hot_mb * 1024 * 1024,
+        ttl=THUMBNAIL_TTL,
+        sizeof=len,
+        second_tier=disk_cache,
+    )
+    latencies = {"hot": [], "disk": [], "miss": []}
+    for _ in range(args.boards):
+        item_ids = (rng.zipf(args.zipf, args.board_size) - 1) % args.items
+        for item_id in item_ids:
+            key = f"m{item_id:011d}:200x200"
+            hot_hits = cache.hits
+            start_time = time.perf_counter()
+            image = cache.get(key)
+            latency = time.perf_counter() - start_time
+            if image is None:
+                latencies["miss"].append(latency)
+                cache.put(key, os.urandom(args.image_kb * 1024))
+            else:
+                latencies["hot" if cache.hits > hot_hits else "disk"].append(latency)
+
+    stats = cache.stats()
+    disk_stats = disk_cache.stats()
+    lookups = sum(len(tier_latencies) for tier_latencies in latencies.values())
+    print(
+        f"{label:>8}: lookups: {lookups}, "
+        + f"hot hits: {stats['hits'] / lookups:.1%}, "
+        + f"disk hits: {stats['second_tier_hits'] / lookups:.1%}, "
+        + f"misses: {stats['misses'] / lookups:.1%}, "
+        + ", ".join(
+            f"{tier} p50/p99: {percentile_ms(tier_latencies, 50):.3f}/"
+            + f"{percentile_ms(tier_latencies, 99):.3f} ms"
+            for tier, tier_latencies in latencies.items()
+            if tier_latencies
+        )
+        + f", disk: {disk_stats['bytes'] / 1024**2:.0f}/{args.disk_mb} MB, "
+        + f"disk evictions: {disk_stats['evictions']}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--boards", type=int, default=2000)
+    parser.add_argument("--board-size", type=int, default=25)
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--zipf", type=float, default=1.1, help="popularity skew (> 1)")
+    parser.add_argument("--image-kb", type=int, default=8)
+    parser.add_argument("--hot-mb", type=int, default=16)
+    parser.add_argument("--disk-mb", type=int, default=128)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        run_benchmark("cold", temp_dir, args, rng)
+        run_benchmark("restart", temp_dir, args, rng)
@@ -0,0 +1,86 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Shared helpers for the benchmarks.
+"""
+
+import time
+import threading
+
+import numpy as np
+
+SAMPLE_QUERIES = [
+    "wooden train set",
+    "toy storage bin",
+    "kids wall decor",
+    "picture books for toddlers",
+    "learning toys for 3 year olds",
+    "desk organizer",
+    "monitor stand",
+    "desk lamp",
+    "houseplant pot",
+    "framed wall art",
+    "leather notebook",
+    "fountain pen",
+    "men's dress shirt",
+    "leather belt",
+    "oxford shoes",
+    "winter coat",
+    "wool sweater",
+    "snow boots",
+    "knit beanie",
+    "cashmere scarf",
+]
+
+
+def get_rss_kb() -> int:
+    """Returns the resident set size of this process in KB"""
+    with open("/proc/self/status", "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+class ThreadCountSampler:
+    """Samples the number of active threads (and the RSS) in the background"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.max_count = 0
+        self.max_rss_kb = 0
+        self.running = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        """Sampling loop"""
+        while self.running:
+            self.max_count = max(self.max_count, threading.active_count())
+            self.max_rss_kb = max(self.max_rss_kb, get_rss_kb())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.running = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.running = False
+        self.thread.join()
+
+
+def percentile_ms(latencies: list[float], p: float) -> float:
+    """Returns the percentile of the latencies (in secs) in milliseconds"""
+    return float(np.percentile(latencies, p) * 1000)
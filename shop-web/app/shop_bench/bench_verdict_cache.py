@@ -0,0 +1,109 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Benchmarks the multimodal verdict cache on simulated sessions: Gemini calls per session with
+and without the cache. Each session runs --searches searches. A search refines the previous
+one (same intent and category, --overlap of the candidates kept) with --refine-rate, or
+starts a new intent. With --overlap 1, a refinement repeats the search (as on a reconnect). Gemini is replaced by a deterministic selection of ~40% of a board.
+
+Usage:
+    python3 -m shop_bench.bench_verdict_cache --sessions 200 --searches 5 --overlap 0.7
+"""
+
+import zlib
+import argparse
+
+import numpy as np
+
+from shop_utils.cache import TTLCache
+from shop_utils.verdict_cache import VerdictCache
+
+SELECT_RATE = 0.4
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+CACHE_TTL = 60 * 60
+
+
+def select_with_fake_gemini(context: str, group_items: list[dict]) -> list[dict]:
+    """Selects the items whose hash with the context falls under SELECT_RATE"""
+    return [
+        item
+        for item in group_items
+        if zlib.crc32(f"{context}:{item['id']}".encode()) % 1000 < SELECT_RATE * 1000
+    ]
+
+
+def run_session(
+    verdict_cache: VerdictCache,
+    session: int,
+    args: argparse.Namespace,
+    rng: np.random.Generator,
+) -> int:
+    """Runs the searches of a session and returns the Gemini calls"""
+    calls = 0
+    intent = 0
+    candidates = []
+    next_id = 0
+    for search in range(args.searches):
+        if search == 0 or rng.random() >= args.refine_rate:
+            # a new intent with new candidates
+            intent += 1
+            kept = []
+        else:
+            # refine: keep a part of the candidates and add new ones (in a new order)
+            kept_count = int(len(candidates) * args.overlap)
+            kept_rows = sorted(rng.choice(len(candidates), kept_count, replace=False))
+            kept = [candidates[row] for row in kept_rows]
+        new_ids = [f"s{session}-{next_id + i}" for i in range(args.candidates - len(kept))]
+        next_id += len(new_ids)
+        candidates = kept + new_ids
+        if new_ids:
+            rng.shuffle(candidates)
+
+        items = [{"id": item_id} for item_id in candidates]
+        context = verdict_cache.context_key(f"intent {session}-{intent}", "category", None)
+        _, groups = verdict_cache.plan(context, items)
+        for group_items in groups:
+            verdict_cache.put(context, group_items, select_with_fake_gemini(context, group_items))
+        calls += len(groups)
+    return calls
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--searches", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=100)
+    parser.add_argument("--overlap", type=float, default=0.7)
+    parser.add_argument("--refine-rate", type=float, default=0.6)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    bench_rng = np.random.default_rng(args.seed)
+    cache = VerdictCache(TTLCache(name="mm_verdict", max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL))
+    session_calls = [run_session(cache, i, args, bench_rng) for i in range(args.sessions)]
+    uncached_calls = args.searches * -(-args.candidates // cache.group_size)
+    stats = cache.stats()
+    print(
+        f"sessions: {args.sessions}, searches/session: {args.searches}, "
+        + f"overlap: {args.overlap}, refine rate: {args.refine_rate}"
+    )
+    print(
+        f"gemini calls/session: without cache: {uncached_calls}, "
+        + f"with cache: {np.mean(session_calls):.2f} "
+        + f"({(1 - np.mean(session_calls) / uncached_calls) * 100:.1f}% fewer), "
+        + f"batch hits: {stats['batch_hits']}, item hits: {stats['item_hits']}, "
+        + f"cache bytes: {cache.cache.stats()['bytes']}"
+    )
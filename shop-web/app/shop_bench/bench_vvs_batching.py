@@ -0,0 +1,61 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks vector search with a thread per query x modality against one batched
+find_neighbors call per index. Requires access to the Vertex AI resources in query.py.
+
+Usage:
+    python3 -m shop_bench.bench_vvs_batching --queries 20 --rounds 10
+"""
+
+import time
+import queue
+import argparse
+
+import numpy as np
+
+from shop_bench.bench_utils import SAMPLE_QUERIES, ThreadCountSampler
+from shop_utils.query import run_threaded_vector_search, run_batched_vector_search
+
+
+def run_benchmark(search_func, query_list: list[str], rounds: int, query_rows: int) -> None:
+    """Runs the search function for the rounds and prints the latency stats"""
+    latencies = []
+    with ThreadCountSampler() as sampler:
+        for _ in range(rounds):
+            items_queue = queue.Queue()
+            start_time = time.perf_counter()
+            search_func(query_list, items_queue, query_rows)
+            latencies.append(time.perf_counter() - start_time)
+    print(
+        f"{search_func.__name__}: queries: {len(query_list)}, "
+        + f"mean: {np.mean(latencies) * 1000:.0f} ms, "
+        + f"p50: {np.percentile(latencies, 50) * 1000:.0f} ms, "
+        + f"p99: {np.percentile(latencies, 99) * 1000:.0f} ms, "
+        + f"throughput: {len(query_list) * rounds / sum(latencies):.1f} queries/sec, "
+        + f"max threads: {sampler.max_count}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--query-rows", type=int, default=10)
+    args = parser.parse_args()
+
+    queries = SAMPLE_QUERIES[: args.queries]
+    for func in [run_threaded_vector_search, run_batched_vector_search]:
+        run_benchmark(func, queries, args.rounds, args.query_rows)
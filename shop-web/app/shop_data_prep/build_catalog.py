@@ -0,0 +1,213 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module builds a local catalog snapshot (see shop_utils/catalog.py) with the id, name
+and description of all the Mercari items, plus the text/multimodal embeddings generated by
+generate_text_embs.py and generate_mm_embs.py (downloaded from Cloud Storage).
+
+Usage:
+    gsutil -m cp -r gs://<bucket>/text_embs gs://<bucket>/mm_embs ./embs/
+    python3 -m shop_data_prep.build_catalog --catalog-dir ./catalog \
+        --text-emb-dir ./embs/text_embs --mm-emb-dir ./embs/mm_embs
+"""
+
+import os
+import json
+import argparse
+from typing import Any, Iterator, Optional
+
+import numpy as np
+from tqdm import tqdm
+
+from shop_data_prep.build_local_index import list_emb_files
+from shop_utils.catalog import (
+    Catalog,
+    META_FILE,
+    SORTED_IDS_FILE,
+    SORTED_ROWS_FILE,
+    STRING_COLUMNS,
+    string_file,
+    string_offsets_file,
+    embedding_file,
+    embedding_mask_file,
+)
+
+PROJECT_ID = "gcp-samples-ic0"
+ITEMS_QUERY = """
+SELECT
+  id,
+  name,
+  description
+FROM
+  `gcp-samples-ic0.mercari202502.mercari_items_202502`
+"""
+EMB_WRITE_BATCH_SIZE = 10000
+
+
+def read_items_from_bigquery() -> Iterator[dict[str, Any]]:
+    """Reads the items from the BigQuery table page by page"""
+    from google.cloud import bigquery  # pylint: disable=import-outside-toplevel
+
+    bq_client = bigquery.Client(project=PROJECT_ID)
+    rows = bq_client.query(ITEMS_QUERY).result(page_size=100000)
+    for row in tqdm(rows, total=rows.total_rows):
+        yield {"id": row["id"], "name": row["name"], "description": row["description"]}
+
+
+def read_items_from_file(items_file: str) -> Iterator[dict[str, Any]]:
+    """Reads the items from a JSON lines file with "id", "name" and "description" """
+    with open(items_file, "r", encoding="utf-8") as f:
+        for line in tqdm(f):
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_strings(catalog_dir: str, items: Iterator[dict[str, Any]]) -> list[str]:
+    """Writes the string columns in row order and returns the item ids"""
+    ids = []
+    offsets = {column: [0] for column in STRING_COLUMNS}
+    files = {
+        column: open(string_file(catalog_dir, column), "wb")  # pylint: disable=consider-using-with
+        for column in STRING_COLUMNS
+    }
+    try:
+        for item in items:
+            ids.append(item["id"])
+            for column in STRING_COLUMNS:
+                value = (item.get(column) or "").encode("utf-8")
+                files[column].write(value)
+                offsets[column].append(offsets[column][-1] + len(value))
+    finally:
+        for f in files.values():
+            f.close()
+    for column in STRING_COLUMNS:
+        np.save(
+            string_offsets_file(catalog_dir, column),
+            np.array(offsets[column], dtype=np.int64),
+        )
+    return ids
+
+
+def write_id_index(catalog_dir: str, ids: list[str]) -> None:
+    """Writes the sorted ids and their rows for binary search"""
+    id_array = np.array([item_id.encode("utf-8") for item_id in ids], dtype=bytes)
+    order = np.argsort(id_array, kind="stable")
+    sorted_ids = id_array[order]
+    duplicates = np.flatnonzero(sorted_ids[1:] == sorted_ids[:-1])
+    if len(duplicates):
+        raise ValueError(f"duplicate item ids: {sorted_ids[duplicates[:10]].tolist()}")
+    np.save(os.path.join(catalog_dir, SORTED_IDS_FILE), sorted_ids)
+    np.save(os.path.join(catalog_dir, SORTED_ROWS_FILE), order.astype(np.int64))
+
+
+def read_emb_dim(emb_files: list[str]) -> int:
+    """Reads the dimensions from the first embedding"""
+    for emb_file in emb_files:
+        with open(emb_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    return len(json.loads(line)["embedding"])
+    raise ValueError("no embeddings found")
+
+
+def write_embeddings(
+    catalog: Catalog, catalog_dir: str, column: str, emb_dir: str, dtype: str
+) -> int:
+    """Writes the embeddings of the catalog items in row order and returns the count"""
+    files = list_emb_files(emb_dir)
+    dim = read_emb_dim(files)
+    count = catalog.meta["count"]
+    embs = np.lib.format.open_memmap(
+        embedding_file(catalog_dir, column), mode="w+", dtype=dtype, shape=(count, dim)
+    )
+    mask = np.zeros(count, dtype=bool)
+
+    def write_batch(batch_ids, batch_embs):
+        rows = catalog.lookup(batch_ids)
+        found = rows >= 0
+        embs[rows[found]] = np.asarray(batch_embs, dtype=dtype)[found]
+        mask[rows[found]] = True
+
+    batch_ids, batch_embs = [], []
+    for emb_file in tqdm(files):
+        with open(emb_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                emb = json.loads(line)
+                batch_ids.append(emb["id"])
+                batch_embs.append(emb["embedding"])
+                if len(batch_ids) >= EMB_WRITE_BATCH_SIZE:
+                    write_batch(batch_ids, batch_embs)
+                    batch_ids, batch_embs = [], []
+    if batch_ids:
+        write_batch(batch_ids, batch_embs)
+    embs.flush()
+    np.save(embedding_mask_file(catalog_dir, column), mask)
+    return int(mask.sum())
+
+
+def build_catalog(
+    catalog_dir: str,
+    items: Iterator[dict[str, Any]],
+    emb_dirs: dict[str, Optional[str]],
+    dtype: str = "float16",
+) -> None:
+    """Builds a catalog directory from the items and the embedding directories"""
+    os.makedirs(catalog_dir, exist_ok=True)
+
+    print("writing strings...")
+    ids = write_strings(catalog_dir, items)
+    write_id_index(catalog_dir, ids)
+    meta = {
+        "count": len(ids),
+        "string_columns": STRING_COLUMNS,
+        "embedding_columns": [],
+    }
+    with open(os.path.join(catalog_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    for column, emb_dir in emb_dirs.items():
+        if not emb_dir:
+            continue
+        print(f"writing {column} embeddings...")
+        found_count = write_embeddings(Catalog(catalog_dir), catalog_dir, column, emb_dir, dtype)
+        print(f"{column} embeddings: {found_count} of {len(ids)} items")
+        meta["embedding_columns"].append(column)
+        with open(os.path.join(catalog_dir, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--catalog-dir", required=True)
+    parser.add_argument("--items-file", help="JSON lines file (default: read from BigQuery)")
+    parser.add_argument("--text-emb-dir")
+    parser.add_argument("--mm-emb-dir")
+    parser.add_argument("--dtype", default="float16", choices=["float16", "float32"])
+    args = parser.parse_args()
+
+    catalog_items = (
+        read_items_from_file(args.items_file)
+        if args.items_file
+        else read_items_from_bigquery()
+    )
+    build_catalog(
+        args.catalog_dir,
+        catalog_items,
+        {"text": args.text_emb_dir, "mm": args.mm_emb_dir},
+        args.dtype,
+    )
+    print(f"Done! Created catalog: {args.catalog_dir}")
@@ -0,0 +1,123 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module builds a local IVF index from the embedding files generated by
+generate_text_embs.py or generate_mm_embs.py (downloaded from Cloud Storage).
+With --cluster-dir (see cluster_catalog.py), only one item per near-duplicate cluster is
+indexed.
+
+Usage:
+    gsutil -m cp -r gs://<bucket>/text_embs ./embs/
+    python3 -m shop_data_prep.build_local_index --emb-dir ./embs/text_embs \
+        --index-dir ./local_index/text
+"""
+
+import os
+import glob
+import json
+import argparse
+from typing import Optional
+
+import numpy as np
+from tqdm import tqdm
+
+from shop_utils.local_index import build_index, DEFAULT_NLIST
+from shop_utils.dedup import ClusterMap
+
+RAW_VECTORS_FILE = "raw_vectors.npy"
+
+
+def list_emb_files(emb_dir: str) -> list[str]:
+    """Lists the embedding files (JSON lines with "id" and "embedding")"""
+    return sorted(glob.glob(os.path.join(emb_dir, "*.json")))
+
+
+def count_embeddings(emb_files: list[str]) -> tuple[int, int]:
+    """Counts the embeddings and reads the dimensions"""
+    count = 0
+    dim = None
+    for emb_file in tqdm(emb_files):
+        with open(emb_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                if dim is None:
+                    dim = len(json.loads(line)["embedding"])
+                count += 1
+    return count, dim
+
+
+def load_embeddings(
+    emb_files: list[str],
+    raw_path: str,
+    count: int,
+    dim: int,
+    dtype: str,
+    cluster_map: Optional[ClusterMap] = None,
+) -> tuple[np.ndarray, list[str]]:
+    """
+    Loads the embeddings into a memory-mapped file (only the cluster representatives if
+    cluster_map is given)
+    """
+    vectors = np.lib.format.open_memmap(
+        raw_path, mode="w+", dtype=dtype, shape=(count, dim)
+    )
+    ids = []
+    for emb_file in tqdm(emb_files):
+        with open(emb_file, "r", encoding="utf-8") as f:
+            embs = [json.loads(line) for line in f if line.strip()]
+        if cluster_map:
+            is_representative = cluster_map.is_representative([emb["id"] for emb in embs])
+            embs = [emb for emb, keep in zip(embs, is_representative.tolist()) if keep]
+        for emb in embs:
+            vectors[len(ids)] = emb["embedding"]
+            ids.append(emb["id"])
+    vectors.flush()
+    return vectors[: len(ids)], ids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emb-dir", required=True)
+    parser.add_argument("--index-dir", required=True)
+    parser.add_argument("--nlist", type=int, default=DEFAULT_NLIST)
+    parser.add_argument("--dtype", default="float16", choices=["float16", "float32"])
+    parser.add_argument("--cluster-dir")
+    args = parser.parse_args()
+
+    files = list_emb_files(args.emb_dir)
+    print(f"counting embeddings in {len(files)} files...")
+    emb_count, emb_dim = count_embeddings(files)
+    print(f"found {emb_count} embeddings with {emb_dim} dimensions")
+
+    print("loading embeddings...")
+    os.makedirs(args.index_dir, exist_ok=True)
+    raw_vectors_path = os.path.join(args.index_dir, RAW_VECTORS_FILE)
+    raw_vectors, item_ids = load_embeddings(
+        files,
+        raw_vectors_path,
+        emb_count,
+        emb_dim,
+        args.dtype,
+        ClusterMap(args.cluster_dir) if args.cluster_dir else None,
+    )
+    if len(item_ids) < emb_count:
+        print(f"indexing {len(item_ids)} cluster representatives of {emb_count} items")
+
+    print("building index...")
+    build_index(raw_vectors, item_ids, args.index_dir, args.nlist, args.dtype)
+    del raw_vectors
+    os.remove(raw_vectors_path)
+    print(f"Done! Created local index: {args.index_dir}")
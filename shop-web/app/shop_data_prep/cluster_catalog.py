@@ -0,0 +1,235 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module clusters near-duplicate listings (re-posts) over the whole catalog snapshot built
+with build_catalog.py, and writes an id -> cluster map for ClusterMap in shop_utils/dedup.py.
+
+Items with the same normalized description are always merged. Then, depending on --method:
+    shingles: items sharing a MinHash band of their descriptions are merged if the
+        Levenshtein distance is <= --max-dist (the same rule as dedup_items). Descriptions
+        shorter than DEFAULT_MIN_LSH_LEN are only merged when repeated exactly (the online
+        dedup_items still compares them).
+    embeddings: items sharing a SimHash (random hyperplane) band of their text embeddings
+        are merged if the cosine similarity is >= --min-cosine
+Clusters are the connected components of the merged pairs, and the representative of a
+cluster is its first row.
+
+Usage:
+    python3 -m shop_data_prep.cluster_catalog --catalog-dir ./catalog --cluster-dir ./clusters
+"""
+
+import os
+import argparse
+from typing import Callable
+
+import numpy as np
+from tqdm import tqdm
+from Levenshtein import distance as levenshtein_distance
+
+from shop_utils.catalog import Catalog
+from shop_utils.dedup import (
+    CLUSTER_SORTED_IDS_FILE,
+    CLUSTER_IDS_FILE,
+    DEFAULT_MAX_DIST,
+    DEFAULT_MIN_LSH_LEN,
+    NearDuplicateDetector,
+    normalize_description,
+)
+
+BATCH_SIZE = 100000
+MAX_BUCKET_SIZE = 1000  # members of a band bucket compared with each other
+SIMHASH_BANDS = 8
+SIMHASH_BITS = 16  # hyperplanes per band
+SIMHASH_SEED = 1
+DEFAULT_MIN_COSINE = 0.98
+
+
+class UnionFind:
+    """Union-find over rows, where the root of a set is its smallest row"""
+
+    def __init__(self, count: int):
+        self.parent = list(range(count))
+
+    def find(self, x: int) -> int:
+        """Returns the root of x (with path halving)"""
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int) -> None:
+        """Merges the sets of a and b"""
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    def roots(self) -> np.ndarray:
+        """Returns the root of every row"""
+        roots = np.array(self.parent, dtype=np.int64)
+        while True:
+            next_roots = roots[roots]
+            if np.array_equal(next_roots, roots):
+                return roots
+            roots = next_roots
+
+
+def read_descriptions(catalog: Catalog, start: int, end: int) -> list[str]:
+    """Reads the normalized descriptions of the rows"""
+    buffer, offsets = catalog.strings["description"]
+    bounds = offsets[start : end + 1].tolist()
+    return [
+        normalize_description(str(buffer[bounds[i] : bounds[i + 1]], "utf-8"))
+        for i in range(end - start)
+    ]
+
+
+def merge_exact_repeats(catalog: Catalog, uf: UnionFind) -> int:
+    """Merges the rows with the same normalized description and returns the merge count"""
+    first_rows = {}
+    merge_count = 0
+    for start in tqdm(range(0, catalog.meta["count"], BATCH_SIZE)):
+        end = min(start + BATCH_SIZE, catalog.meta["count"])
+        for row, text in enumerate(read_descriptions(catalog, start, end), start):
+            first_row = first_rows.setdefault(hash(text), row)
+            if first_row == row:
+                continue
+            if read_descriptions(catalog, first_row, first_row + 1)[0] == text:
+                uf.union(first_row, row)
+                merge_count += 1
+    return merge_count
+
+
+def merge_buckets(
+    band_keys: np.ndarray, rows: np.ndarray, is_near: Callable[[int, int], bool], uf: UnionFind
+) -> int:
+    """
+    Merges the rows sharing a key in any band if is_near, and returns the merge count. Each
+    row is compared with one row of each cluster seen so far in the bucket (not with all of
+    its members), so a pair is missed if both rows are only near other members of the cluster.
+    """
+    merge_count = 0
+    for band in tqdm(range(band_keys.shape[1])):
+        order = np.argsort(band_keys[:, band], kind="stable")
+        keys = band_keys[order, band]
+        bucket_starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+        bucket_ends = np.append(bucket_starts[1:], len(keys))
+        for bucket_start, bucket_end in zip(bucket_starts.tolist(), bucket_ends.tolist()):
+            if bucket_end - bucket_start < 2:
+                continue
+            bucket_end = min(bucket_end, bucket_start + MAX_BUCKET_SIZE)
+            bucket_rows = rows[order[bucket_start:bucket_end]]
+            cluster_rows = []  # a row of each cluster in the bucket
+            for row in bucket_rows.tolist():
+                root = uf.find(row)
+                near_row = next(
+                    (
+                        cluster_row
+                        for cluster_row in cluster_rows
+                        if uf.find(cluster_row) == root or is_near(cluster_row, row)
+                    ),
+                    None,
+                )
+                if near_row is None:
+                    cluster_rows.append(row)
+                elif uf.find(near_row) != root:
+                    uf.union(near_row, row)
+                    merge_count += 1
+    return merge_count
+
+
+def cluster_by_shingles(catalog: Catalog, uf: UnionFind, max_dist: int) -> int:
+    """Merges the rows with near-duplicate descriptions (MinHash LSH + Levenshtein)"""
+    detector = NearDuplicateDetector(max_dist=max_dist)
+    rows, band_keys = [], []
+    for start in tqdm(range(0, catalog.meta["count"], BATCH_SIZE)):
+        texts = read_descriptions(catalog, start, min(start + BATCH_SIZE, catalog.meta["count"]))
+        long_rows = [i for i, text in enumerate(texts) if len(text) >= DEFAULT_MIN_LSH_LEN]
+        rows.append(np.array(long_rows, dtype=np.int64) + start)
+        band_keys.append(detector.band_keys([texts[i] for i in long_rows]))
+
+    def is_near(row_a, row_b):
+        text_a = read_descriptions(catalog, row_a, row_a + 1)[0]
+        text_b = read_descriptions(catalog, row_b, row_b + 1)[0]
+        return levenshtein_distance(text_a, text_b, score_cutoff=max_dist) <= max_dist
+
+    return merge_buckets(np.concatenate(band_keys), np.concatenate(rows), is_near, uf)
+
+
+def cluster_by_embeddings(catalog: Catalog, uf: UnionFind, min_cosine: float) -> int:
+    """Merges the rows with near-duplicate text embeddings (SimHash LSH + cosine)"""
+    embs, mask = catalog.embeddings["text"]
+    rng = np.random.default_rng(SIMHASH_SEED)
+    hyperplanes = rng.standard_normal((embs.shape[1], SIMHASH_BANDS * SIMHASH_BITS))
+    hyperplanes = hyperplanes.astype(np.float32)
+    bit_weights = np.uint64(1) << np.arange(SIMHASH_BITS, dtype=np.uint64)
+    rows, band_keys = [], []
+    for start in tqdm(range(0, catalog.meta["count"], BATCH_SIZE)):
+        batch_rows = np.flatnonzero(mask[start : start + BATCH_SIZE]) + start
+        bits = (embs[batch_rows].astype(np.float32) @ hyperplanes) > 0
+        bits = bits.reshape(len(batch_rows), SIMHASH_BANDS, SIMHASH_BITS).astype(np.uint64)
+        rows.append(batch_rows)
+        band_keys.append((bits * bit_weights).sum(axis=2, dtype=np.uint64))
+
+    def is_near(row_a, row_b):
+        emb_a = embs[row_a].astype(np.float32)
+        emb_b = embs[row_b].astype(np.float32)
+        norm = np.linalg.norm(emb_a) * np.linalg.norm(emb_b)
+        return norm > 0 and float(emb_a @ emb_b) / norm >= min_cosine
+
+    return merge_buckets(np.concatenate(band_keys), np.concatenate(rows), is_near, uf)
+
+
+def write_cluster_map(catalog: Catalog, roots: np.ndarray, cluster_dir: str) -> None:
+    """Writes the sorted ids and the position of their representative in the sorted ids"""
+    os.makedirs(cluster_dir, exist_ok=True)
+    sorted_rows = np.asarray(catalog.sorted_rows)
+    positions = np.empty(len(sorted_rows), dtype=np.int64)
+    positions[sorted_rows] = np.arange(len(sorted_rows))
+    np.save(os.path.join(cluster_dir, CLUSTER_SORTED_IDS_FILE), np.asarray(catalog.sorted_ids))
+    np.save(os.path.join(cluster_dir, CLUSTER_IDS_FILE), positions[roots[sorted_rows]])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--catalog-dir", required=True)
+    parser.add_argument("--cluster-dir", required=True)
+    parser.add_argument("--method", default="shingles", choices=["shingles", "embeddings"])
+    parser.add_argument("--max-dist", type=int, default=DEFAULT_MAX_DIST)
+    parser.add_argument("--min-cosine", type=float, default=DEFAULT_MIN_COSINE)
+    args = parser.parse_args()
+
+    item_catalog = Catalog(args.catalog_dir)
+    union_find = UnionFind(item_catalog.meta["count"])
+
+    print("merging exact repeats...")
+    print(f"merged: {merge_exact_repeats(item_catalog, union_find)}")
+    print(f"merging near-duplicates by {args.method}...")
+    if args.method == "shingles":
+        merged = cluster_by_shingles(item_catalog, union_find, args.max_dist)
+    else:
+        merged = cluster_by_embeddings(item_catalog, union_find, args.min_cosine)
+    print(f"merged: {merged}")
+
+    item_roots = union_find.roots()
+    write_cluster_map(item_catalog, item_roots, args.cluster_dir)
+    cluster_sizes = np.bincount(item_roots)
+    cluster_count = int((cluster_sizes > 0).sum())
+    print(
+        f"Done! items: {len(item_roots)}, clusters: {cluster_count} "
+        + f"({(1 - cluster_count / max(len(item_roots), 1)) * 100:.1f}% fewer), "
+        + f"largest cluster: {cluster_sizes.max() if len(cluster_sizes) else 0}. "
+        + f"Created cluster map: {args.cluster_dir}"
+    )
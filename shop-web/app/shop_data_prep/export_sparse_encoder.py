@@ -0,0 +1,81 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module exports the TF-IDF vectorizer (joblib) to the compact SparseEncoder format,
+and checks that the encoder reproduces vectorizer.transform() exactly.
+
+Usage:
+    python3 -m shop_data_prep.export_sparse_encoder
+"""
+
+import random
+import argparse
+
+import numpy as np
+import joblib
+
+from shop_utils.sparse_encoder import export_vectorizer, SparseEncoder
+
+CHECK_SAMPLE_COUNT = 10000
+CHECK_QUERIES = [
+    "wooden train set for toddlers",
+    "Women's Café Leather Boots, size 8!",
+    "pixel 7 case",
+    "",
+    "THE AND OF",
+]
+
+
+def generate_check_texts(vectorizer, count: int) -> list[str]:
+    """Generates texts from random vocabulary terms plus the sample queries"""
+    rng = random.Random(0)
+    terms = list(vectorizer.vocabulary_.keys())
+    texts = list(CHECK_QUERIES)
+    for _ in range(count):
+        texts.append(" ".join(rng.choice(terms) for _ in range(rng.randint(1, 12))))
+    return texts
+
+
+def check_encoder(vectorizer, encoder: SparseEncoder, texts: list[str]) -> int:
+    """Returns the number of texts with any difference from vectorizer.transform()"""
+    expected = vectorizer.transform(texts)
+    mismatch_count = 0
+    for i, (indices, values) in enumerate(encoder.transform(texts)):
+        row = expected[[i]]
+        if not (np.array_equal(row.indices, indices) and np.array_equal(row.data, values)):
+            mismatch_count += 1
+            print(f"mismatch: {texts[i]}")
+    return mismatch_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectorizer", default="./shop_utils/mercari3m_vectorizer.joblib")
+    parser.add_argument("--encoder-dir", default="./shop_utils/mercari3m_tfidf")
+    parser.add_argument("--check-count", type=int, default=CHECK_SAMPLE_COUNT)
+    args = parser.parse_args()
+
+    print("loading vectorizer...")
+    tfidf_vectorizer = joblib.load(args.vectorizer)
+
+    print("exporting...")
+    export_vectorizer(tfidf_vectorizer, args.encoder_dir)
+
+    print("checking...")
+    check_texts = generate_check_texts(tfidf_vectorizer, args.check_count)
+    mismatches = check_encoder(tfidf_vectorizer, SparseEncoder(args.encoder_dir), check_texts)
+    if mismatches:
+        raise SystemExit(f"{mismatches} of {len(check_texts)} texts didn't match")
+    print(f"Done! {len(check_texts)} texts matched. Created encoder: {args.encoder_dir}")
@@ -22,8 +22,6 @@ import json
 import queue
 import time
 import threading
-import requests
-import logging
 from datetime import datetime
 from typing import List, Dict, Any, Callable
 
@@ -37,6 +35,8 @@ from vertexai.vision_models import (
     MultiModalEmbeddingResponse,
 )
 
+from shop_utils.image_utils import load_item_images
+
 # Set the project ID
 
 PROJECT_ID = "gcp-samples-ic0"
@@ -68,38 +68,20 @@ items = df.to_dict("records")
 # Prepare a multimodal embedding model
 MM_EMB_MODEL_NAME = "multimodalembedding"
 MM_EMB_DIMENSIONALITY = 1408
-IMAGE_LOADING_TIMEOUT = 2
 
 mm_emb_model = MultiModalEmbeddingModel.from_pretrained(MM_EMB_MODEL_NAME)
 
 vertexai.init(project=PROJECT_ID, location=LOCATION)
 
 
-def load_item_image(id: str, width: int, height: int) -> bytes:
-    """Load item image from Mercari"""
-    try:
-        # Download the item image
-        image_url = f"https://u-mercari-images.mercdn.net/photos/{id}_1.jpg?w={width}&h={height}&fitcrop"
-        response = requests.get(image_url, stream=True, timeout=IMAGE_LOADING_TIMEOUT)
-        response.raise_for_status()
-        return response.content
-    except requests.exceptions.RequestException as e:
-        logging.info("generate_item_tile(): Image download failed: %s", str(e))
-        return None
-    except Exception:
-        logging.error(
-            "generate_item_tile(): Image processing failed: %s", exc_info=True
-        )
-        return None
-
-
 def generate_mm_embeddings(items: list[dict[str, Any]]) -> list[list[float]]:
     """
     Generate multimodal embeddings for items.
     """
 
     # Download item image
-    images = [Image(image_bytes=load_item_image(item["id"], 200, 200)) for item in items]
+    item_images = load_item_images([item["id"] for item in items], 200, 200)
+    images = [Image(image_bytes=item_image) for item_image in item_images]
 
     # Get multimodal embeddings.
     embs: list[MultiModalEmbeddingResponse] = [
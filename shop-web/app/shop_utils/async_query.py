@@ -0,0 +1,471 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+This module provides an asyncio version of the search pipeline in query.py, for running the
+searches as tasks on the event loop of the server instead of threads per unit of work.
+
+Each stage runs its calls as tasks under the deadline, and cancels the unfinished ones when
+the deadline expires. The Ranking API, Feature Store and Gemini use async clients (grpc.aio
+and client.aio), and the item image downloads are awaited from the shared image fetcher (see
+image_fetcher.py). The calls without an async API (the Vector Search SDK, multimodal
+embeddings and the local backends) run on the I/O pool, and the image boards and embedding
+dedup on the CPU pool (the boards on the render processes with BOARD_RENDER_PROCESSES, see
+executor.py).
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor
+from typing import Any, Awaitable, Callable
+
+from google.cloud import discoveryengine_v1 as discoveryengine
+from google.cloud.aiplatform_v1beta1 import FeatureOnlineStoreServiceAsyncClient
+from vertexai.language_models import TextEmbeddingInput
+
+from shop_utils.deadline import Deadline
+from shop_utils.executor import io_executor, cpu_executor
+from shop_utils.image_utils import generate_item_image_board_async
+from shop_utils.item_selection import (
+    ITEM_SELECTION_CONFIG,
+    build_multimodal_contents,
+    select_items,
+)
+from shop_utils.query import (
+    LOCATION,
+    TEXT_EMB_BATCH_SIZE,
+    TEXT_EMB_TASK_TYPE,
+    VVS_DEPLOYED_INDEX_ID,
+    VVS_DEPLOYED_INDEX_ID_MM,
+    RANK_MAX_RECORDS,
+    RANK_MODEL,
+    RANK_TOURNAMENT_SIZE,
+    RANK_DEADLINE,
+    FEATURE_FETCH_TIMEOUT,
+    GEMINI_MODEL,
+    MM_BOARD_LAYOUT,
+    MM_FILTER_TIMEOUT,
+    MM_FILTER_MIN_TIME,
+    RERANK_RESERVE,
+    catalog,
+    feature_fetcher,
+    gemini_client,
+    mm_verdict_cache,
+    lexical_scorer,
+    ranking_config,
+    text_emb_model,
+    query_emb_cache,
+    query_emb_cache_key,
+    generate_mm_embedding,
+    get_sparse_embeddings,
+    build_hybrid_query,
+    run_vvs_query,
+    neighbor_to_item,
+    merge_found_items,
+    prefetch_item_images,
+    dedup_items,
+    dedup_items_by_embeddings,
+    cascade_items_by_embeddings,
+    get_rank_records,
+    merge_rank_scores,
+    get_tournament_records,
+    get_local_rank_scores,
+    get_reranked_items,
+    count_rank_outcome,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+#
+# Async clients (created on the event loop of the first search, as grpc.aio clients are
+# bound to a loop)
+#
+
+ASYNC_CLIENT_FACTORIES: dict[str, Callable[[], Any]] = {
+    "rank": discoveryengine.RankServiceAsyncClient,
+    "feature_store": lambda: FeatureOnlineStoreServiceAsyncClient(
+        client_options={"api_endpoint": f"{LOCATION}-aiplatform.googleapis.com"}
+    ),
+}
+async_clients: dict[str, Any] = {}
+
+
+def get_async_client(name: str) -> Any:
+    """Returns the async client (creating it on the running loop)"""
+    if name not in async_clients:
+        async_clients[name] = ASYNC_CLIENT_FACTORIES[name]()
+    return async_clients[name]
+
+
+def run_in_pool(executor: Executor, fn: Callable, *args) -> asyncio.Future:
+    """Runs fn(*args) on the pool and returns a future of the result on the running loop"""
+    return asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+async def gather_until(awaitables: list[Awaitable[Any]], timeout: float = None) -> list[Any]:
+    """
+    Runs the awaitables as tasks and returns their results, with None for the ones that failed
+    or didn't finish within the timeout (which are cancelled).
+    """
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    if not tasks:
+        return []
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    results = []
+    for task in tasks:
+        if task.cancelled():
+            results.append(None)
+        elif task.exception() is not None:
+            logging.error("gather_until(): task failed", exc_info=task.exception())
+            results.append(None)
+        else:
+            results.append(task.result())
+    return results
+
+
+#
+# Query embeddings
+#
+
+
+async def generate_text_embeddings_async(queries):
+    """generate text embeddings for the query texts in batches (async)."""
+    embeddings = []
+    for i in range(0, len(queries), TEXT_EMB_BATCH_SIZE):
+        text_emb_inputs = [
+            TextEmbeddingInput(query, TEXT_EMB_TASK_TYPE)
+            for query in queries[i : i + TEXT_EMB_BATCH_SIZE]
+        ]
+        embeddings.extend(
+            emb.values for emb in await text_emb_model.get_embeddings_async(text_emb_inputs)
+        )
+    return embeddings
+
+
+async def generate_mm_embeddings_async(queries):
+    """generate multimodal embeddings (the API takes one text per request, with no async API)"""
+    return await asyncio.gather(
+        *(run_in_pool(io_executor, generate_mm_embedding, query) for query in queries)
+    )
+
+
+async def get_cached_embeddings_async(modality, queries, generation_func):
+    """Get embeddings from the cache and generate the missing ones with generation_func"""
+    keys = [query_emb_cache_key(modality, query) for query in queries]
+    embs = {key: query_emb_cache.get(key) for key in dict.fromkeys(keys)}
+    missing_keys = [key for key, emb in embs.items() if emb is None]
+    if missing_keys:
+        missing_queries = [queries[keys.index(key)] for key in missing_keys]
+        for key, emb in zip(missing_keys, await generation_func(missing_queries)):
+            query_emb_cache.put(key, emb)
+            embs[key] = emb
+    return [embs[key] for key in keys]
+
+
+async def create_hybrid_queries_async(
+    query_list: list[str], deadline: Deadline
+) -> tuple[list[Any], list[Any]]:
+    """
+    Create text and mm HybridQuery objects for all queries. The queries of a modality are
+    set to None when its embeddings failed or missed the deadline.
+    """
+    sparse_embs = get_sparse_embeddings(query_list)
+    text_embs, mm_embs = await gather_until(
+        [
+            get_cached_embeddings_async("text", query_list, generate_text_embeddings_async),
+            get_cached_embeddings_async("mm", query_list, generate_mm_embeddings_async),
+        ],
+        deadline.timeout(),
+    )
+    return [
+        [
+            build_hybrid_query(emb, sparse_emb, is_text) if embs else None
+            for emb, sparse_emb in zip(embs or [None] * len(query_list), sparse_embs)
+        ]
+        for embs, is_text in [(text_embs, True), (mm_embs, False)]
+    ]
+
+
+#
+# Run Query
+#
+
+
+async def run_queries_async(
+    query_list: list[str],
+    feature_names: list[str],
+    query_rows: int,
+    deadline: Deadline = None,
+) -> list[Any]:
+    """Find items with the list of queries (the items found and fetched before the deadline)"""
+    deadline = deadline or Deadline()
+    search_start_time = time.monotonic()
+    text_queries, mm_queries = await create_hybrid_queries_async(query_list, deadline)
+
+    # run a batched query on the text and mm index concurrently
+    searches = []
+    for hybrid_queries, deployed_index_id in [
+        (text_queries, VVS_DEPLOYED_INDEX_ID),
+        (mm_queries, VVS_DEPLOYED_INDEX_ID_MM),
+    ]:
+        query_indexes = [i for i, q in enumerate(hybrid_queries) if q is not None]
+        if query_indexes:
+            searches.append((hybrid_queries, query_indexes, deployed_index_id))
+    responses = await gather_until(
+        [
+            run_in_pool(
+                io_executor,
+                run_vvs_query,
+                [hybrid_queries[i] for i in query_indexes],
+                query_rows,
+                deployed_index_id,
+            )
+            for hybrid_queries, query_indexes, deployed_index_id in searches
+        ],
+        deadline.timeout(),
+    )
+    if None in responses:
+        logging.warning("run_queries_async(): searches failed or missed the deadline")
+
+    # fan the neighbors back out per query
+    neighbors_per_query = [[] for _ in query_list]
+    for (_, query_indexes, _), response in zip(searches, responses):
+        for i, neighbors in zip(query_indexes, response or []):
+            neighbors_per_query[i].extend(neighbors)
+    items = merge_found_items(
+        [neighbor_to_item(neighbor) for neighbors in neighbors_per_query for neighbor in neighbors]
+    )
+    deadline.record_stage("search", search_start_time)
+
+    # prefetch the board images, and fetch feature values meanwhile
+    prefetch_item_images(items, deadline)
+    with deadline.stage("features"):
+        if catalog:
+            return catalog.fetch_feature_values(items, feature_names)
+        return await feature_fetcher.fetch_feature_values_async(
+            get_async_client("feature_store"),
+            items,
+            feature_names,
+            deadline.child(limit=FEATURE_FETCH_TIMEOUT).timeout(),
+        )
+
+
+#
+# Multimodal item evaluation
+#
+
+
+async def multimodal_filtering_async(
+    user_intent,
+    item_category,
+    items,
+    user_uploaded_image,
+    deadline: Deadline,
+    on_filtered: Callable[[list[Any]], None] = None,
+):
+    """
+    Multimodal filtering with a task per MM_BATCH_SIZE items without cached verdicts (see
+    multimodal_filtering). The groups that didn't finish by the deadline are cancelled.
+    """
+    filter_deadline = deadline.child(limit=MM_FILTER_TIMEOUT, reserve=RERANK_RESERVE)
+    if filter_deadline.remaining() < MM_FILTER_MIN_TIME:
+        logging.warning("multimodal_filtering_async: skipped (deadline): items: %d", len(items))
+        return items
+
+    async def filter_group(group_items):
+        with filter_deadline.stage("boards"):
+            group_items, item_image_board = await generate_item_image_board_async(
+                group_items, MM_BOARD_LAYOUT
+            )
+        contents = build_multimodal_contents(
+            user_intent,
+            item_category,
+            group_items,
+            item_image_board,
+            user_uploaded_image,
+            MM_BOARD_LAYOUT.mime_type,
+        )
+        response = await gemini_client.aio.models.generate_content(
+            model=GEMINI_MODEL, contents=contents, config=ITEM_SELECTION_CONFIG
+        )
+        selected_items = select_items(group_items, response.text)
+        mm_verdict_cache.put(context, group_items, selected_items)
+        return selected_items
+
+    # resolve the items with cached verdicts, and collect the results as the groups finish
+    context = mm_verdict_cache.context_key(user_intent, item_category, user_uploaded_image)
+    cached_items, groups = mm_verdict_cache.plan(context, items)
+    tasks = [asyncio.create_task(filter_group(group_items)) for group_items in groups]
+    reranked_items = list(cached_items)
+    if cached_items and on_filtered:
+        on_filtered(reranked_items)
+    finished_count = 0
+    try:
+        async with asyncio.timeout(filter_deadline.timeout()):
+            for next_group in asyncio.as_completed(tasks):
+                try:
+                    reranked_items.extend(await next_group)
+                except Exception:
+                    logging.error("multimodal_filtering_async: group failed", exc_info=True)
+                finished_count += 1
+                if on_filtered:
+                    on_filtered(reranked_items)
+    except TimeoutError:
+        logging.warning(
+            "multimodal_filtering_async: deadline expired: finished groups: %d/%d",
+            finished_count,
+            len(tasks),
+        )
+        if finished_count == 0:
+            reranked_items = cached_items + [item for group in groups for item in group]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    logging.info(
+        "multimodal_filtering_async: incoming items: %d, reranked items: %d, elapsed: %.2f sec, %s",
+        len(items),
+        len(reranked_items),
+        filter_deadline.elapsed(),
+        mm_verdict_cache.stats(),
+    )
+    return reranked_items
+
+
+#
+# Ranking API
+#
+
+
+async def rank_records_async(query, records, rows):
+    """Ranks up to RANK_MAX_RECORDS records and returns the top (id, score) pairs"""
+    rank_request = discoveryengine.RankRequest(
+        ranking_config=ranking_config,
+        model=RANK_MODEL,
+        top_n=rows,
+        query=query,
+        records=records,
+        ignore_record_details_in_response=True,
+    )
+    response = await get_async_client("rank").rank(request=rank_request)
+    return [(r.id, r.score) for r in response.records]
+
+
+async def text_rerank_async(query, items, rows, deadline: Deadline):
+    """
+    Rerank the features (see text_rerank). The rank requests are cancelled when they miss
+    RANK_DEADLINE (or the deadline), and the items are ordered by the local lexical scores.
+    """
+    rank_deadline = deadline.child(limit=RANK_DEADLINE)
+    # the local scores are computed on the pool while the rank requests are in flight
+    local_scores = run_in_pool(cpu_executor, lexical_scorer.score, query, items)
+    outcome = "timeout"
+    if not rank_deadline.expired():
+        records = get_rank_records(items)
+        chunks = [
+            records[i : i + RANK_MAX_RECORDS] for i in range(0, len(records), RANK_MAX_RECORDS)
+        ]
+        try:
+            async with asyncio.timeout(rank_deadline.timeout()):
+                async with asyncio.TaskGroup() as tg:
+                    chunk_tasks = [
+                        tg.create_task(rank_records_async(query, chunk, rows)) for chunk in chunks
+                    ]
+            scores = merge_rank_scores([task.result() for task in chunk_tasks], rows)
+            outcome = "ranked"
+        except TimeoutError:
+            pass
+        except Exception:
+            logging.error("text_rerank_async(): ranking api failed", exc_info=True)
+            outcome = "error"
+
+    if outcome == "ranked":
+        # rank the top candidates of all chunks again in one request (if in time)
+        if len(chunks) > 1 and RANK_TOURNAMENT_SIZE > 1:
+            top_records = get_tournament_records(records, scores)
+            try:
+                async with asyncio.timeout(rank_deadline.timeout()):
+                    top_scores = await rank_records_async(query, top_records, len(top_records))
+                scores[: len(top_records)] = top_scores
+            except Exception:
+                logging.warning("text_rerank_async(): second round skipped", exc_info=True)
+    else:
+        scores = get_local_rank_scores(items, await local_scores, rows)
+    logging.info("text_rerank_async(): %s: %s", outcome, count_rank_outcome(outcome))
+    return get_reranked_items(items, scores)
+
+
+async def filter_and_rerank_items_async(
+    user_intent: str,
+    item_category: str,
+    items: list[Any],
+    user_uploaded_image: Any,
+    deadline: Deadline = None,
+    on_filtered: Callable[[list[Any]], None] = None,
+) -> list[Any]:
+    """Filtering and Reranking on the items (see filter_and_rerank_items)"""
+    deadline = deadline or Deadline()
+
+    # remove items without product name
+    items = [item for item in items if item["name"] and len(item["name"].strip()) > 0]
+
+    # dedup items
+    with deadline.stage("dedup"):
+        items = await run_in_pool(cpu_executor, dedup_items, items)
+        items = await run_in_pool(cpu_executor, dedup_items_by_embeddings, items, deadline)
+
+    # embedding cascade, then multimodal filtering of the uncertain items
+    with deadline.stage("cascade"):
+        accepted_items, items = await run_in_pool(
+            io_executor,
+            cascade_items_by_embeddings,
+            user_intent,
+            item_category,
+            items,
+            user_uploaded_image,
+            deadline,
+        )
+
+    def on_filtered_with_accepted(filtered_items):
+        on_filtered(accepted_items + filtered_items)
+
+    with deadline.stage("mm_filter"):
+        items = accepted_items + await multimodal_filtering_async(
+            user_intent,
+            item_category,
+            items,
+            user_uploaded_image,
+            deadline,
+            on_filtered_with_accepted if on_filtered else None,
+        )
+
+    # text rerank
+    with deadline.stage("rerank"):
+        items = await text_rerank_async(
+            f"{user_intent} {item_category}", items, len(items), deadline
+        )
+
+    # remove distances
+    for item in items:
+        del item["dense_dist"]
+        del item["sparse_dist"]
+        del item["rerank_score"]
+    return items
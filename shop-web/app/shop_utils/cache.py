@@ -0,0 +1,377 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides in-memory and on-disk caches with LRU/TTL eviction.
+"""
+
+import os
+import sys
+import mmap
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+logging.basicConfig(level=logging.INFO)
+
+
+def estimate_size(value: Any) -> int:
+    """Estimates the memory size of a value in bytes (including nested objects)"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(estimate_size(v) for v in value)
+    elif hasattr(value, "nbytes"):
+        size += value.nbytes
+    return size
+
+
+#
+# On-disk cache
+#
+
+
+class SqliteCache:
+    """
+    A persistent cache tier on SQLite that survives instance restarts. Values are pickled, so
+    the file must not be shared with untrusted writers.
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int = 100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                + "(key TEXT PRIMARY KEY, value BLOB, expires_at REAL, accessed_at REAL)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+            )
+            self.conn.commit()
+        self.put_count = 0
+
+    def get(self, key: str) -> Any:
+        """Returns the value for the key, or None if missing or expired"""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self.conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            self.conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.conn.commit()
+        return pickle.loads(row[0])
+
+    def put(self, key: str, value: Any) -> None:
+        """Stores the value for the key"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                (key, pickle.dumps(value), now + self.ttl, now),
+            )
+            self.put_count += 1
+
+            # Evict expired and least recently used entries from time to time
+            if self.put_count % 1000 == 0:
+                self.conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+                self.conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                    + "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self.conn.commit()
+
+
+class BlobCache:
+    """
+    A persistent, content-addressed cache of bytes values bounded by the total size on disk.
+    Each value is a file named by its SHA-256 (written atomically, and shared by the keys with
+    the same content), read with mmap. A SQLite index maps the keys to the files, and the
+    least recently used keys are evicted when the files exceed max_bytes.
+    """
+
+    INDEX_FILE = "index.db"
+    BLOB_DIR = "blobs"
+    ACCESS_FLUSH_COUNT = 100  # hits buffered before updating their access times
+    EVICTION_TARGET = 0.9  # evict down to this share of max_bytes
+
+    def __init__(self, cache_dir: str, max_bytes: int, ttl: float):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(os.path.join(cache_dir, self.BLOB_DIR), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(cache_dir, self.INDEX_FILE), check_same_thread=False
+        )
+        with self.lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                + "(key TEXT PRIMARY KEY, digest TEXT, expires_at REAL, accessed_at REAL)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER)"
+            )
+            self.conn.commit()
+            self.total_bytes = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM blobs"
+            ).fetchone()[0]
+        self.accessed: dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.shared_writes = 0
+        self.evictions = 0
+
+    def get_blob_path(self, digest: str) -> str:
+        """Returns the path of the file of the digest"""
+        return os.path.join(self.cache_dir, self.BLOB_DIR, digest[:2], digest)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the value for the key, or None if missing or expired"""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT digest, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                self.misses += 1
+                return None
+        try:
+            with open(self.get_blob_path(row[0]), "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    value = mapped[:]
+        except (OSError, ValueError):
+            # removed by an eviction in between (or an empty file)
+            with self.lock:
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.conn.commit()
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+            self.accessed[key] = now
+            if len(self.accessed) >= self.ACCESS_FLUSH_COUNT:
+                self.flush_accessed()
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        """Stores the value for the key and evicts the least recently used keys"""
+        if not value or len(value) > self.max_bytes:
+            return
+        digest = hashlib.sha256(value).hexdigest()
+        path = self.get_blob_path(digest)
+        shared = os.path.exists(path)
+        if not shared:
+            # write a temp file in the same dir and rename it, so readers never see a partial file
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(value)
+                os.replace(temp_path, path)
+            except OSError:
+                logging.error("BlobCache: write failed: %s", path, exc_info=True)
+                os.unlink(temp_path)
+                return
+        now = time.time()
+        with self.lock:
+            if not os.path.exists(path):
+                return  # the shared file was evicted in between
+            inserted = self.conn.execute(
+                "INSERT OR IGNORE INTO blobs VALUES (?, ?)", (digest, len(value))
+            ).rowcount
+            self.total_bytes += len(value) * inserted
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, digest, now + self.ttl, now),
+            )
+            self.conn.commit()
+            self.writes += 1
+            self.shared_writes += shared
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def flush_accessed(self) -> None:
+        """Writes the buffered access times of the hits (called with the lock)"""
+        self.conn.executemany(
+            "UPDATE entries SET accessed_at = ? WHERE key = ?",
+            [(accessed_at, key) for key, accessed_at in self.accessed.items()],
+        )
+        self.conn.commit()
+        self.accessed.clear()
+
+    def evict(self) -> None:
+        """Evicts the least recently used keys and their unshared files (called with the lock)"""
+        self.flush_accessed()
+        while self.total_bytes > self.max_bytes * self.EVICTION_TARGET:
+            rows = self.conn.execute(
+                "SELECT key, digest FROM entries ORDER BY accessed_at LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            self.conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in rows])
+            self.evictions += len(rows)
+            for digest in {digest for _, digest in rows}:
+                if self.conn.execute(
+                    "SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)
+                ).fetchone():
+                    continue
+                size = self.conn.execute(
+                    "SELECT size FROM blobs WHERE digest = ?", (digest,)
+                ).fetchone()
+                self.conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                self.total_bytes -= size[0] if size else 0
+                try:
+                    os.unlink(self.get_blob_path(digest))
+                except FileNotFoundError:
+                    pass
+        self.conn.commit()
+
+    def stats(self) -> dict[str, Any]:
+        """Returns the cache metrics"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "shared_writes": self.shared_writes,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+#
+# In-memory cache
+#
+
+
+class TTLCache:
+    """
+    A thread-safe LRU cache bounded by the total estimated size in bytes, with TTL
+    and an optional second tier (such as SqliteCache) for persistence.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_bytes: int,
+        ttl: float,
+        sizeof: Callable[[Any], int] = estimate_size,
+        second_tier: Optional[Any] = None,
+    ):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.second_tier = second_tier
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[Any, tuple[Any, int, float]] = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.second_tier_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Any, include_second_tier: bool = True) -> Any:
+        """
+        Returns the value for the key, or None if missing or expired. Without
+        include_second_tier, only this tier is looked up (and a miss isn't counted).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, size, expires_at = entry
+                if expires_at >= time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+                self.total_bytes -= size
+                self.expirations += 1
+
+        if not include_second_tier:
+            return None
+
+        # Look up the second tier
+        if self.second_tier is not None:
+            value = self.second_tier.get(key)
+            if value is not None:
+                with self.lock:
+                    self.second_tier_hits += 1
+                self.put(key, value, write_through=False)
+                return value
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: Any, value: Any, write_through: bool = True) -> None:
+        """Stores the value for the key and evicts the least recently used entries"""
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old_entry = self.entries.pop(key, None)
+            if old_entry is not None:
+                self.total_bytes -= old_entry[1]
+            self.entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+        if write_through and self.second_tier is not None:
+            self.second_tier.put(key, value)
+
+    def stats(self) -> dict[str, Any]:
+        """Returns the cache metrics"""
+        with self.lock:
+            lookups = self.hits + self.second_tier_hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "second_tier_hits": self.second_tier_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": (self.hits + self.second_tier_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,54 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+This module provides the embedding-similarity cascade before the multimodal filtering with
+Gemini. Items are scored by the cosine similarity of their multimodal embeddings to the query
+embeddings (the user intent and item category text, and the uploaded image if any), which are
+in the same embedding space. Items scoring at or above the accept band are kept and items
+below the reject band are dropped without Gemini. Only the uncertain items in between, and
+the items without embeddings, are sent to Gemini.
+"""
+
+import numpy as np
+
+DEFAULT_ACCEPT_COSINE = 0.3
+DEFAULT_REJECT_COSINE = 0.1
+
+
+def score_by_embeddings(embs: np.ndarray, found: np.ndarray, query_embs: np.ndarray) -> np.ndarray:
+    """
+    Returns the max cosine similarity of each item (rows of embs) to the query embeddings,
+    or nan for the items not found.
+    """
+    embs = embs.astype(np.float32, copy=False)
+    query_embs = np.asarray(query_embs, dtype=np.float32).reshape(-1, embs.shape[1])
+    norms = np.sqrt(np.einsum("ij,ij->i", embs, embs))
+    query_norms = np.linalg.norm(query_embs, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cosines = (embs @ query_embs.T) / np.outer(norms, query_norms)
+    scores = cosines.max(axis=1) if len(query_embs) else np.full(len(embs), np.nan)
+    scores[~found | (norms == 0)] = np.nan
+    return scores
+
+
+def partition_by_scores(
+    scores: np.ndarray, accept: float = DEFAULT_ACCEPT_COSINE, reject: float = DEFAULT_REJECT_COSINE
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the rows accepted, rejected and uncertain (including nan scores)"""
+    accepted = scores >= accept
+    rejected = scores < reject
+    uncertain = ~(accepted | rejected)
+    return np.flatnonzero(accepted), np.flatnonzero(rejected), np.flatnonzero(uncertain)
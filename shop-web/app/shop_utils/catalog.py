@@ -0,0 +1,175 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides a local, memory-mapped snapshot of the item catalog that serves item
+features (and embeddings) without the Feature Store.
+
+A catalog directory contains:
+    meta.json: item count and the string/embedding columns
+    sorted_ids.npy: (count,) item ids (bytes), sorted for binary search
+    sorted_rows.npy: (count,) row of each sorted id
+    <column>.bin: the UTF-8 bytes of a string column (e.g. name, description), in row order
+    <column>_offsets.npy: (count + 1,) offsets of each row in <column>.bin
+    <column>_embs.npy: (count, dim) embeddings (e.g. text, mm), zeros for missing rows
+    <column>_embs_mask.npy: (count,) True for the rows with an embedding
+"""
+
+import os
+import mmap
+import json
+import logging
+from typing import Any, Iterator, Optional
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+
+META_FILE = "meta.json"
+SORTED_IDS_FILE = "sorted_ids.npy"
+SORTED_ROWS_FILE = "sorted_rows.npy"
+
+STRING_COLUMNS = ["name", "description"]
+
+
+def string_file(catalog_dir: str, column: str) -> str:
+    """Path of the bytes of a string column"""
+    return os.path.join(catalog_dir, f"{column}.bin")
+
+
+def string_offsets_file(catalog_dir: str, column: str) -> str:
+    """Path of the row offsets of a string column"""
+    return os.path.join(catalog_dir, f"{column}_offsets.npy")
+
+
+def embedding_file(catalog_dir: str, column: str) -> str:
+    """Path of the embeddings of an embedding column"""
+    return os.path.join(catalog_dir, f"{column}_embs.npy")
+
+
+def embedding_mask_file(catalog_dir: str, column: str) -> str:
+    """Path of the row mask of an embedding column"""
+    return os.path.join(catalog_dir, f"{column}_embs_mask.npy")
+
+
+def map_file(path: str) -> memoryview:
+    """Memory-maps a file read-only"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b"")
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class Catalog:
+    """
+    Serves item features from a catalog directory built with
+    shop_data_prep/build_catalog.py. Strings are decoded straight from the memory-mapped
+    column files, so a lookup costs a binary search plus the decoding of the requested rows.
+    """
+
+    def __init__(self, catalog_dir: str):
+        with open(os.path.join(catalog_dir, META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.sorted_ids = np.load(os.path.join(catalog_dir, SORTED_IDS_FILE), mmap_mode="r")
+        self.sorted_rows = np.load(os.path.join(catalog_dir, SORTED_ROWS_FILE), mmap_mode="r")
+        self.strings = {
+            column: (
+                map_file(string_file(catalog_dir, column)),
+                np.load(string_offsets_file(catalog_dir, column), mmap_mode="r"),
+            )
+            for column in self.meta["string_columns"]
+        }
+        self.embeddings = {
+            column: (
+                np.load(embedding_file(catalog_dir, column), mmap_mode="r"),
+                np.load(embedding_mask_file(catalog_dir, column), mmap_mode="r"),
+            )
+            for column in self.meta["embedding_columns"]
+        }
+        logging.info(
+            "Catalog(): loaded %s: items: %d, strings: %s, embeddings: %s",
+            catalog_dir,
+            self.meta["count"],
+            list(self.strings),
+            list(self.embeddings),
+        )
+
+    def lookup(self, ids: list[str]) -> np.ndarray:
+        """Returns the rows of the ids (-1 for the ids not in the catalog)"""
+        if not ids or len(self.sorted_ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        keys = np.array([item_id.encode("utf-8") for item_id in ids], dtype=bytes)
+        positions = np.searchsorted(self.sorted_ids, keys)
+        positions = np.minimum(positions, len(self.sorted_ids) - 1)
+        found = self.sorted_ids[positions] == keys
+        return np.where(found, self.sorted_rows[positions], -1)
+
+    def get_string(self, column: str, row: int) -> str:
+        """Decodes a string column of the row from the memory-mapped bytes"""
+        buffer, offsets = self.strings[column]
+        return str(buffer[offsets[row] : offsets[row + 1]], "utf-8")
+
+    def get_embeddings(self, ids: list[str], column: str) -> tuple[np.ndarray, np.ndarray]:
+        """Returns (embeddings, found mask) of the ids from an embedding column"""
+        embs, mask = self.embeddings[column]
+        rows = self.lookup(ids)
+        found = rows >= 0
+        found[found] = mask[rows[found]]
+        result = np.zeros((len(ids), embs.shape[1]), dtype=embs.dtype)
+        result[found] = embs[rows[found]]
+        return result, found
+
+    def fetch(self, ids: list[str], feature_names: list[str]) -> dict[str, dict[str, str]]:
+        """Fetches the string features of the ids (same format as FeatureFetcher.fetch)"""
+        unique_ids = list(dict.fromkeys(ids))
+        rows = self.lookup(unique_ids)
+        found = rows >= 0
+        found_rows = rows[found]
+        f_dict = {
+            item_id: {"id": item_id}
+            for item_id, is_found in zip(unique_ids, found.tolist())
+            if is_found
+        }
+
+        # gather the offsets of all rows at once, then decode each slice of the mapped bytes
+        for column in feature_names:
+            if column not in self.strings:
+                continue
+            buffer, offsets = self.strings[column]
+            starts = offsets[found_rows].tolist()
+            ends = offsets[found_rows + 1].tolist()
+            for features, start, end in zip(f_dict.values(), starts, ends):
+                features[column] = str(buffer[start:end], "utf-8")
+        return f_dict
+
+    def iter_feature_values(
+        self, items: list[dict[str, Any]], feature_names: list[str]
+    ) -> Iterator[list[dict[str, Any]]]:
+        """Adds the features to the items (all items arrive in one chunk)"""
+        yield self.fetch_feature_values(items, feature_names)
+
+    def fetch_feature_values(
+        self, items: list[dict[str, Any]], feature_names: list[str]
+    ) -> list[dict[str, Any]]:
+        """Adds the features to the items (in the original order)"""
+        f_dict = self.fetch([item["id"] for item in items], feature_names)
+        items_with_features = []
+        for item in items:
+            features: Optional[dict[str, str]] = f_dict.get(item["id"])
+            if features is None:
+                logging.warning("fetch_feature_values(): item not found: %s", item["id"])
+                continue
+            item.update({name: features[name] for name in feature_names if name in features})
+            items_with_features.append(item)
+        return items_with_features
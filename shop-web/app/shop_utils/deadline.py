@@ -0,0 +1,110 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+This module provides the latency budget of a search, created per tool call and passed to
+every stage of the pipeline. Stages check the remaining time to skip, shrink or cut their
+work short, and pass timeout() to their outbound calls.
+
+Stages also record when they ran on the deadline (shared with its children), so that the
+timings of a search show which stages overlapped.
+"""
+
+import math
+import time
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class Deadline:
+    """A point in time by which a search should return (never, by default)"""
+
+    def __init__(self, budget: float = math.inf):
+        self.start_time = time.monotonic()
+        self.end_time = self.start_time + budget
+        self.search_start_time = self.start_time
+        self.stages: dict[str, list[float]] = {}  # stage -> [start, end] (monotonic)
+        self.stages_lock = threading.Lock()
+
+    def child(self, limit: float = math.inf, reserve: float = 0.0) -> "Deadline":
+        """
+        Returns the deadline of a stage: at most limit secs from now, and reserve secs
+        before this deadline (left for the later stages).
+        """
+        deadline = Deadline()
+        deadline.end_time = min(self.end_time - reserve, deadline.start_time + limit)
+        deadline.search_start_time = self.search_start_time
+        deadline.stages, deadline.stages_lock = self.stages, self.stages_lock
+        return deadline
+
+    def elapsed(self) -> float:
+        """Returns the secs since the deadline was created"""
+        return time.monotonic() - self.start_time
+
+    def remaining(self) -> float:
+        """Returns the secs left (inf if unbounded)"""
+        return max(self.end_time - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        """Returns True if no time is left"""
+        return self.remaining() <= 0.0
+
+    def timeout(self) -> Optional[float]:
+        """Returns the timeout for a blocking call (None if unbounded)"""
+        remaining = self.remaining()
+        return None if math.isinf(remaining) else remaining
+
+    def record_stage(self, stage: str, start_time: float, end_time: float = None) -> None:
+        """
+        Records that the stage ran from start_time to end_time (now by default). A stage
+        recorded several times (such as the boards) spans from the first start to the last end.
+        """
+        end_time = time.monotonic() if end_time is None else end_time
+        with self.stages_lock:
+            span = self.stages.setdefault(stage, [start_time, end_time])
+            span[0], span[1] = min(span[0], start_time), max(span[1], end_time)
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """Records the stage running in the with block"""
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, start_time)
+
+    def stage_timings(self) -> dict[str, tuple[float, float]]:
+        """Returns the start and end secs of the stages since the search started"""
+        with self.stages_lock:
+            return {
+                stage: (
+                    round(start - self.search_start_time, 3),
+                    round(end - self.search_start_time, 3),
+                )
+                for stage, (start, end) in self.stages.items()
+            }
+
+    def stage_overlap(self, stage: str, other_stages: list[str]) -> float:
+        """Returns the secs the stage ran alongside the other (sequential) stages"""
+        with self.stages_lock:
+            if stage not in self.stages:
+                return 0.0
+            start, end = self.stages[stage]
+            return sum(
+                max(min(end, self.stages[other][1]) - max(start, self.stages[other][0]), 0.0)
+                for other in other_stages
+                if other in self.stages
+            )
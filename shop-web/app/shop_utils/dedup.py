@@ -0,0 +1,307 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides near-duplicate detection of item descriptions with MinHash LSH.
+
+An item is a duplicate if the Levenshtein distance between its normalized description and
+the description of any kept item is <= max_dist (the same rule as comparing against every
+kept item). Instead of comparing all pairs, the candidates of a long description are the
+kept items sharing a MinHash band of character shingles, and short descriptions are only
+compared to the kept descriptions of a similar length and character histogram. Every
+candidate is then verified with the exact Levenshtein distance, so LSH can only miss
+duplicates (never add false ones).
+
+Items can also be deduped by the cosine similarity of their embeddings (dedup_by_embeddings),
+which catches visually identical items with different descriptions.
+
+Near-duplicates can also be clustered offline over the whole catalog with
+shop_data_prep/cluster_catalog.py. A cluster directory contains:
+    sorted_ids.npy: (count,) item ids (bytes), sorted for binary search
+    cluster_ids.npy: (count,) the position in sorted_ids of the cluster representative
+"""
+
+import os
+from typing import Any, Optional
+
+import numpy as np
+from Levenshtein import distance as levenshtein_distance
+
+DEFAULT_MAX_DIST = 10
+DEFAULT_SHINGLE_SIZE = 3  # bytes per shingle
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 32
+DEFAULT_MIN_LSH_LEN = 100  # shorter descriptions are compared by length buckets
+DEFAULT_MIN_COSINE = 0.97
+
+CLUSTER_SORTED_IDS_FILE = "sorted_ids.npy"
+CLUSTER_IDS_FILE = "cluster_ids.npy"
+
+MINHASH_SEED = 1
+MINHASH_BATCH_SIZE = 1024  # texts per signature batch (bounds the (num_perm, shingles) array)
+HISTOGRAM_BINS = 64
+
+
+def normalize_description(desc: str) -> str:
+    """Normalizes a description for comparison (same as the original dedup_items)"""
+    return desc.replace(" ", "").lower()
+
+
+def shingles(texts: list[str], shingle_size: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the unique byte shingles of all texts as one array and the start of each text
+    (texts shorter than shingle_size are padded with zeros).
+    """
+    if not texts:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+    encoded = [text.encode("utf-8").ljust(shingle_size, b"\0") for text in texts]
+    lengths = np.array([len(data) for data in encoded], dtype=np.int64)
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+
+    # shingles at every position, without the ones crossing the end of a text
+    position_count = len(data) - shingle_size + 1
+    values = np.zeros(position_count, dtype=np.uint64)
+    for j in range(shingle_size):
+        values = (values << np.uint64(8)) | data[j : j + position_count]
+    text_ids = np.repeat(np.arange(len(texts), dtype=np.uint64), lengths)[:position_count]
+    text_starts = np.cumsum(lengths) - lengths
+    offsets = np.arange(position_count) - text_starts[text_ids.astype(np.int64)]
+    valid = offsets <= (lengths - shingle_size)[text_ids.astype(np.int64)]
+
+    # unique (text id, shingle) pairs, sorted by text id
+    keys = np.sort((text_ids[valid] << np.uint64(32)) | values[valid])
+    keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+    starts = np.searchsorted(keys >> np.uint64(32), np.arange(len(texts), dtype=np.uint64))
+    return keys & np.uint64(0xFFFFFFFF), starts
+
+
+def char_histograms(texts: list[str]) -> np.ndarray:
+    """Returns (text count, HISTOGRAM_BINS) counts of the characters (code point mod bins)"""
+    hists = np.zeros((len(texts), HISTOGRAM_BINS), dtype=np.int32)
+    for i, text in enumerate(texts):
+        code_points = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        hists[i] = np.bincount(code_points % HISTOGRAM_BINS, minlength=HISTOGRAM_BINS)
+    return hists
+
+
+def bag_distances(hist: np.ndarray, hists: np.ndarray) -> np.ndarray:
+    """Returns lower bounds of the Levenshtein distances from the character histograms"""
+    diffs = hists - hist
+    return np.maximum(np.clip(diffs, 0, None).sum(axis=1), np.clip(-diffs, 0, None).sum(axis=1))
+
+
+class MinHasher:
+    """Computes MinHash signatures with multiply-shift hashing ((a * x + b) >> 32)"""
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, seed: int = MINHASH_SEED):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(0, 1 << 64, size=(num_perm, 1), dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 1 << 64, size=(num_perm, 1), dtype=np.uint64)
+
+    def signatures(self, values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        """Returns (text count, num_perm) signatures of the shingles from shingles()"""
+        # in place, with uint64 wraparound (shingles are < 2^32 for shingle sizes <= 4)
+        hashes = np.empty((len(self.a), len(values)), dtype=np.uint64)
+        np.multiply(self.a, values, out=hashes)
+        hashes += self.b
+        hashes >>= np.uint64(32)
+        return np.minimum.reduceat(hashes, starts, axis=1).T
+
+
+class NearDuplicateDetector:
+    """
+    Finds near-duplicate descriptions with MinHash LSH plus exact Levenshtein verification.
+    """
+
+    def __init__(
+        self,
+        max_dist: int = DEFAULT_MAX_DIST,
+        shingle_size: int = DEFAULT_SHINGLE_SIZE,
+        num_perm: int = DEFAULT_NUM_PERM,
+        bands: int = DEFAULT_BANDS,
+        min_lsh_len: int = DEFAULT_MIN_LSH_LEN,
+    ):
+        if num_perm % bands != 0:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        if not 1 <= shingle_size <= 4:
+            raise ValueError(f"shingle_size must be 1 to 4: {shingle_size}")
+        self.max_dist = max_dist
+        self.shingle_size = shingle_size
+        self.bands = bands
+        self.min_lsh_len = min_lsh_len
+        self.hasher = MinHasher(num_perm)
+
+    def band_keys(self, texts: list[str]) -> np.ndarray:
+        """Returns (text count, bands) hash keys of the MinHash bands"""
+        if not texts:
+            return np.zeros((0, self.bands), dtype=np.uint64)
+        signatures = np.concatenate(
+            [
+                self.hasher.signatures(*shingles(batch, self.shingle_size))
+                for batch in (
+                    texts[i : i + MINHASH_BATCH_SIZE]
+                    for i in range(0, len(texts), MINHASH_BATCH_SIZE)
+                )
+            ]
+        )
+        rows = signatures.reshape(len(texts), self.bands, -1)
+        weights = np.uint64(0x9E3779B97F4A7C15) ** np.arange(rows.shape[2], dtype=np.uint64)
+        return (rows * weights).sum(axis=2, dtype=np.uint64)
+
+    def is_near(self, text: str, kept_text: str) -> bool:
+        """Exact check with the Levenshtein distance"""
+        if abs(len(text) - len(kept_text)) > self.max_dist:
+            return False
+        return levenshtein_distance(text, kept_text, score_cutoff=self.max_dist) <= self.max_dist
+
+    def dedup(self, texts: list[str]) -> list[int]:
+        """Returns the indices of the texts to keep (the first of each near-duplicate group)"""
+        long_indices = [i for i, text in enumerate(texts) if len(text) >= self.min_lsh_len]
+        long_keys = dict(zip(long_indices, self.band_keys([texts[i] for i in long_indices])))
+        short_indices = [
+            i for i, text in enumerate(texts) if len(text) < self.min_lsh_len + self.max_dist
+        ]
+        short_hists = dict(zip(short_indices, char_histograms([texts[i] for i in short_indices])))
+
+        kept_indices = []
+        kept_texts = set()
+        buckets: dict[tuple[int, int], list[int]] = {}  # (band, key) -> kept indices
+        kept_by_len: dict[int, list[int]] = {}  # length -> kept indices
+        for i, text in enumerate(texts):
+            if text in kept_texts:
+                continue
+
+            # kept items sharing a band, and kept short items of a similar length
+            candidates = {}
+            keys = long_keys.get(i)
+            if keys is not None:
+                for band, key in enumerate(keys.tolist()):
+                    candidates.update(dict.fromkeys(buckets.get((band, key), [])))
+            hist = short_hists.get(i)
+            if hist is not None:
+                length_candidates = [
+                    j
+                    for length in range(len(text) - self.max_dist, len(text) + self.max_dist + 1)
+                    for j in kept_by_len.get(length, [])
+                ]
+                if length_candidates:
+                    length_candidates = np.array(length_candidates)
+                    bounds = bag_distances(
+                        hist, np.array([short_hists[j] for j in length_candidates.tolist()])
+                    )
+                    candidates.update(
+                        dict.fromkeys(length_candidates[bounds <= self.max_dist].tolist())
+                    )
+            if any(self.is_near(text, texts[j]) for j in candidates):
+                continue
+
+            kept_indices.append(i)
+            kept_texts.add(text)
+            if keys is not None:
+                for band, key in enumerate(keys.tolist()):
+                    buckets.setdefault((band, key), []).append(i)
+            if hist is not None:
+                # texts near the threshold length can be duplicates of short texts
+                kept_by_len.setdefault(len(text), []).append(i)
+        return kept_indices
+
+
+def dedup_texts_bruteforce(texts: list[str], max_dist: int = DEFAULT_MAX_DIST) -> list[int]:
+    """Returns the indices of the texts to keep by comparing all pairs (reference)"""
+    kept_indices = []
+    for i, text in enumerate(texts):
+        if all(levenshtein_distance(text, texts[j]) > max_dist for j in kept_indices):
+            kept_indices.append(i)
+    return kept_indices
+
+
+def dedup_items(
+    items: list[dict[str, Any]], detector: Optional[NearDuplicateDetector] = None
+) -> list[dict[str, Any]]:
+    """Dedup items with near-duplicate detection on the item description"""
+    detector = detector or NearDuplicateDetector()
+    texts = [normalize_description(item["description"]) for item in items]
+    return [items[i] for i in detector.dedup(texts)]
+
+
+def dedup_by_embeddings(
+    embs: np.ndarray, found: np.ndarray, min_cosine: float = DEFAULT_MIN_COSINE
+) -> list[int]:
+    """
+    Returns the indices of the items to keep: an item is dropped if the cosine similarity of
+    its embedding to a kept item is >= min_cosine. Items without an embedding (found is
+    False) are always kept.
+    """
+    embs = np.asarray(embs, dtype=np.float32)
+    norms = np.sqrt(np.einsum("ij,ij->i", embs, embs))
+    valid = np.asarray(found, dtype=bool) & (norms > 0)
+
+    # all pairs at once (dot products compared to min_cosine * norms, instead of normalizing
+    # the embeddings), keeping the pairs with an earlier item above the threshold
+    near = (embs @ embs.T) >= min_cosine * np.outer(norms, norms)
+    near &= valid[:, None] & valid[None, :]
+    near = np.tril(near, k=-1)
+
+    # greedy in order (kept if not near any earlier kept item), solved by fixed-point
+    # iteration: the first i items are final after i iterations, and chains are short
+    kept = np.ones(len(embs), dtype=bool)
+    while True:
+        next_kept = ~(near & kept[None, :]).any(axis=1)
+        if np.array_equal(next_kept, kept):
+            return np.flatnonzero(kept).tolist()
+        kept = next_kept
+
+
+class ClusterMap:
+    """
+    Maps item ids to the near-duplicate clusters built with shop_data_prep/cluster_catalog.py,
+    so that dedup is a dictionary lookup per item.
+    """
+
+    def __init__(self, cluster_dir: str):
+        self.sorted_ids = np.load(
+            os.path.join(cluster_dir, CLUSTER_SORTED_IDS_FILE), mmap_mode="r"
+        )
+        self.cluster_ids = np.load(os.path.join(cluster_dir, CLUSTER_IDS_FILE), mmap_mode="r")
+
+    def find(self, ids: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """Returns (positions in sorted_ids, found mask) of the items"""
+        if not ids or len(self.sorted_ids) == 0:
+            return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+        keys = np.array([item_id.encode("utf-8") for item_id in ids], dtype=bytes)
+        positions = np.searchsorted(self.sorted_ids, keys)
+        positions = np.minimum(positions, len(self.sorted_ids) - 1)
+        return positions, self.sorted_ids[positions] == keys
+
+    def lookup(self, ids: list[str]) -> np.ndarray:
+        """Returns the cluster ids of the items (-1 for the items not in the map)"""
+        positions, found = self.find(ids)
+        return np.where(found, self.cluster_ids[positions], -1)
+
+    def is_representative(self, ids: list[str]) -> np.ndarray:
+        """Returns True for the cluster representatives and the items not in the map"""
+        positions, found = self.find(ids)
+        return ~found | (self.cluster_ids[positions] == positions)
+
+    def dedup_items(self, items: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Keeps the first item of each cluster (items not in the map are kept)"""
+        kept_clusters = set()
+        unique_items = []
+        for item, cluster_id in zip(items, self.lookup([item["id"] for item in items]).tolist()):
+            if cluster_id < 0:
+                unique_items.append(item)
+            elif cluster_id not in kept_clusters:
+                kept_clusters.add(cluster_id)
+                unique_items.append(item)
+        return unique_items
@@ -0,0 +1,211 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+This module provides the application-wide thread pools for the blocking work, instead of
+starting a thread per call:
+
+    io_executor: outbound calls (Vector Search, Feature Store, embeddings, Ranking API and
+        Gemini requests)
+    image_executor: item image downloads (its size bounds the requests to the CDN)
+    cpu_executor: board rendering (image decoding, composition and encoding)
+    search_executor: the searches of the deep research (which wait on the other pools)
+
+Work running on a pool must not block on other work submitted to the same pool (the pool
+could be full of waiting workers). Stages that depend on each other are chained with
+then(), which submits the next stage when the previous ones are done, without holding a
+worker while waiting. Cancelling the future of a chain cancels the stages that haven't started.
+
+Each pool reports its queue depth, wait time (from submit to start) and utilization.
+
+With BOARD_RENDER_PROCESSES, the image boards are rendered on render_executor, a pool of
+processes (so the rendering doesn't contend on the GIL with the other threads). Its workers
+are forked from a server process started on the first board (forkserver), which imports the
+main module once.
+"""
+
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Union
+
+logging.basicConfig(level=logging.INFO)
+
+WAIT_TIME_SAMPLES = 1000  # recent wait times per pool for the percentiles
+
+IO_MAX_WORKERS = int(os.environ.get("IO_MAX_WORKERS", 64))
+IMAGE_MAX_WORKERS = int(os.environ.get("IMAGE_MAX_WORKERS", 64))
+CPU_MAX_WORKERS = int(os.environ.get("CPU_MAX_WORKERS", os.cpu_count() or 4))
+SEARCH_MAX_WORKERS = int(os.environ.get("SEARCH_MAX_WORKERS", 16))
+BOARD_RENDER_PROCESSES = int(os.environ.get("BOARD_RENDER_PROCESSES", 0))  # 0: CPU pool
+
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    """A ThreadPoolExecutor with queue depth, wait time and utilization metrics"""
+
+    def __init__(self, name: str, max_workers: int):
+        super().__init__(max_workers=max_workers, thread_name_prefix=name)
+        self.name = name
+        self.stats_lock = threading.Lock()
+        self.queued = 0
+        self.max_queued = 0
+        self.active = 0
+        self.completed = 0
+        self.busy_time = 0.0
+        self.wait_times = deque(maxlen=WAIT_TIME_SAMPLES)
+        self.stats_time = time.perf_counter()
+        self.stats_busy_time = 0.0
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        """Submits fn(*args, **kwargs) and measures its wait and run time"""
+        submit_time = time.perf_counter()
+
+        def run():
+            start_time = time.perf_counter()
+            with self.stats_lock:
+                self.queued -= 1
+                self.active += 1
+                self.wait_times.append(start_time - submit_time)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.stats_lock:
+                    self.active -= 1
+                    self.completed += 1
+                    self.busy_time += time.perf_counter() - start_time
+
+        def on_done(future):
+            if future.cancelled():  # cancelled before it started
+                with self.stats_lock:
+                    self.queued -= 1
+
+        with self.stats_lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        try:
+            future = super().submit(run)
+        except RuntimeError:
+            with self.stats_lock:
+                self.queued -= 1
+            raise
+        future.add_done_callback(on_done)
+        return future
+
+    def stats(self) -> dict[str, Any]:
+        """Returns the metrics (utilization since the last call)"""
+        now = time.perf_counter()
+        with self.stats_lock:
+            wait_times = sorted(self.wait_times)
+            busy_time = self.busy_time - self.stats_busy_time
+            window = now - self.stats_time
+            self.stats_time, self.stats_busy_time = now, self.busy_time
+            stats = {
+                "workers": self._max_workers,
+                "active": self.active,
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "completed": self.completed,
+            }
+        if wait_times:
+            stats["wait_p50_ms"] = wait_times[len(wait_times) // 2] * 1000
+            stats["wait_p95_ms"] = wait_times[int(len(wait_times) * 0.95)] * 1000
+        stats["utilization"] = busy_time / (window * self._max_workers) if window > 0 else 0.0
+        return stats
+
+
+io_executor = InstrumentedExecutor("io", IO_MAX_WORKERS)
+image_executor = InstrumentedExecutor("image", IMAGE_MAX_WORKERS)
+cpu_executor = InstrumentedExecutor("cpu", CPU_MAX_WORKERS)
+search_executor = InstrumentedExecutor("search", SEARCH_MAX_WORKERS)
+EXECUTORS = [io_executor, image_executor, cpu_executor, search_executor]
+render_executor = (
+    ProcessPoolExecutor(
+        BOARD_RENDER_PROCESSES, mp_context=multiprocessing.get_context("forkserver")
+    )
+    if BOARD_RENDER_PROCESSES > 0
+    else None
+)
+
+
+def executor_stats() -> dict[str, dict[str, Any]]:
+    """Returns the metrics of all pools"""
+    return {executor.name: executor.stats() for executor in EXECUTORS}
+
+
+def then(
+    futures: list[Future],
+    executor: Union[InstrumentedExecutor, ProcessPoolExecutor],
+    fn: Callable,
+) -> Future:
+    """
+    Returns a future of fn(results of the futures), submitted to the executor when all the
+    futures are done. If any of them failed, the returned future fails with its exception.
+    Cancelling the returned future cancels the futures and fn if they haven't started. On a
+    process pool, fn and the results must be picklable.
+    """
+    result_future = Future()
+    pending = [len(futures)]
+    pending_lock = threading.Lock()
+
+    def copy_result(future):
+        try:
+            if future.cancelled():
+                result_future.cancel()
+            elif future.exception() is not None:
+                result_future.set_exception(future.exception())
+            else:
+                result_future.set_result(future.result())
+        except InvalidStateError:
+            pass  # cancelled meanwhile
+
+    def on_done(_):
+        with pending_lock:
+            pending[0] -= 1
+            if pending[0] > 0:
+                return
+        for future in futures:
+            if future.cancelled() or future.exception() is not None:
+                copy_result(future)
+                return
+        if result_future.cancelled():
+            return
+        try:
+            fn_future = executor.submit(fn, [future.result() for future in futures])
+        except RuntimeError as e:
+            result_future.set_exception(e)
+            return
+        fn_future.add_done_callback(copy_result)
+        result_future.add_done_callback(cancel_if_cancelled(fn_future))
+
+    if not futures:
+        on_done(None)
+    for future in futures:
+        future.add_done_callback(on_done)
+        result_future.add_done_callback(cancel_if_cancelled(future))
+    return result_future
+
+
+def cancel_if_cancelled(future: Future) -> Callable[[Future], None]:
+    """Returns a done callback cancelling the future if the done future was cancelled"""
+
+    def on_done(done_future):
+        if done_future.cancelled():
+            future.cancel()
+
+    return on_done
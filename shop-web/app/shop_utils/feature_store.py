@@ -0,0 +1,293 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides item feature fetching from Vertex AI Feature Store online serving
+with a client-side cache.
+"""
+
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Executor
+from typing import Any, Iterator, Optional
+
+from google.api_core.exceptions import DeadlineExceeded
+from google.cloud.aiplatform_v1beta1.types import (
+    feature_online_store_service as feature_online_store_service_pb2,
+)
+
+from shop_utils.cache import TTLCache
+
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_CHUNK_SIZE = 100
+DEFAULT_MAX_STREAMS = 4
+
+
+class FeatureFetcher:
+    """
+    Fetches item features with streaming_fetch_feature_values calls, serving repeated ids
+    from an id-keyed cache and fetching only the misses. Large key sets are split into
+    chunks sent over up to max_streams parallel streams, and the responses are consumed
+    incrementally. With a timeout, fetch_feature_values returns the items fetched in time.
+    The parallel streams run on the executor if given (otherwise on their own threads).
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        feature_view_path: str,
+        cache: Optional[TTLCache] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_streams: int = DEFAULT_MAX_STREAMS,
+        executor: Optional[Executor] = None,
+    ):
+        self.client = client
+        self.feature_view_path = feature_view_path
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.max_streams = max_streams
+        self.executor = executor
+
+    def build_request(self, ids: list[str]) -> Any:
+        """Builds a StreamingFetchFeatureValuesRequest for the ids"""
+        return feature_online_store_service_pb2.StreamingFetchFeatureValuesRequest(
+            feature_view=self.feature_view_path,
+            data_keys=[
+                feature_online_store_service_pb2.FeatureViewDataKey(key=item_id)
+                for item_id in ids
+            ],
+            data_format=feature_online_store_service_pb2.FeatureViewDataFormat.KEY_VALUE,
+        )
+
+    def run_stream(
+        self, chunks: list[list[str]], timeout: Optional[float] = None
+    ) -> Iterator[dict[str, dict[str, str]]]:
+        """Sends the chunks as requests over one stream and yields the features per response"""
+        responses = self.client.streaming_fetch_feature_values(
+            requests=iter([self.build_request(chunk) for chunk in chunks]), timeout=timeout
+        )
+        for response in responses:
+            yield self.parse_response(response)
+
+    @staticmethod
+    def parse_response(response: Any) -> dict[str, dict[str, str]]:
+        """Returns the features per id of a StreamingFetchFeatureValuesResponse"""
+        f_dict = {}
+        for kv in response.data:
+            features = {"id": kv.data_key.key}
+            for f in kv.key_values.features:
+                features[f.name] = f.value.string_value
+            f_dict[features["id"]] = features
+        return f_dict
+
+    def iter_from_feature_store(
+        self, ids: list[str], timeout: Optional[float] = None
+    ) -> Iterator[dict[str, dict[str, str]]]:
+        """
+        Fetches the features of the ids from the Feature Store and yields them per chunk.
+        Raises TimeoutError or DeadlineExceeded if the timeout expires.
+        """
+        if timeout is not None and timeout <= 0:
+            raise TimeoutError("no time left for fetching features")
+        end_time = time.monotonic() + timeout if timeout is not None else None
+        chunks = [ids[i : i + self.chunk_size] for i in range(0, len(ids), self.chunk_size)]
+        stream_count = min(self.max_streams, len(chunks))
+        if stream_count <= 1:
+            yield from self.run_stream(chunks, timeout)
+            return
+
+        # Distribute the chunks over parallel streams and yield responses as they arrive
+        results: queue.Queue = queue.Queue()
+
+        def run_stream_thread(stream_chunks):
+            try:
+                for f_dict in self.run_stream(stream_chunks, timeout):
+                    results.put(f_dict)
+            except Exception as e:
+                results.put(e)
+            finally:
+                results.put(None)
+
+        for i in range(stream_count):
+            if self.executor:
+                self.executor.submit(run_stream_thread, chunks[i::stream_count])
+            else:
+                threading.Thread(
+                    target=run_stream_thread, args=(chunks[i::stream_count],), daemon=True
+                ).start()
+        finished_streams = 0
+        while finished_streams < stream_count:
+            try:
+                result = results.get(
+                    timeout=max(end_time - time.monotonic(), 0) if end_time else None
+                )
+            except queue.Empty as e:
+                raise TimeoutError("timed out fetching features") from e
+            if result is None:
+                finished_streams += 1
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                yield result
+
+    def iter_fetch(
+        self, ids: list[str], feature_names: list[str], timeout: Optional[float] = None
+    ) -> Iterator[dict[str, dict[str, str]]]:
+        """Yields the features of the ids per chunk (cache hits first)"""
+
+        # look up the cache
+        cached, missing_ids = self.lookup_cache(ids, feature_names)
+        if cached:
+            yield cached
+
+        # fetch the misses
+        if missing_ids:
+            for f_dict in self.iter_from_feature_store(missing_ids, timeout):
+                if self.cache:
+                    for item_id, features in f_dict.items():
+                        self.cache.put(item_id, features)
+                yield f_dict
+
+    def lookup_cache(
+        self, ids: list[str], feature_names: list[str]
+    ) -> tuple[dict[str, dict[str, str]], list[str]]:
+        """Returns the cached features of the ids and the ids to fetch"""
+        cached = {}
+        missing_ids = []
+        for item_id in dict.fromkeys(ids):
+            features = self.cache.get(item_id) if self.cache else None
+            if features is not None and all(name in features for name in feature_names):
+                cached[item_id] = features
+            else:
+                missing_ids.append(item_id)
+        if self.cache:
+            logging.info(
+                "FeatureFetcher.lookup_cache(): ids: %d, fetching: %d, %s",
+                len(ids),
+                len(missing_ids),
+                self.cache.stats(),
+            )
+        return cached, missing_ids
+
+    def fetch(self, ids: list[str], feature_names: list[str]) -> dict[str, dict[str, str]]:
+        """Fetches the features of the ids (from the cache if available)"""
+        f_dict = {}
+        for chunk in self.iter_fetch(ids, feature_names):
+            f_dict.update(chunk)
+        return f_dict
+
+    def iter_feature_values(
+        self,
+        items: list[dict[str, Any]],
+        feature_names: list[str],
+        timeout: Optional[float] = None,
+    ) -> Iterator[list[dict[str, Any]]]:
+        """Adds the features to the items and yields them per fetched chunk"""
+        ids = list(dict.fromkeys(item["id"] for item in items))
+        found_ids = set()
+        for f_dict in self.iter_fetch(ids, feature_names, timeout):
+            items_with_features = []
+            for item in items:
+                features = f_dict.get(item["id"])
+                if features is not None:
+                    item.update(
+                        {name: features[name] for name in feature_names if name in features}
+                    )
+                    items_with_features.append(item)
+            found_ids.update(f_dict)
+            yield items_with_features
+        for item_id in ids:
+            if item_id not in found_ids:
+                logging.warning("fetch_feature_values(): item not found: %s", item_id)
+
+    def fetch_feature_values(
+        self,
+        items: list[dict[str, Any]],
+        feature_names: list[str],
+        timeout: Optional[float] = None,
+    ) -> list[dict[str, Any]]:
+        """
+        Adds the features to the items (in the original order). If the timeout expires,
+        returns the items fetched so far.
+        """
+        found_ids = set()
+        try:
+            for items_with_features in self.iter_feature_values(items, feature_names, timeout):
+                found_ids.update(item["id"] for item in items_with_features)
+        except (TimeoutError, DeadlineExceeded):
+            logging.warning(
+                "fetch_feature_values(): timed out: items: %d, fetched: %d",
+                len(items),
+                len(found_ids),
+            )
+        return [item for item in items if item["id"] in found_ids]
+
+    async def fetch_feature_values_async(
+        self,
+        async_client: Any,
+        items: list[dict[str, Any]],
+        feature_names: list[str],
+        timeout: Optional[float] = None,
+    ) -> list[dict[str, Any]]:
+        """
+        Adds the features to the items (in the original order) with an async client
+        (FeatureOnlineStoreServiceAsyncClient), running the streams as tasks. If the timeout
+        expires (or a stream exceeds its gRPC deadline), the other streams are cancelled and the
+        items fetched so far are returned.
+        """
+        ids = list(dict.fromkeys(item["id"] for item in items))
+        f_dict, missing_ids = self.lookup_cache(ids, feature_names)
+        chunks = [
+            missing_ids[i : i + self.chunk_size]
+            for i in range(0, len(missing_ids), self.chunk_size)
+        ]
+        stream_count = min(self.max_streams, len(chunks))
+
+        async def run_stream_async(stream_chunks):
+            async def requests():
+                for chunk in stream_chunks:
+                    yield self.build_request(chunk)
+
+            responses = await async_client.streaming_fetch_feature_values(requests=requests())
+            async for response in responses:
+                fetched = self.parse_response(response)
+                if self.cache:
+                    for item_id, features in fetched.items():
+                        self.cache.put(item_id, features)
+                f_dict.update(fetched)
+
+        try:
+            async with asyncio.timeout(timeout):
+                async with asyncio.TaskGroup() as tg:
+                    for i in range(stream_count):
+                        tg.create_task(run_stream_async(chunks[i::stream_count]))
+        except* (TimeoutError, DeadlineExceeded):
+            logging.warning(
+                "fetch_feature_values_async(): timed out: items: %d, fetched: %d",
+                len(ids),
+                len(f_dict),
+            )
+
+        items_with_features = []
+        for item in items:
+            features = f_dict.get(item["id"])
+            if features is None:
+                continue
+            item.update({name: features[name] for name in feature_names if name in features})
+            items_with_features.append(item)
+        return items_with_features
@@ -39,7 +39,6 @@ from google.cloud import aiplatform
 from shop_utils.image_utils import (
     load_item_image,
     generate_item_image_board,
-    image_to_bytes,
     png_to_jpeg,
 )
 
@@ -151,10 +150,7 @@ def multimodal_filtering_25items(
     """Multimodal filtering for 25 items"""
 
     # Generate image board
-    items, item_image_board = generate_item_image_board(items)
-
-    # Convert image_board to bytearray
-    item_image_board_data = image_to_bytes(item_image_board)
+    items, item_image_board_data = generate_item_image_board(items)
 
     # Item list with item number, title and description
     item_listing = ""
@@ -0,0 +1,307 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+This module provides the pooled and hedged downloads of the item images. All downloads share
+one client with keep-alive connections (a requests session, or an httpx client with HTTP/2
+if IMAGE_HTTP2), and run on the image pool, which bounds the requests in flight (see
+executor.py), instead of a thread and a new connection per image.
+
+A download that hasn't finished after the IMAGE_HEDGE_PERCENTILE of the recent download
+latencies is hedged with a duplicate request (up to HEDGE_BUDGET of the requests), and the
+first response wins (the other one finishes in the background). A board waits for its images
+until its deadline, and the missing ones are returned as None. The hedges and deadlines are
+timed on an event loop thread.
+
+The downloaded images are kept in the thumbnail cache by key (item id and size): an in-memory
+hot tier over an optional size-bounded disk tier (THUMBNAIL_CACHE_DIR) that survives restarts,
+so the images of the popular items aren't downloaded again for each search. The concurrent
+requests for an image being downloaded (such as a board and the prefetch of its items) share
+the download, which is cancelled when none of them waits for it anymore.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Optional
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+import httpx
+
+from shop_utils.cache import TTLCache, BlobCache
+from shop_utils.executor import InstrumentedExecutor, image_executor, IMAGE_MAX_WORKERS
+
+logging.basicConfig(level=logging.INFO)
+
+IMAGE_HTTP2 = os.environ.get("IMAGE_HTTP2", "False") == "True"
+IMAGE_HEDGE_PERCENTILE = float(os.environ.get("IMAGE_HEDGE_PERCENTILE", 90))
+
+REQUEST_TIMEOUT = 2.0  # secs per request
+DEFAULT_HEDGE_DELAY = 0.3  # secs, until there are MIN_LATENCY_SAMPLES
+MIN_HEDGE_DELAY = 0.05
+MAX_HEDGE_DELAY = 1.0
+MIN_LATENCY_SAMPLES = 20
+LATENCY_SAMPLES = 1000  # recent download latencies for the hedge delay
+HEDGE_BUDGET = 0.1  # max hedged requests per request (when the CDN itself is slow)
+
+THUMBNAIL_CACHE_DIR = os.environ.get("THUMBNAIL_CACHE_DIR")  # optional disk tier
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get("THUMBNAIL_CACHE_MAX_BYTES", 2 * 1024**3))
+THUMBNAIL_HOT_MAX_BYTES = 64 * 1024 * 1024
+THUMBNAIL_TTL = 7 * 24 * 60 * 60  # secs (sellers may replace the photos)
+
+
+class ImageFetcher:
+    """Downloads images with a shared client, hedging the stragglers"""
+
+    def __init__(
+        self,
+        executor: InstrumentedExecutor = image_executor,
+        max_connections: int = IMAGE_MAX_WORKERS,
+        http2: bool = IMAGE_HTTP2,
+        hedge_percentile: Optional[float] = IMAGE_HEDGE_PERCENTILE,
+        request_timeout: float = REQUEST_TIMEOUT,
+        cache: Optional[TTLCache] = None,
+    ):
+        self.executor = executor
+        self.cache = cache
+        self.client = create_client(max_connections, http2)
+        self.hedge_percentile = hedge_percentile  # None to disable hedging
+        self.request_timeout = request_timeout
+        self.loop = None
+        self.start_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.counts = {
+            "requests": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "failed": 0,
+            "missing": 0,
+            "coalesced": 0,
+        }
+        self.inflight: dict[str, list[Any]] = {}  # key -> [fetch task, waiters] (loop thread)
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        """Starts the event loop thread (on the first download)"""
+        with self.start_lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever, name="image_fetcher", daemon=True
+                ).start()
+                self.loop = loop
+        return self.loop
+
+    def hedge_delay(self) -> float:
+        """Secs to wait before hedging a download (the percentile of the recent latencies)"""
+        with self.stats_lock:
+            if self.hedge_percentile is None or len(self.latencies) < MIN_LATENCY_SAMPLES:
+                return DEFAULT_HEDGE_DELAY
+            delay = float(np.percentile(self.latencies, self.hedge_percentile))
+        return min(max(delay, MIN_HEDGE_DELAY), MAX_HEDGE_DELAY)
+
+    def take_hedge(self) -> bool:
+        """Counts a hedged request if it's within HEDGE_BUDGET of the requests"""
+        with self.stats_lock:
+            if self.counts["hedged"] >= HEDGE_BUDGET * self.counts["requests"] + 1:
+                return False
+            self.counts["hedged"] += 1
+            return True
+
+    def download(self, url: str, key: Optional[str]) -> bytes:
+        """Downloads the url and caches it by the key (run on the image pool, raises on errors)"""
+        with self.stats_lock:
+            self.counts["requests"] += 1
+        start_time = time.perf_counter()
+        response = self.client.get(url, timeout=self.request_timeout)
+        response.raise_for_status()
+        with self.stats_lock:
+            self.latencies.append(time.perf_counter() - start_time)
+        if key is not None and self.cache is not None:
+            self.cache.put(key, response.content)
+        return response.content
+
+    def get(self, url: str, key: Optional[str]) -> asyncio.Future:
+        """Starts downloading the url on the image pool"""
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor, self.download, url, key
+        )
+
+    async def fetch(self, url: str, key: Optional[str] = None) -> Optional[bytes]:
+        """
+        Downloads the url, with a hedged request after the hedge delay (within the hedge
+        budget). Returns None if failed.
+        """
+        primary = self.get(url, key)
+        attempts = {primary}
+        hedge = None
+        error = None
+        try:
+            if self.hedge_percentile is not None:
+                done, _ = await asyncio.wait(attempts, timeout=self.hedge_delay())
+                if (primary not in done or primary.exception() is not None) and self.take_hedge():
+                    hedge = self.get(url, key)
+                    attempts.add(hedge)
+            while attempts:
+                done, attempts = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        if attempt is hedge:
+                            with self.stats_lock:
+                                self.counts["hedge_wins"] += 1
+                        return attempt.result()
+                    error = attempt.exception()
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+        logging.info("ImageFetcher: download failed: %s: %s", url, str(error))
+        with self.stats_lock:
+            self.counts["failed"] += 1
+        return None
+
+    def join(self, url: str, key: Optional[str]) -> asyncio.Task:
+        """Returns the fetch task of the url, shared by the waiters for the same key"""
+        if key is None:
+            return asyncio.ensure_future(self.fetch(url))
+        shared = self.inflight.get(key)
+        if shared is None:
+            task = asyncio.ensure_future(self.fetch(url, key))
+            task.add_done_callback(lambda done_task: self.forget(key, done_task))
+            shared = self.inflight[key] = [task, 0]
+        else:
+            with self.stats_lock:
+                self.counts["coalesced"] += 1
+        shared[1] += 1
+        return shared[0]
+
+    def leave(self, key: Optional[str], task: asyncio.Task) -> None:
+        """Stops waiting for the fetch task, and cancels it if nothing else waits for it"""
+        shared = self.inflight.get(key) if key is not None else None
+        if shared is not None and shared[0] is task:
+            shared[1] -= 1
+            if shared[1] > 0:
+                return
+            self.forget(key, task)
+        task.cancel()
+
+    def forget(self, key: str, task: asyncio.Task) -> None:
+        """Removes the fetch task of the key (done or cancelled) from the shared ones"""
+        if self.inflight.get(key, [None])[0] is task:
+            del self.inflight[key]
+
+    async def fetch_all(
+        self, urls: list[str], timeout: float, keys: list[Optional[str]], images: list[bytes]
+    ) -> list[Optional[bytes]]:
+        """
+        Downloads the urls without images (from the cache) until the timeout, and returns the
+        images (None for the missing ones). If cancelled, stops waiting for the downloads.
+        """
+        tasks = {
+            i: self.join(url, key)
+            for i, (url, key, image) in enumerate(zip(urls, keys, images))
+            if image is None
+        }
+        try:
+            done, _ = await asyncio.wait(set(tasks.values()), timeout=timeout)
+        except asyncio.CancelledError:
+            for i, task in tasks.items():
+                self.leave(keys[i], task)
+            raise
+        missing = [i for i, task in tasks.items() if task not in done]
+        for i in missing:
+            self.leave(keys[i], tasks[i])
+        if missing:
+            with self.stats_lock:
+                self.counts["missing"] += len(missing)
+        for i, task in tasks.items():
+            images[i] = task.result() if task in done else None
+        return images
+
+    def submit(
+        self, urls: list[str], timeout: float, keys: Optional[list[str]] = None
+    ) -> Future:
+        """
+        Returns a future of the images of the urls: from the cache by the keys if available,
+        or downloaded (see fetch_all)
+        """
+        keys = keys or [None] * len(urls)
+        images = [
+            self.cache.get(key) if key is not None and self.cache is not None else None
+            for key in keys
+        ]
+        if all(image is not None for image in images):
+            future = Future()
+            future.set_result(images)
+            return future
+        return asyncio.run_coroutine_threadsafe(
+            self.fetch_all(urls, timeout, keys, images), self.start()
+        )
+
+    def stats(self) -> dict[str, Any]:
+        """Returns the download counts and latency percentiles"""
+        with self.stats_lock:
+            latencies = list(self.latencies)
+            counts = dict(self.counts)
+        return {
+            **counts,
+            "latency_p50_ms": float(np.percentile(latencies, 50) * 1000) if latencies else 0.0,
+            "latency_p99_ms": float(np.percentile(latencies, 99) * 1000) if latencies else 0.0,
+            "hedge_delay_ms": self.hedge_delay() * 1000,
+            **(self.cache_stats() if self.cache is not None else {}),
+        }
+
+    def cache_stats(self) -> dict[str, Any]:
+        """Returns the metrics of the cache tiers"""
+        stats = {"cache": self.cache.stats()}
+        if self.cache.second_tier is not None:
+            stats["disk_cache"] = self.cache.second_tier.stats()
+        return stats
+
+
+def create_client(max_connections: int, http2: bool) -> Any:
+    """Returns a thread-safe HTTP client keeping up to max_connections connections alive"""
+    if http2:
+        return httpx.Client(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=max_connections, max_keepalive_connections=max_connections
+            ),
+        )
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Shared by all downloads
+thumbnail_cache = TTLCache(
+    name="thumbnail",
+    max_bytes=THUMBNAIL_HOT_MAX_BYTES,
+    ttl=THUMBNAIL_TTL,
+    sizeof=len,
+    second_tier=(
+        BlobCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_TTL)
+        if THUMBNAIL_CACHE_DIR
+        else None
+    ),
+)
+image_fetcher = ImageFetcher(cache=thumbnail_cache)
@@ -14,105 +14,339 @@
 """ Provides utils for image processing """
 
 import io
-import threading
-import queue
+import os
+import asyncio
 import base64
+import functools
+import threading
 from io import BytesIO
-from typing import Dict, Any
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Dict, Any, Optional
 import logging
 
-from PIL import Image, ImageDraw, ImageFont
-import requests
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from shop_utils.executor import cpu_executor, image_executor, render_executor, then
+from shop_utils.image_fetcher import image_fetcher, thumbnail_cache
 
 logging.basicConfig(level=logging.INFO)
 
 # Load mono space font
-font = ImageFont.truetype("./shop_utils/FreeMonoBold.ttf", 32)  # Make sure this path is correct
+FONT_PATH = "./shop_utils/FreeMonoBold.ttf"  # Make sure this path is correct
 IMAGE_LOADING_TIMEOUT = 2
+IMAGE_CDN_URL = "https://u-mercari-images.mercdn.net"
+
+# Max secs to wait for the images of a board (the missing ones are drawn as placeholders)
+BOARD_IMAGE_TIMEOUT = float(os.environ.get("BOARD_IMAGE_TIMEOUT", 1.5))
+PLACEHOLDER_COLOR = (200, 200, 200)
+LABEL_BG_COLOR = (230, 230, 230)
+BOARD_BG_COLOR = (255, 255, 255)
+
+# Encodings of a board: format and chroma subsampling
+BOARD_ENCODINGS = {
+    "jpeg": ("JPEG", "4:2:0"),
+    "jpeg420": ("JPEG", "4:2:0"),
+    "jpeg422": ("JPEG", "4:2:2"),
+    "jpeg444": ("JPEG", "4:4:4"),
+    "webp": ("WEBP", "4:2:0"),  # lossy WebP is always 4:2:0
+}
+
+
+@dataclass(frozen=True)
+class BoardLayout:
+    """
+    Geometry of an item image board (columns x rows tiles of tile_size px) and its encoding
+    (JPEG or WebP at the quality, with the chroma subsampling of JPEG)
+    """
+
+    columns: int = 5
+    rows: int = 5
+    tile_size: int = 200
+    quality: int = 75
+    image_format: str = "JPEG"
+    subsampling: str = "4:2:0"
+
+    @property
+    def capacity(self) -> int:
+        """Max number of items on a board"""
+        return self.columns * self.rows
+
+    @property
+    def size(self) -> tuple[int, int]:
+        """Board width and height in px"""
+        return self.columns * self.tile_size, self.rows * self.tile_size
+
+    @property
+    def mime_type(self) -> str:
+        """MIME type of the encoded board"""
+        return f"image/{self.image_format.lower()}"
+
+    @classmethod
+    def parse(cls, spec: str) -> "BoardLayout":
+        """
+        Parses "<columns>x<rows>@<tile_size>" with an optional "q<quality>" suffix and an
+        optional "/<encoding>" suffix (see BOARD_ENCODINGS)
+        """
+        try:
+            geometry, _, encoding = spec.strip().lower().partition("/")
+            grid, _, tile = geometry.partition("@")
+            columns, rows = grid.split("x")
+            tile_size, _, quality = tile.partition("q")
+            image_format, subsampling = BOARD_ENCODINGS[encoding or "jpeg"]
+            return cls(
+                int(columns),
+                int(rows),
+                int(tile_size),
+                int(quality) if quality else cls.quality,
+                image_format,
+                subsampling,
+            )
+        except (ValueError, KeyError) as e:
+            raise ValueError(
+                f"invalid board layout: {spec!r} (e.g. 5x5@200q75 or 5x5@200q75/webp)"
+            ) from e
+
+    def __str__(self) -> str:
+        spec = f"{self.columns}x{self.rows}@{self.tile_size}q{self.quality}"
+        if self.image_format == "WEBP":
+            return spec + "/webp"
+        if self.subsampling != "4:2:0":
+            return spec + "/jpeg" + self.subsampling.replace(":", "")
+        return spec
+
+
+DEFAULT_BOARD_LAYOUT = BoardLayout()
+
+
+@functools.lru_cache(maxsize=None)
+def get_label_font(tile_size: int) -> ImageFont.FreeTypeFont:
+    """Label font scaled to the tile size (32 for 200px tiles, readable down to 20)"""
+    return ImageFont.truetype(FONT_PATH, max(20, round(32 * tile_size / 200)))
+
+
+def item_image_url(id: str, width: int, height: int) -> str:
+    """URL of the item image on Mercari"""
+    return f"{IMAGE_CDN_URL}/photos/{id}_1.jpg?w={width}&h={height}&fitcrop"
+
+
+def item_image_key(id: str, width: int, height: int) -> str:
+    """Key of the item image in the thumbnail cache"""
+    return f"{id}:{width}x{height}"
+
+
+def submit_image_downloads(ids: list[str], width: int, height: int, timeout: float) -> Future:
+    """Starts loading the item images from the thumbnail cache or Mercari (see image_fetcher)"""
+    return image_fetcher.submit(
+        [item_image_url(id, width, height) for id in ids],
+        timeout,
+        [item_image_key(id, width, height) for id in ids],
+    )
+
+
+def load_item_images(ids: list[str], width: int, height: int) -> list[bytes]:
+    """Load item images from the thumbnail cache or Mercari (None if the download failed)"""
+    return submit_image_downloads(ids, width, height, IMAGE_LOADING_TIMEOUT).result()
+
 
 def load_item_image(id: str, width: int, height: int) -> bytes:
-    """Load item image from Mercari"""
-    try:
-        # Download the item image
-        image_url = f"https://u-mercari-images.mercdn.net/photos/{id}_1.jpg?w={width}&h={height}&fitcrop"
-        response = requests.get(image_url, stream=True, timeout=IMAGE_LOADING_TIMEOUT)
-        response.raise_for_status()
-        return response.content
-    except requests.exceptions.RequestException as e:
-        logging.info("generate_item_tile(): Image download failed: %s", str(e))
-        return None
-    except Exception:
-        logging.error(
-            "generate_item_tile(): Image processing failed: %s", exc_info=True
-        )
-        return None
+    """Load item image from the thumbnail cache or Mercari (None if the download failed)"""
+    return load_item_images([id], width, height)[0]
 
 
-def generate_item_tile(item):
-    """Generate an item tile"""
-    # Load the item image
-    item_image_bytes = load_item_image(item["id"], 200, 200)
-    if not item_image_bytes:
-        return None
-    item_image = Image.open(io.BytesIO(item_image_bytes))
+async def load_item_image_async(
+    id: str, width: int, height: int, timeout: float = IMAGE_LOADING_TIMEOUT
+) -> Optional[bytes]:
+    """
+    Load item image on an event loop: from the hot tier of the thumbnail cache, else from its
+    disk tier or Mercari, looked up on the image pool (None if the download failed)
+    """
+    image = thumbnail_cache.get(item_image_key(id, width, height), include_second_tier=False)
+    if image is not None:
+        return image
+    download_future = await asyncio.get_running_loop().run_in_executor(
+        image_executor, submit_image_downloads, [id], width, height, timeout
+    )
+    return (await asyncio.wrap_future(download_future))[0]
+
+
+def number_items(items: list[Dict[str, Any]]) -> list[str]:
+    """Numbers the items for the labels, and returns their ids"""
+    for item_number, item in enumerate(items):
+        item.update({"item_number": str(item_number)})
+    return [item["id"] for item in items]
+
+
+def submit_item_image_downloads(
+    items: list[Dict[str, Any]],
+    layout: BoardLayout = DEFAULT_BOARD_LAYOUT,
+    timeout: float = BOARD_IMAGE_TIMEOUT,
+) -> Future:
+    """
+    Numbers the items and starts downloading their images. Returns a future of the images,
+    with None for the ones that failed or didn't arrive within the timeout.
+    """
+    return submit_image_downloads(
+        number_items(items), layout.tile_size, layout.tile_size, timeout
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def get_label_sprite(tile_size: int, item_number: str) -> Image:
+    """
+    Pre-rendered "#<item_number>" label for the top left of a tile: the text on a light
+    background, with an alpha mask (the text may overflow the background)
+    """
+    label_font = get_label_font(tile_size)
+    label_scale = label_font.size / 32
+    label_text = f"#{item_number}"
+    bg_size = (round(60 * label_scale), round(40 * label_scale))
+    _, _, text_right, text_bottom = label_font.getbbox(label_text)
+    sprite = Image.new(
+        "RGBA", (max(bg_size[0], text_right), max(bg_size[1], text_bottom)), (0, 0, 0, 0)
+    )
+    sprite.paste(LABEL_BG_COLOR + (255,), (0, 0) + bg_size)
+    ImageDraw.Draw(sprite).text((0, 0), label_text, font=label_font, fill=(0, 0, 0, 255))
+    return sprite
 
-    # Paste a white background for the label at top left
-    label_bg = Image.new("RGB", (60, 40), (230, 230, 230))
-    item_image.paste(label_bg, (0, 0))
 
-    # Paste an item number label at 0, 200 of item_image
-    draw = ImageDraw.Draw(item_image)
-    label_text = f"#{item['item_number']}"
-    draw.text((0, 0), label_text, font=font, fill=(0, 0, 0))
+# Canvas of each board size, reused by the boards rendered on a thread (or render process)
+board_canvases = threading.local()
 
+
+def get_board_canvas(layout: BoardLayout) -> Image:
+    """Returns the canvas of the layout for this thread (overwritten by each board)"""
+    canvases = board_canvases.__dict__.setdefault("canvases", {})
+    if layout.size not in canvases:
+        canvases[layout.size] = Image.new("RGB", layout.size, BOARD_BG_COLOR)
+    return canvases[layout.size]
+
+
+def decode_tile(item_image_bytes: bytes, tile_size: int) -> Image:
+    """
+    Decodes the item image to fit in the tile, keeping its aspect ratio. A JPEG larger than
+    the tile is decoded at the smallest DCT scale (1/2, 1/4 or 1/8) that still covers the tile
+    (draft mode).
+    """
+    item_image = Image.open(io.BytesIO(item_image_bytes))
+    item_image.draft("RGB", (tile_size, tile_size))
+    if item_image.mode != "RGB":
+        item_image = item_image.convert("RGB")
+    if item_image.size != (tile_size, tile_size):
+        item_image = ImageOps.contain(item_image, (tile_size, tile_size))
     return item_image
 
 
+def render_board(
+    item_numbers: list[str],
+    item_images: list[Optional[bytes]],
+    layout: BoardLayout = DEFAULT_BOARD_LAYOUT,
+) -> bytes:
+    """
+    Renders the labeled tiles of the item images (placeholders for the missing ones, up to
+    layout.capacity) row by row on the canvas, and returns the encoded board
+    """
+    canvas = get_board_canvas(layout)
+    tile_size = layout.tile_size
+    for cell in range(layout.capacity):
+        x, y = cell % layout.columns * tile_size, cell // layout.columns * tile_size
+        if cell >= len(item_numbers):
+            canvas.paste(BOARD_BG_COLOR, (x, y, x + tile_size, y + tile_size))
+            continue
+        item_image = None
+        if item_images[cell]:
+            try:
+                item_image = decode_tile(item_images[cell], tile_size)
+            except Exception:
+                logging.error("render_board(): Image processing failed", exc_info=True)
+        if item_image is not None:
+            # center a non-square image on the background
+            if item_image.size != (tile_size, tile_size):
+                canvas.paste(BOARD_BG_COLOR, (x, y, x + tile_size, y + tile_size))
+            canvas.paste(
+                item_image,
+                (x + (tile_size - item_image.width) // 2, y + (tile_size - item_image.height) // 2),
+            )
+        else:
+            canvas.paste(PLACEHOLDER_COLOR, (x, y, x + tile_size, y + tile_size))
+        label_sprite = get_label_sprite(tile_size, item_numbers[cell])
+        canvas.paste(label_sprite, (x, y), label_sprite)
+    return encode_image(canvas, layout)
 
-def generate_item_image_board(items: list[Dict[str, Any]]):
-    """Generate item image board for 5 x 5 = 25 items"""
 
-    # Start download threads
-    image_tiles = []
-    image_queue = queue.Queue()
-    threads = []
-    item_number = 0
-    for item in items:
-        item.update({"item_number": str(item_number)})
-        item_number += 1
-        thread = threading.Thread(
-            target=lambda q, item: q.put(generate_item_tile(item)),
-            args=(image_queue, item),
-        )
-        thread.start()
-        threads.append(thread)
+def render_item_image_board(
+    items: list[Dict[str, Any]],
+    item_images: list[Optional[bytes]],
+    layout: BoardLayout = DEFAULT_BOARD_LAYOUT,
+) -> bytes:
+    """
+    Render the board of the numbered items and their downloaded images (on a render process
+    if BOARD_RENDER_PROCESSES, else on this thread), and return it encoded. Waits for the
+    render process: on the pools, chain submit_board_render instead.
+    """
+    item_numbers = [item["item_number"] for item in items]
+    if render_executor is None:
+        return render_board(item_numbers, item_images, layout)
+    return render_executor.submit(render_board, item_numbers, item_images, layout).result()
 
-    # Wait for all threads to complete
-    for thread in threads:
-        thread.join()
 
-    # Collect images from the queue
-    while not image_queue.empty():
-        img = image_queue.get()
-        if img is not None:
-            image_tiles.append(img)
+def submit_board_render(
+    items: list[Dict[str, Any]],
+    download_future: Future,
+    layout: BoardLayout = DEFAULT_BOARD_LAYOUT,
+) -> Future:
+    """
+    Returns a future of the encoded board of the numbered items, rendered when their image
+    downloads are done (on a render process if BOARD_RENDER_PROCESSES, else on the CPU pool)
+    """
+    return then(
+        [download_future],
+        render_executor or cpu_executor,
+        functools.partial(
+            render_downloaded_board, [item["item_number"] for item in items], layout
+        ),
+    )
 
-    # Create a background image for 1000 x 1000
-    image_board = Image.new("RGB", (1000, 1000), (255, 255, 255))
 
-    # Paste the image tiles to bg_image with 5 tiles x 5 rows
-    for y in range(0, 5):
-        for x in range(0, 5):
-            if len(image_tiles) > 0:
-                img = image_tiles.pop(0)
-                image_board.paste(img, (x * 200, y * 200))
-    return items, image_board
+def render_downloaded_board(
+    item_numbers: list[str], layout: BoardLayout, results: list[list[Optional[bytes]]]
+) -> bytes:
+    """Renders the board of the downloaded item images (the results of submit_board_render)"""
+    return render_board(item_numbers, results[0], layout)
 
 
-def image_to_bytes(image: Image) -> bytes:
-    """Convert PIL Image to bytes"""
+def generate_item_image_board(
+    items: list[Dict[str, Any]], layout: BoardLayout = DEFAULT_BOARD_LAYOUT
+):
+    """Generate the encoded item image board for up to layout.capacity items (25 by default)"""
+    item_images = submit_item_image_downloads(items, layout).result()
+    return items, render_item_image_board(items, item_images, layout)
+
+
+async def generate_item_image_board_async(
+    items: list[Dict[str, Any]], layout: BoardLayout = DEFAULT_BOARD_LAYOUT
+):
+    """Generate the encoded item image board (awaiting the downloads and the rendering)"""
+    item_images = await asyncio.wrap_future(submit_item_image_downloads(items, layout))
+    item_image_board = await asyncio.get_running_loop().run_in_executor(
+        render_executor or cpu_executor,
+        render_board,
+        [item["item_number"] for item in items],
+        item_images,
+        layout,
+    )
+    return items, item_image_board
+
+
+def encode_image(image: Image, layout: BoardLayout = DEFAULT_BOARD_LAYOUT) -> bytes:
+    """Encode the image with the format, quality and subsampling of the layout"""
     img_byte_arr = io.BytesIO()
-    image.save(img_byte_arr, format="JPEG")
+    if layout.image_format == "WEBP":
+        image.save(img_byte_arr, format="WEBP", quality=layout.quality)
+    else:
+        image.save(
+            img_byte_arr, format="JPEG", quality=layout.quality, subsampling=layout.subsampling
+        )
     return img_byte_arr.getvalue()
 
 
@@ -0,0 +1,139 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Gemini prompt and response schema of the multimodal filtering: the contents for selecting items
+from an image board, and the selected items of a response. Kept apart from query.py so the
+benchmarks can build the requests without the Vertex AI clients.
+"""
+
+import json
+
+from pydantic import BaseModel
+from google.genai.types import (
+    Part,
+    GenerateContentConfig,
+)
+
+from shop_utils.image_utils import DEFAULT_BOARD_LAYOUT
+
+
+class ItemSelectionResult(BaseModel):
+    """Schema for item selection result"""
+
+    item_numbers: list[str]
+#    reasons: list[str]
+
+
+ITEM_SELECTION_CONFIG = GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=ItemSelectionResult,
+)
+
+
+def build_multimodal_contents(
+    user_intent,
+    item_category,
+    items,
+    item_image_board_data: bytes,
+    user_uploaded_image,
+    board_mime_type: str = DEFAULT_BOARD_LAYOUT.mime_type,
+):
+    """Build the Gemini contents for selecting items from the encoded image board"""
+
+    # Item list with item number, title and description
+    item_listing = ""
+    for item in items:
+        item_line = "<item>"
+        item_line += f"<item_number>#{item['item_number']}</item_number>"
+        item_line += f"<item_name>{item['name']}</item_name>"
+        item_line += (
+            f"<item_description>{item['description'][0:200]}</item_description>"
+        )
+        item_line += "</item>"
+        item_listing += f"{item_line}\n"
+
+    # Evaluation prompt
+    eval_prompt_with_user_image = f"""
+
+        Preparation:
+
+        A user is visiting an e-commerce site.  The user's intent is "{user_intent}", and they are
+        searching for "{item_category}" that fits the first image shared by the user. Based on the
+        first image, predict what kind of profile and preference the user would have.
+ 
+        Question:
+
+        The second image is the items found on the site. The Item List below has the detail of each
+        item. From these items, select items that best match with the user's preference, the user 
+        intent and item category. Return a list of the selected item numbers 
+        (starting with #). 
+        Do not include any items irrelevant to the user intent or item category.
+
+        Item List:
+        {item_listing}
+
+        """
+    eval_prompt_without_user_image = f"""
+
+        Preparation:
+
+        A user is visiting an e-commerce site.  The user's intent is "{user_intent}", and they are
+        searching for "{item_category}".
+
+        Question:
+
+        The image is the items found on the site. The Item List below has the detail of each
+        item. From these items, select items best match with the user intent and item category. 
+        Return a list of the selected item numbers (starting with #).
+        Do not include any items irrelevant to the user intent or item category.
+
+        Item List:
+        {item_listing}
+
+        """
+
+    # Prepare contents and prompt
+    if user_uploaded_image:
+        contents = [
+            Part.from_bytes(data=user_uploaded_image, mime_type="image/jpeg"),
+            eval_prompt_with_user_image,
+            Part.from_bytes(data=item_image_board_data, mime_type=board_mime_type),
+        ]
+    else:
+        contents = [
+            eval_prompt_without_user_image,
+            Part.from_bytes(data=item_image_board_data, mime_type=board_mime_type),
+        ]
+    return contents
+
+
+def select_items(items, response_text):
+    """Select the items of the item numbers in the Gemini response"""
+    decoded_response = json.loads(response_text)
+    item_numbers = decoded_response["item_numbers"]
+#    reasons = decoded_response["reasons"]
+#    logging.info("select_items(): reasons %s", reasons)
+
+    # Filter and rerank items
+    items_by_number = {item["item_number"]: item for item in items}
+    reranked_items = []
+    for item_number in item_numbers:
+        item_number = (
+            item_number.lstrip("#") if item_number.startswith("#") else item_number
+        )
+        if item_number in items_by_number:
+            reranked_items.append(items_by_number[item_number])
+    return reranked_items
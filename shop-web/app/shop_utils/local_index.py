@@ -0,0 +1,270 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides a local in-process ANN index (IVF with dot product scoring)
+that can serve find_neighbors() and read_index_datapoints() in place of the Vertex AI
+Vector Search endpoint.
+
+An index directory contains:
+    meta.json: dimensions, number of lists and item count
+    centroids.npy: (nlist, dim) float32 centroids of the inverted lists
+    offsets.npy: (nlist + 1,) int64 row offsets of each list
+    vectors.npy: (count, dim) vectors sorted by list (memory-mapped)
+    ids.npy: (count,) item ids sorted by list (memory-mapped)
+"""
+
+import os
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+
+META_FILE = "meta.json"
+CENTROIDS_FILE = "centroids.npy"
+OFFSETS_FILE = "offsets.npy"
+VECTORS_FILE = "vectors.npy"
+IDS_FILE = "ids.npy"
+
+DEFAULT_NLIST = 4096
+DEFAULT_NPROBE = 32
+KMEANS_SAMPLE_SIZE = 200000
+KMEANS_ITERATIONS = 10
+ASSIGN_BATCH_SIZE = 65536
+
+
+@dataclass
+class LocalNeighbor:
+    """A neighbor with the same fields as MatchNeighbor used by run_queries()"""
+
+    id: str
+    distance: float
+    sparse_distance: Optional[float] = None
+
+
+@dataclass
+class LocalDatapoint:
+    """A datapoint with the same fields as IndexDatapoint used by read_index_datapoints()"""
+
+    datapoint_id: str
+    feature_vector: list[float]
+
+
+#
+# Index building
+#
+
+
+def assign_lists(vectors: Any, centroids: np.ndarray) -> np.ndarray:
+    """Assigns each vector to the list of the centroid with the largest dot product"""
+    assign = np.empty(len(vectors), dtype=np.int32)
+    for i in range(0, len(vectors), ASSIGN_BATCH_SIZE):
+        chunk = np.asarray(vectors[i : i + ASSIGN_BATCH_SIZE], dtype=np.float32)
+        assign[i : i + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assign
+
+
+def train_centroids(
+    vectors: Any,
+    nlist: int,
+    sample_size: int = KMEANS_SAMPLE_SIZE,
+    iterations: int = KMEANS_ITERATIONS,
+    seed: int = 0,
+) -> np.ndarray:
+    """Trains spherical k-means centroids on a random sample of the vectors"""
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(
+        rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False)
+    )
+    sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+    nlist = min(nlist, len(sample))
+
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = assign_lists(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+
+        # reseed empty lists with random sample vectors
+        counts = np.bincount(assign, minlength=nlist)
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+def build_index(
+    vectors: Any,
+    ids: Iterable[str],
+    index_dir: str,
+    nlist: int = DEFAULT_NLIST,
+    dtype: str = "float16",
+) -> None:
+    """
+    Builds a local IVF index from vectors and their item ids.
+
+    Args:
+        vectors: a (count, dim) array or memmap of item embeddings.
+        ids: the item ids in the same order as vectors.
+        index_dir: the directory to write the index files to.
+        nlist: the number of inverted lists.
+        dtype: the dtype for storing the vectors ("float16" or "float32").
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    ids = np.asarray(ids, dtype=np.bytes_)
+    count, dim = vectors.shape
+
+    # Train centroids and assign all vectors to the lists
+    logging.info("build_index(): training %d centroids for %d vectors", nlist, count)
+    centroids = train_centroids(vectors, nlist)
+    assign = assign_lists(vectors, centroids)
+    order = np.argsort(assign, kind="stable")
+    offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assign, minlength=len(centroids)))
+
+    # Write the vectors sorted by list, so each list is a contiguous slice
+    logging.info("build_index(): writing vectors to %s", index_dir)
+    sorted_vectors = np.lib.format.open_memmap(
+        os.path.join(index_dir, VECTORS_FILE), mode="w+", dtype=dtype, shape=(count, dim)
+    )
+    for i in range(0, count, ASSIGN_BATCH_SIZE):
+        sorted_vectors[i : i + ASSIGN_BATCH_SIZE] = vectors[order[i : i + ASSIGN_BATCH_SIZE]]
+    sorted_vectors.flush()
+    del sorted_vectors
+
+    np.save(os.path.join(index_dir, IDS_FILE), ids[order])
+    np.save(os.path.join(index_dir, CENTROIDS_FILE), centroids)
+    np.save(os.path.join(index_dir, OFFSETS_FILE), offsets)
+    with open(os.path.join(index_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump({"count": count, "dim": dim, "nlist": len(centroids)}, f)
+
+
+#
+# Index serving
+#
+
+
+class LocalIndex:
+    """
+    A memory-mapped IVF index searched with dot product (higher is closer).
+    """
+
+    def __init__(self, index_dir: str, nprobe: int = DEFAULT_NPROBE):
+        with open(os.path.join(index_dir, META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.centroids = np.load(os.path.join(index_dir, CENTROIDS_FILE))
+        self.offsets = np.load(os.path.join(index_dir, OFFSETS_FILE))
+        self.vectors = np.load(os.path.join(index_dir, VECTORS_FILE), mmap_mode="r")
+        self.ids = np.load(os.path.join(index_dir, IDS_FILE), mmap_mode="r")
+        self.nprobe = min(nprobe, len(self.centroids))
+        self.id_order = None  # row order sorted by id, built on the first lookup
+        logging.info(
+            "LocalIndex(): loaded %s: count: %d, dim: %d, nlist: %d",
+            index_dir,
+            self.meta["count"],
+            self.meta["dim"],
+            self.meta["nlist"],
+        )
+
+    def search(self, query: Any, num_neighbors: int) -> list[tuple[str, float]]:
+        """Returns (id, dot product) of the nearest neighbors of the query vector"""
+        query = np.asarray(query, dtype=np.float32)
+
+        # Pick the lists to probe
+        centroid_scores = self.centroids @ query
+        probes = np.argpartition(-centroid_scores, self.nprobe - 1)[: self.nprobe]
+
+        # Score all vectors in the probed lists
+        scores = []
+        rows = []
+        for probe in probes:
+            start, end = self.offsets[probe], self.offsets[probe + 1]
+            if start == end:
+                continue
+            scores.append(np.asarray(self.vectors[start:end], dtype=np.float32) @ query)
+            rows.append(np.arange(start, end))
+        if not scores:
+            return []
+        scores = np.concatenate(scores)
+        rows = np.concatenate(rows)
+
+        # Pick the top k
+        k = min(num_neighbors, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[rows[i]].decode("utf-8"), float(scores[i])) for i in top]
+
+    def lookup(self, ids: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """Returns (rows, found mask) of the item ids"""
+        if self.id_order is None:
+            self.id_order = np.argsort(self.ids, kind="stable")
+        if not ids or len(self.id_order) == 0:
+            return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+        keys = np.array([item_id.encode("utf-8") for item_id in ids], dtype=bytes)
+        positions = np.searchsorted(self.ids, keys, sorter=self.id_order)
+        rows = self.id_order[np.minimum(positions, len(self.id_order) - 1)]
+        return rows, self.ids[rows] == keys
+
+
+class LocalIndexEndpoint:
+    """
+    Serves find_neighbors() from local indexes with the same interface as
+    MatchingEngineIndexEndpoint. Only dense embeddings are used, so sparse_distance
+    of the neighbors is always None.
+    """
+
+    def __init__(self, index_dirs: dict[str, str], nprobe: int = DEFAULT_NPROBE):
+        self.indexes = {
+            deployed_index_id: LocalIndex(index_dir, nprobe)
+            for deployed_index_id, index_dir in index_dirs.items()
+        }
+
+    def find_neighbors(
+        self,
+        deployed_index_id: str,
+        queries: list[Any],
+        num_neighbors: int,
+        **kwargs,
+    ) -> list[list[LocalNeighbor]]:
+        """Finds neighbors for HybridQuery objects or plain dense vectors"""
+        index = self.indexes[deployed_index_id]
+        results = []
+        for query in queries:
+            dense_emb = getattr(query, "dense_embedding", query)
+            neighbors = index.search(dense_emb, num_neighbors)
+            results.append(
+                [LocalNeighbor(id=item_id, distance=dist) for item_id, dist in neighbors]
+            )
+        return results
+
+    def read_index_datapoints(
+        self, deployed_index_id: str, ids: list[str]
+    ) -> list[LocalDatapoint]:
+        """Reads the vectors of the ids (the ids not in the index are skipped)"""
+        index = self.indexes[deployed_index_id]
+        rows, found = index.lookup(ids)
+        return [
+            LocalDatapoint(
+                datapoint_id=item_id,
+                feature_vector=np.asarray(index.vectors[row], dtype=np.float32).tolist(),
+            )
+            for item_id, row, is_found in zip(ids, rows.tolist(), found.tolist())
+            if is_found
+        ]
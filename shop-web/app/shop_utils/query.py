@@ -17,31 +17,25 @@ This module provides a hybrid search with Mercari dataset.
 """
 
 import os
-from typing import Any
+from typing import Any, Callable
 import logging
 import threading
 import queue
 import time
-import json
+import base64
+import functools
+from concurrent.futures import wait as wait_futures
 
-from pydantic import BaseModel
+import numpy as np
 import joblib
-from Levenshtein import distance as levenshtein_distance
 
 from google import genai
-from google.genai.types import (
-    Part,
-    GenerateContentConfig,
-)
 
 from google.cloud import aiplatform
 from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import (
     HybridQuery,
 )
 from google.cloud.aiplatform_v1beta1 import FeatureOnlineStoreServiceClient
-from google.cloud.aiplatform_v1beta1.types import (
-    feature_online_store_service as feature_online_store_service_pb2,
-)
 from google.cloud import discoveryengine_v1 as discoveryengine
 
 from vertexai.language_models import (
@@ -49,10 +43,44 @@ from vertexai.language_models import (
     TextEmbeddingModel,
 )
 from vertexai.vision_models import (
+    Image as MMImage,
     MultiModalEmbeddingModel,
 )
 
-from shop_utils.image_utils import generate_item_image_board, image_to_bytes
+from shop_utils.image_utils import (
+    BoardLayout,
+    DEFAULT_BOARD_LAYOUT,
+    submit_image_downloads,
+    submit_item_image_downloads,
+    submit_board_render,
+)
+from shop_utils.item_selection import (
+    ITEM_SELECTION_CONFIG,
+    build_multimodal_contents,
+    select_items,
+)
+from shop_utils.executor import io_executor, then
+from shop_utils.local_index import LocalIndexEndpoint, DEFAULT_NPROBE
+from shop_utils.cache import TTLCache, SqliteCache
+from shop_utils.sparse_encoder import SparseEncoder
+from shop_utils.lexical_scorer import LexicalScorer
+from shop_utils.deadline import Deadline
+from shop_utils.feature_store import FeatureFetcher, DEFAULT_CHUNK_SIZE, DEFAULT_MAX_STREAMS
+from shop_utils.catalog import Catalog
+from shop_utils.verdict_cache import VerdictCache, hash_image
+from shop_utils.cascade import (
+    DEFAULT_ACCEPT_COSINE,
+    DEFAULT_REJECT_COSINE,
+    score_by_embeddings,
+    partition_by_scores,
+)
+from shop_utils.dedup import (
+    NearDuplicateDetector,
+    ClusterMap,
+    DEFAULT_MIN_COSINE,
+    dedup_by_embeddings,
+    dedup_items as near_dup_dedup_items,
+)
 
 logging.basicConfig(level=logging.INFO)
 
@@ -65,26 +93,95 @@ LOCATION: str = os.environ.get("LOCATION", "us-central1")
 
 aiplatform.init(project=PROJECT_ID, location=LOCATION)
 
+#
+# Query embedding cache (dense and sparse embeddings keyed by modality and query text)
+#
+
+QUERY_EMB_CACHE_MAX_BYTES = 64 * 1024 * 1024
+QUERY_EMB_CACHE_TTL = 24 * 60 * 60  # secs
+QUERY_EMB_CACHE_PATH = os.environ.get("QUERY_EMB_CACHE_PATH")  # optional SQLite file
+
+query_emb_cache = TTLCache(
+    name="query_emb",
+    max_bytes=QUERY_EMB_CACHE_MAX_BYTES,
+    ttl=QUERY_EMB_CACHE_TTL,
+    second_tier=(
+        SqliteCache(QUERY_EMB_CACHE_PATH, QUERY_EMB_CACHE_TTL)
+        if QUERY_EMB_CACHE_PATH
+        else None
+    ),
+)
+
+
+def query_emb_cache_key(modality: str, query: str) -> str:
+    """Cache key with the modality and the normalized query text"""
+    return f"{modality}:{' '.join(query.lower().split())}"
+
+
+def get_cached_embeddings(modality, queries, generation_func):
+    """Get embeddings from the cache and generate the missing ones with generation_func"""
+    keys = [query_emb_cache_key(modality, query) for query in queries]
+    embs = {key: query_emb_cache.get(key) for key in dict.fromkeys(keys)}
+
+    # generate the missing embeddings in a batch
+    missing_keys = [key for key, emb in embs.items() if emb is None]
+    if missing_keys:
+        missing_queries = [queries[keys.index(key)] for key in missing_keys]
+        for key, emb in zip(missing_keys, generation_func(missing_queries)):
+            query_emb_cache.put(key, emb)
+            embs[key] = emb
+    return [embs[key] for key in keys]
+
+
 #
 # Sparse embeddings with TF-IDF
 #
 
-vectorizer = joblib.load("./shop_utils/mercari3m_vectorizer.joblib")
+# Use the compact encoder exported by shop_data_prep/export_sparse_encoder.py if available
+SPARSE_ENCODER_DIR = "./shop_utils/mercari3m_tfidf"
+SPARSE_VECTORIZER_PATH = "./shop_utils/mercari3m_vectorizer.joblib"
 
+if os.path.exists(SPARSE_ENCODER_DIR):
+    sparse_encoder = SparseEncoder(SPARSE_ENCODER_DIR)
+    vectorizer = None
+else:
+    sparse_encoder = None
+    vectorizer = joblib.load(SPARSE_VECTORIZER_PATH)
+
+
+def generate_sparse_embeddings(queries):
+    """generate sparse embeddings for the query texts"""
+
+    # Encode Texts with the compact encoder
+    if sparse_encoder:
+        return [
+            {"values": values.tolist(), "dimensions": indices.tolist()}
+            for indices, values in sparse_encoder.transform(queries)
+        ]
+
+    # Transform Texts into TF-IDF Sparse Vectors
+    tfidf_vectors = vectorizer.transform(queries)
+
+    # Create Sparse Embedding for each Text
+    sparse_embs = []
+    for tfidf_vector in tfidf_vectors:
+        values = []
+        dims = []
+        for i, tfidf_value in enumerate(tfidf_vector.data):
+            values.append(float(tfidf_value))
+            dims.append(int(tfidf_vector.indices[i]))
+        sparse_embs.append({"values": values, "dimensions": dims})
+    return sparse_embs
 
-def get_sparse_embedding(query):
-    """get sparse embedding for the query text"""
 
-    # Transform Text into TF-IDF Sparse Vector
-    tfidf_vector = vectorizer.transform([query])
+def get_sparse_embeddings(queries):
+    """get sparse embeddings for the query texts (from the cache if available)"""
+    return get_cached_embeddings("sparse", queries, generate_sparse_embeddings)
 
-    # Create Sparse Embedding for the New Text
-    values = []
-    dims = []
-    for i, tfidf_value in enumerate(tfidf_vector.data):
-        values.append(float(tfidf_value))
-        dims.append(int(tfidf_vector.indices[i]))
-    return {"values": values, "dimensions": dims}
+
+def get_sparse_embedding(query):
+    """get sparse embedding for the query text"""
+    return get_sparse_embeddings([query])[0]
 
 
 #
@@ -92,14 +189,32 @@ def get_sparse_embedding(query):
 #
 
 text_emb_model = TextEmbeddingModel.from_pretrained("text-embedding-005")
+TEXT_EMB_TASK_TYPE = "QUESTION_ANSWERING"
+TEXT_EMB_BATCH_SIZE = 250  # max number of texts per request
+
+
+def generate_text_embeddings(queries):
+    """generate text embeddings for the query texts in batches."""
+    embeddings = []
+    for i in range(0, len(queries), TEXT_EMB_BATCH_SIZE):
+        text_emb_inputs = [
+            TextEmbeddingInput(query, TEXT_EMB_TASK_TYPE)
+            for query in queries[i : i + TEXT_EMB_BATCH_SIZE]
+        ]
+        embeddings.extend(
+            emb.values for emb in text_emb_model.get_embeddings(text_emb_inputs)
+        )
+    return embeddings
+
+
+def get_text_embeddings(queries):
+    """get text embeddings for the query texts (from the cache if available)"""
+    return get_cached_embeddings("text", queries, generate_text_embeddings)
 
 
 def get_text_embedding(query):
     """generate text embedding for the query text."""
-    emb_task_type = "QUESTION_ANSWERING"
-    text_emb_inputs = [TextEmbeddingInput(query, emb_task_type)]
-    embeddings = text_emb_model.get_embeddings(text_emb_inputs)
-    return embeddings[0].values
+    return get_text_embeddings([query])[0]
 
 
 #
@@ -111,7 +226,7 @@ MM_EMB_DIMENSIONALITY = 1408
 mm_emb_model = MultiModalEmbeddingModel.from_pretrained(MM_EMB_MODEL_NAME)
 
 
-def get_mm_embedding(query):
+def generate_mm_embedding(query):
     """
     Generate multimodal embeddings for items.
     """
@@ -122,6 +237,13 @@ def get_mm_embedding(query):
     return emb.image_embedding
 
 
+def get_mm_embedding(query):
+    """get multimodal embedding for the query text (from the cache if available)"""
+    return get_cached_embeddings(
+        "mm", [query], lambda queries: [generate_mm_embedding(queries[0])]
+    )[0]
+
+
 #
 # Vector Search
 #
@@ -136,34 +258,48 @@ DENSE_DIST_THRESHOLD = 0.0
 RRF_ALPHA_TEXT = 0.5
 RRF_ALPHA_MM = 1.0  # use no sparse results for mm search
 
-vvs_endpoint = aiplatform.MatchingEngineIndexEndpoint(VVS_ENDPOINT_ID)
+# Vector search backend: "vvs" (Vertex AI Vector Search) or "local" (in-process IVF index
+# built with shop_data_prep/build_local_index.py)
+VECTOR_SEARCH_BACKEND = os.environ.get("VECTOR_SEARCH_BACKEND", "vvs")
+LOCAL_INDEX_DIR = os.environ.get("LOCAL_INDEX_DIR", "./local_index")
+LOCAL_INDEX_NPROBE = int(os.environ.get("LOCAL_INDEX_NPROBE", DEFAULT_NPROBE))
+
+if VECTOR_SEARCH_BACKEND == "local":
+    vvs_endpoint = LocalIndexEndpoint(
+        {
+            VVS_DEPLOYED_INDEX_ID: os.path.join(LOCAL_INDEX_DIR, "text"),
+            VVS_DEPLOYED_INDEX_ID_MM: os.path.join(LOCAL_INDEX_DIR, "mm"),
+        },
+        nprobe=LOCAL_INDEX_NPROBE,
+    )
+else:
+    vvs_endpoint = aiplatform.MatchingEngineIndexEndpoint(VVS_ENDPOINT_ID)
+
+
+def build_hybrid_query(dense_emb, sparse_emb, is_text=True):
+    """Build a HybridQuery object from the dense and sparse embs"""
+    return HybridQuery(
+        dense_embedding=dense_emb,
+        sparse_embedding_dimensions=sparse_emb["dimensions"],
+        sparse_embedding_values=sparse_emb["values"],
+        rrf_ranking_alpha=RRF_ALPHA_TEXT if is_text else RRF_ALPHA_MM,
+    )
 
 
 def create_hybrid_query(query, is_text=True):
     """Create a HybridQuery object for the query text"""
 
-    # generate dense and/or sparse embs
-    dense_emb = None
-    sparse_dims = None
-    sparse_values = None
+    # generate dense and sparse embs
     dense_emb = get_text_embedding(query) if is_text else get_mm_embedding(query)
     sparse_emb = get_sparse_embedding(query)
-    sparse_dims = sparse_emb["dimensions"]
-    sparse_values = sparse_emb["values"]
+    return build_hybrid_query(dense_emb, sparse_emb, is_text)
 
-    return HybridQuery(
-        dense_embedding=dense_emb,
-        sparse_embedding_dimensions=sparse_dims,
-        sparse_embedding_values=sparse_values,
-        rrf_ranking_alpha=RRF_ALPHA_TEXT if is_text else RRF_ALPHA_MM,
-    )
 
-
-def run_vvs_query(hybrid_query, query_rows, deployed_index_id):
-    """Run vector search"""
+def run_vvs_query(hybrid_queries, query_rows, deployed_index_id):
+    """Run vector search for a list of queries (returns a list of neighbors per query)"""
     response = vvs_endpoint.find_neighbors(
         deployed_index_id=deployed_index_id,
-        queries=[hybrid_query],
+        queries=hybrid_queries,
         num_neighbors=query_rows,
     )
     return response
@@ -185,43 +321,56 @@ FS_FEATUREVIEW_PATH = (
 )
 
 
-def fetch_feature_values(items, feature_names):
-    """Fetches feature values"""
+# Client-side cache of item features (names and descriptions rarely change)
+FEATURE_CACHE_MAX_BYTES = 128 * 1024 * 1024
+FEATURE_CACHE_TTL = 60 * 60  # secs
 
-    # build a list of FeatureViewDataKey objects
-    data_keys = [
-        feature_online_store_service_pb2.FeatureViewDataKey(key=item["id"])
-        for item in items
-    ]
+feature_cache = TTLCache(
+    name="feature", max_bytes=FEATURE_CACHE_MAX_BYTES, ttl=FEATURE_CACHE_TTL
+)
 
-    # build a request
-    request = feature_online_store_service_pb2.StreamingFetchFeatureValuesRequest(
-        feature_view=FS_FEATUREVIEW_PATH,
-        data_keys=data_keys,
-        data_format=feature_online_store_service_pb2.FeatureViewDataFormat.KEY_VALUE,
-    )
+# Keys per StreamingFetchFeatureValuesRequest, and parallel streams per fetch
+FS_FETCH_CHUNK_SIZE = int(os.environ.get("FS_FETCH_CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+FS_FETCH_MAX_STREAMS = int(os.environ.get("FS_FETCH_MAX_STREAMS", DEFAULT_MAX_STREAMS))
+
+feature_fetcher = FeatureFetcher(
+    fs_data_client,
+    FS_FEATUREVIEW_PATH,
+    feature_cache,
+    chunk_size=FS_FETCH_CHUNK_SIZE,
+    max_streams=FS_FETCH_MAX_STREAMS,
+    executor=io_executor,
+)
 
-    # fetch features
-    f_dict = {}
-    key_values = fs_data_client.streaming_fetch_feature_values(requests=iter([request]))
-    key_values = [item.data for item in key_values][0]
 
-    for kv in key_values:
-        features = {"id": kv.data_key.key}
-        for f in kv.key_values.features:
-            if f.name in feature_names:
-                features.update({f.name: f.value.string_value})
-        f_dict[features["id"]] = features
+# Feature backend: "featurestore" (Vertex AI Feature Store) or "catalog" (local snapshot
+# built with shop_data_prep/build_catalog.py)
+FEATURE_BACKEND = os.environ.get("FEATURE_BACKEND", "featurestore")
+CATALOG_DIR = os.environ.get("CATALOG_DIR", "./catalog")
 
-    # sort features
-    items_with_features = []
-    for item in items:
-        try:
-            item.update(f_dict[item["id"]])
-            items_with_features.append(item)
-        except KeyError:
-            logging.warning("fetch_feature_values(): item not found: %s", item["id"])
-    return items_with_features
+catalog = Catalog(CATALOG_DIR) if FEATURE_BACKEND == "catalog" else None
+
+
+FEATURE_FETCH_TIMEOUT = 3.0  # max secs for fetching the features of the retrieved items
+
+
+def fetch_feature_values(items, feature_names, deadline: Deadline = None):
+    """Fetches feature values (the items fetched so far when the deadline expires)"""
+    if catalog:
+        return catalog.fetch_feature_values(items, feature_names)
+    timeout = deadline.timeout() if deadline else None
+    return feature_fetcher.fetch_feature_values(items, feature_names, timeout)
+
+
+def iter_feature_values(items, feature_names, deadline: Deadline = None):
+    """
+    Fetches feature values and yields the items per chunk as they arrive (raises TimeoutError
+    when the deadline expires)
+    """
+    if catalog:
+        return catalog.iter_feature_values(items, feature_names)
+    timeout = deadline.timeout() if deadline else None
+    return feature_fetcher.iter_feature_values(items, feature_names, timeout)
 
 
 #
@@ -237,6 +386,33 @@ ranking_config = rank_client.ranking_config_path(
 )
 
 RANK_MODEL = "semantic-ranker-512@latest"
+RANK_MAX_RECORDS = 200  # ranking api can't take over 200 rows
+
+# Top candidates ranked again in a single request after merging the chunks (0 to disable)
+RANK_TOURNAMENT_SIZE = min(int(os.environ.get("RANK_TOURNAMENT_SIZE", 0)), RANK_MAX_RECORDS)
+
+# Secs to wait for the ranking api before falling back to the local lexical scores
+RANK_DEADLINE = float(os.environ.get("RANK_DEADLINE", 2.0))
+lexical_scorer = (
+    LexicalScorer.from_sparse_encoder(sparse_encoder)
+    if sparse_encoder
+    else LexicalScorer.from_vectorizer(vectorizer)
+)
+
+# text_rerank outcomes: "ranked" (ranking api), "timeout" and "error" (local fallback)
+rank_stats_lock = threading.Lock()
+rank_stats = {"ranked": 0, "timeout": 0, "error": 0}
+
+
+def count_rank_outcome(outcome: str) -> dict[str, Any]:
+    """Counts a text_rerank outcome and returns the metrics"""
+    with rank_stats_lock:
+        rank_stats[outcome] += 1
+        requests = sum(rank_stats.values())
+        return {
+            **rank_stats,
+            "fallback_ratio": (rank_stats["timeout"] + rank_stats["error"]) / requests,
+        }
 
 
 def get_rank_records(items):
@@ -255,56 +431,270 @@ def get_rank_records(items):
                 content=description,
             )
         )
-    return records[:200] # ranking api can't take over 200 rows
+    return records
 
 
-def text_rerank(query, items, rows):
-    """
-    Rerank the features.
-    """
-    # call ranking api
+def rank_records(query, records, rows, timeout=None):
+    """Ranks up to RANK_MAX_RECORDS records and returns the top (id, score) pairs"""
     rank_request = discoveryengine.RankRequest(
         ranking_config=ranking_config,
         model=RANK_MODEL,
         top_n=rows,
         query=query,
-        records=get_rank_records(items),
+        records=records,
         ignore_record_details_in_response=True,
     )
-    response = rank_client.rank(request=rank_request)
+    response = rank_client.rank(request=rank_request, timeout=timeout)
+    return [(r.id, r.score) for r in response.records]
+
+
+def merge_rank_scores(chunk_scores, rows):
+    """Merges the (id, score) pairs of the chunks by score (ties keep the original rank)"""
+    scores = [score for scores in chunk_scores for score in scores]
+    scores.sort(key=lambda id_score: id_score[1], reverse=True)
+    return scores[:rows]
+
+
+def get_tournament_records(records, scores):
+    """Returns the records of the top candidates to rank again in one request"""
+    top_ids = {item_id for item_id, _ in scores[:RANK_TOURNAMENT_SIZE]}
+    return [record for record in records if record.id in top_ids]
 
-    # rerank the features (using the original rank as secondary rank)
+
+def get_local_rank_scores(items, local_scores, rows):
+    """Returns the top (id, score) pairs by the local lexical scores"""
+    order = np.argsort(-local_scores, kind="stable")[:rows].tolist()
+    return [(items[i]["id"], float(local_scores[i])) for i in order]
+
+
+def get_reranked_items(items, scores):
+    """Returns the items in the order of the (id, score) pairs, with the rerank_score"""
     items_dict = {item["id"]: item for item in items}
     reranked_items = []
-    for r in response.records:
-        f = {"id": r.id, "rerank_score": r.score}
-        f.update(items_dict[r.id])
+    for item_id, score in scores:
+        f = {"id": item_id, "rerank_score": score}
+        f.update(items_dict[item_id])
         reranked_items.append(f)
     return reranked_items
 
 
+def text_rerank(query, items, rows, deadline: Deadline = None):
+    """
+    Rerank the features. More than RANK_MAX_RECORDS items are ranked in chunks in parallel,
+    and the scores are merged into one order (optionally with a second round for the top).
+    If the ranking api doesn't answer within RANK_DEADLINE (or the deadline), the items are
+    ordered by the local lexical scores instead.
+    """
+    rank_deadline = (deadline or Deadline()).child(limit=RANK_DEADLINE)
+    if rank_deadline.expired():
+        # no time left for the ranking api
+        local_scores = lexical_scorer.score(query, items)
+        outcome = "timeout"
+    else:
+        # call ranking api for each chunk
+        records = get_rank_records(items)
+        chunks = [
+            records[i : i + RANK_MAX_RECORDS] for i in range(0, len(records), RANK_MAX_RECORDS)
+        ]
+        futures = [
+            io_executor.submit(rank_records, query, chunk, rows, rank_deadline.timeout())
+            for chunk in chunks
+        ]
+
+        # compute the local scores while waiting for the ranking api
+        local_scores = lexical_scorer.score(query, items)
+        try:
+            scores = merge_rank_scores(
+                [future.result(timeout=rank_deadline.timeout()) for future in futures], rows
+            )
+            outcome = "ranked"
+        except TimeoutError:
+            outcome = "timeout"
+        except Exception:
+            logging.error("text_rerank(): ranking api failed", exc_info=True)
+            outcome = "error"
+
+    if outcome == "ranked":
+        # rank the top candidates of all chunks again in one request (if in time)
+        if len(chunks) > 1 and RANK_TOURNAMENT_SIZE > 1:
+            top_records = get_tournament_records(records, scores)
+            future = io_executor.submit(
+                rank_records, query, top_records, len(top_records), rank_deadline.timeout()
+            )
+            try:
+                top_scores = future.result(timeout=rank_deadline.timeout())
+                scores[: len(top_records)] = top_scores
+            except Exception:
+                logging.warning("text_rerank(): second round skipped", exc_info=True)
+    else:
+        scores = get_local_rank_scores(items, local_scores, rows)
+    logging.info("text_rerank(): %s: %s", outcome, count_rank_outcome(outcome))
+
+    # rerank the features
+    return get_reranked_items(items, scores)
+
+
 #
 # Dedup similar items
 #
 
-DEDUP_MIN_DIST = 10
+# max Levenshtein distance between the normalized descriptions of duplicates
+DEDUP_MIN_DIST = int(os.environ.get("DEDUP_MIN_DIST", 10))
+dedup_detector = NearDuplicateDetector(max_dist=DEDUP_MIN_DIST)
+
+# Optional near-duplicate clusters built with shop_data_prep/cluster_catalog.py
+DEDUP_CLUSTER_DIR = os.environ.get("DEDUP_CLUSTER_DIR")
+cluster_map = ClusterMap(DEDUP_CLUSTER_DIR) if DEDUP_CLUSTER_DIR else None
 
 
 def dedup_items(items):
-    """Dedup items with Levenshtein distance on the item description"""
+    """
+    Dedup items with near-duplicate detection (Levenshtein distance) on the item description,
+    after dropping the non-representatives of the offline clusters (if DEDUP_CLUSTER_DIR). The
+    detection still runs, as the clusters only cover the near-duplicate long descriptions.
+    """
+    if cluster_map:
+        items = cluster_map.dedup_items(items)
+    return near_dup_dedup_items(items, dedup_detector)
 
-    descs = []
-    unique_items = []
-    for item in items:
-        desc = item["description"].replace(" ", "").lower()
-        min_dist = float("inf")
-        for d in descs:
-            dist = levenshtein_distance(desc, d)
-            min_dist = min(min_dist, dist)
-        if min_dist > DEDUP_MIN_DIST:
-            unique_items.append(item)
-            descs.append(desc)
-    return unique_items
+
+# Embedding dedup source: "catalog" (embeddings of the local catalog), "vvs"
+# (read_index_datapoints on the Vector Search index) or "" (disabled)
+EMB_DEDUP_SOURCE = os.environ.get("EMB_DEDUP_SOURCE", "")
+EMB_DEDUP_MIN_COSINE = float(os.environ.get("EMB_DEDUP_MIN_COSINE", DEFAULT_MIN_COSINE))
+EMB_DEDUP_COLUMN = "mm"  # catalog embedding column (the same space as the mm index)
+
+# Embedding cascade source before multimodal filtering (the same choices as EMB_DEDUP_SOURCE),
+# and the cosine bands for accepting and rejecting items without Gemini
+MM_CASCADE_SOURCE = os.environ.get("MM_CASCADE_SOURCE", "")
+MM_CASCADE_ACCEPT = float(os.environ.get("MM_CASCADE_ACCEPT", DEFAULT_ACCEPT_COSINE))
+MM_CASCADE_REJECT = float(os.environ.get("MM_CASCADE_REJECT", DEFAULT_REJECT_COSINE))
+
+item_emb_catalog = catalog or (
+    Catalog(CATALOG_DIR) if "catalog" in (EMB_DEDUP_SOURCE, MM_CASCADE_SOURCE) else None
+)
+
+
+def get_item_embeddings(
+    ids: list[str], source: str = EMB_DEDUP_SOURCE
+) -> tuple[np.ndarray, np.ndarray]:
+    """Returns (embeddings, found mask) of the items from the source ("catalog" or "vvs")"""
+    if source == "catalog":
+        return item_emb_catalog.get_embeddings(ids, EMB_DEDUP_COLUMN)
+
+    # one lookup on the mm index, so that all vectors are in the same space
+    datapoints = vvs_endpoint.read_index_datapoints(
+        deployed_index_id=VVS_DEPLOYED_INDEX_ID_MM, ids=ids
+    )
+    vectors = {dp.datapoint_id: dp.feature_vector for dp in datapoints}
+    dim = len(next(iter(vectors.values()))) if vectors else 0
+    embs = np.zeros((len(ids), dim), dtype=np.float32)
+    found = np.zeros(len(ids), dtype=bool)
+    for i, item_id in enumerate(ids):
+        if item_id in vectors:
+            embs[i] = vectors[item_id]
+            found[i] = True
+    return embs, found
+
+
+def dedup_items_by_embeddings(items, deadline: Deadline = None):
+    """Dedup items whose embeddings are near-duplicates (cosine >= EMB_DEDUP_MIN_COSINE)"""
+    if not EMB_DEDUP_SOURCE or len(items) < 2:
+        return items
+    if deadline and deadline.expired():
+        logging.warning("dedup_items_by_embeddings: skipped (deadline expired)")
+        return items
+    start_time = time.time()
+    embs, found = get_item_embeddings([item["id"] for item in items])
+    deduped_items = [items[i] for i in dedup_by_embeddings(embs, found, EMB_DEDUP_MIN_COSINE)]
+    logging.info(
+        "dedup_items_by_embeddings: incoming items: %d, deduped items: %d, elapsed: %.3f sec",
+        len(items),
+        len(deduped_items),
+        time.time() - start_time,
+    )
+    return deduped_items
+
+
+#
+# Embedding cascade
+#
+
+# Items scored by the cascade, and the Gemini boards (MM_BATCH_SIZE items) before and after it
+cascade_stats_lock = threading.Lock()
+cascade_stats = {"items": 0, "accepted": 0, "rejected": 0, "boards": 0, "gemini_boards": 0}
+
+
+def get_image_embedding(image):
+    """get multimodal embedding for the uploaded image (from the cache if available)"""
+    key = "mm_image:" + hash_image(image)
+    emb = query_emb_cache.get(key)
+    if emb is None:
+        image_bytes = image if isinstance(image, bytes) else base64.b64decode(image)
+        emb = mm_emb_model.get_embeddings(
+            image=MMImage(image_bytes=image_bytes), dimension=MM_EMB_DIMENSIONALITY
+        ).image_embedding
+        query_emb_cache.put(key, emb)
+    return emb
+
+
+def count_cascade_outcome(item_count, accepted_count, rejected_count) -> dict[str, Any]:
+    """Counts the items of a cascade and returns the metrics"""
+    with cascade_stats_lock:
+        cascade_stats["items"] += item_count
+        cascade_stats["accepted"] += accepted_count
+        cascade_stats["rejected"] += rejected_count
+        cascade_stats["boards"] += -(-item_count // MM_BATCH_SIZE)
+        cascade_stats["gemini_boards"] += -(
+            -(item_count - accepted_count - rejected_count) // MM_BATCH_SIZE
+        )
+        return {
+            **cascade_stats,
+            "board_ratio": cascade_stats["gemini_boards"] / max(cascade_stats["boards"], 1),
+        }
+
+
+def cascade_items_by_embeddings(
+    user_intent, item_category, items, user_uploaded_image, deadline: Deadline = None
+):
+    """
+    Scores the items by the cosine similarity of their mm embeddings to the intent and
+    category (and the uploaded image), and returns (accepted items, uncertain items). Items
+    below MM_CASCADE_REJECT are dropped. All items are uncertain if the cascade is disabled
+    or fails.
+    """
+    if not MM_CASCADE_SOURCE or not items:
+        return [], items
+    if deadline and deadline.expired():
+        logging.warning("cascade_items_by_embeddings: skipped (deadline expired)")
+        return [], items
+    start_time = time.time()
+    try:
+        query_embs = [get_mm_embedding(f"{user_intent} {item_category}")]
+        if user_uploaded_image:
+            query_embs.append(get_image_embedding(user_uploaded_image))
+        embs, found = get_item_embeddings([item["id"] for item in items], MM_CASCADE_SOURCE)
+    except Exception:
+        logging.error("cascade_items_by_embeddings: failed", exc_info=True)
+        return [], items
+    if embs.shape[1] != len(query_embs[0]):
+        logging.warning("cascade_items_by_embeddings: skipped (no item embeddings)")
+        return [], items
+
+    scores = score_by_embeddings(embs, found, np.array(query_embs))
+    accepted, rejected, uncertain = partition_by_scores(
+        scores, MM_CASCADE_ACCEPT, MM_CASCADE_REJECT
+    )
+    logging.info(
+        "cascade_items_by_embeddings: accepted: %d, rejected: %d, uncertain: %d, "
+        + "elapsed: %.3f sec, %s",
+        len(accepted),
+        len(rejected),
+        len(uncertain),
+        time.time() - start_time,
+        count_cascade_outcome(len(items), len(accepted), len(rejected)),
+    )
+    return [items[i] for i in accepted], [items[i] for i in uncertain]
 
 
 #
@@ -312,77 +702,195 @@ def dedup_items(items):
 #
 
 
+# Run all queries with one find_neighbors call per index (instead of a thread per query)
+VVS_BATCH_QUERIES = os.environ.get("VVS_BATCH_QUERIES", "True") == "True"
+
+
+def neighbor_to_item(neighbor) -> dict[str, Any]:
+    """Convert a neighbor to an item with the distances"""
+    return {
+        "id": neighbor.id,
+        "dense_dist": neighbor.distance,
+        "sparse_dist": neighbor.sparse_distance,
+    }
+
+
 def run_vector_search_thread(query: str, is_text: bool, items_queue: queue.Queue, query_rows: int):
     """
-    Run vector search in a thread.
+    Run vector search for a query (on the I/O pool).
     """
     # create a HybridQuery
     hybrid_query = create_hybrid_query(query, is_text)
 
     # run query
     deployed_index_id = VVS_DEPLOYED_INDEX_ID if is_text else VVS_DEPLOYED_INDEX_ID_MM
-    response = run_vvs_query(hybrid_query, query_rows, deployed_index_id)
+    response = run_vvs_query([hybrid_query], query_rows, deployed_index_id)
 
     # add distances
     for _, neighbor in enumerate(response[0]):
-        items_queue.put(
-            {
-                "id": neighbor.id,
-                "dense_dist": neighbor.distance,
-                "sparse_dist": neighbor.sparse_distance,
-            }
-        )
+        items_queue.put(neighbor_to_item(neighbor))
+
+
+def run_threaded_vector_search(
+    query_list: list[str], items_queue: queue.Queue, query_rows: int, deadline: Deadline = None
+) -> None:
+    """Run vector search with a text and mm search on the I/O pool for each query"""
+    deadline = deadline or Deadline()
+    futures = [
+        io_executor.submit(run_vector_search_thread, query, is_text, items_queue, query_rows)
+        for query in query_list
+        for is_text in [True, False]
+    ]
 
+    # wait for all searches (until the deadline)
+    done, _ = wait_futures(futures, timeout=deadline.timeout())
+    for future in done:
+        if future.exception() is not None:
+            logging.error(
+                "run_threaded_vector_search(): search failed", exc_info=future.exception()
+            )
 
-def run_queries(
-    query_list: list[str],
-    feature_names: list[str],
-    query_rows: int,
-) -> list[Any]:
-    """Find items from the e-commerce site with the list of queries"""
 
-    # A list for collecting all results
-    items_queue = queue.Queue()
-    threads = []
+def create_hybrid_queries(
+    query_list: list[str], deadline: Deadline = None
+) -> tuple[list[Any], list[Any]]:
+    """
+    Create text and mm HybridQuery objects for all queries with batched embeddings.
+    A query is set to None when its embedding failed or missed the deadline.
+    """
+    deadline = deadline or Deadline()
+    # start missing mm embeddings on the pool while generating the text and sparse embeddings
+    mm_keys = [query_emb_cache_key("mm", query) for query in query_list]
+    mm_embs = [query_emb_cache.get(key) for key in mm_keys]
+    mm_futures = {
+        i: io_executor.submit(generate_mm_embedding, query)
+        for i, query in enumerate(query_list)
+        if mm_embs[i] is None
+    }
+    sparse_embs = get_sparse_embeddings(query_list)
+    try:
+        text_queries = [
+            build_hybrid_query(dense_emb, sparse_emb, True)
+            for dense_emb, sparse_emb in zip(get_text_embeddings(query_list), sparse_embs)
+        ]
+    except Exception:
+        logging.error("create_hybrid_queries(): text embedding failed", exc_info=True)
+        text_queries = [None] * len(query_list)
 
-    for query in query_list:
-        # Create a thread for text emb search
-        text_thread = threading.Thread(
-            target=run_vector_search_thread, args=(query, True, items_queue, query_rows)
-        )
-        text_thread.start()
-        threads.append(text_thread)
+    # collect mm embeddings
+    for i, mm_future in mm_futures.items():
+        try:
+            mm_embs[i] = mm_future.result(timeout=deadline.timeout())
+            query_emb_cache.put(mm_keys[i], mm_embs[i])
+        except Exception:
+            logging.error(
+                "create_hybrid_queries(): mm embedding failed: %s",
+                query_list[i],
+                exc_info=True,
+            )
+    mm_queries = [
+        build_hybrid_query(mm_emb, sparse_emb, False) if mm_emb is not None else None
+        for mm_emb, sparse_emb in zip(mm_embs, sparse_embs)
+    ]
+    logging.info("create_hybrid_queries(): %s", query_emb_cache.stats())
+    return text_queries, mm_queries
 
-        # Create a thread for mm emb search
-        mm_thread = threading.Thread(
-            target=run_vector_search_thread, args=(query, False, items_queue, query_rows)
-        )
-        mm_thread.start()
-        threads.append(mm_thread)
 
-    # join all thread
-    for t in threads:
-        t.join()
+def run_batched_vector_search(
+    query_list: list[str], items_queue: queue.Queue, query_rows: int, deadline: Deadline = None
+) -> None:
+    """Run vector search with one find_neighbors call for each of the text and mm index"""
+    deadline = deadline or Deadline()
 
-    # merge results
+    # create all HybridQuery objects first
+    text_queries, mm_queries = create_hybrid_queries(query_list, deadline)
+
+    # run a batched query on the text and mm index in parallel
+    responses = {}
+
+    def run_vvs_query_thread(hybrid_queries, deployed_index_id):
+        query_indexes = [i for i, q in enumerate(hybrid_queries) if q is not None]
+        if not query_indexes:
+            return
+        try:
+            response = run_vvs_query(
+                [hybrid_queries[i] for i in query_indexes], query_rows, deployed_index_id
+            )
+            responses[deployed_index_id] = dict(zip(query_indexes, response))
+        except Exception:
+            logging.error(
+                "run_batched_vector_search(): search failed: %s", deployed_index_id, exc_info=True
+            )
+
+    futures = [
+        io_executor.submit(run_vvs_query_thread, hybrid_queries, deployed_index_id)
+        for hybrid_queries, deployed_index_id in [
+            (text_queries, VVS_DEPLOYED_INDEX_ID),
+            (mm_queries, VVS_DEPLOYED_INDEX_ID_MM),
+        ]
+    ]
+    _, not_done = wait_futures(futures, timeout=deadline.timeout())
+    if not_done:
+        logging.warning("run_batched_vector_search(): deadline expired: %s", list(responses))
+
+    # fan the neighbors back out per query (of the responses in time)
+    responses = dict(responses)
+    for i in range(len(query_list)):
+        for deployed_index_id in [VVS_DEPLOYED_INDEX_ID, VVS_DEPLOYED_INDEX_ID_MM]:
+            for neighbor in responses.get(deployed_index_id, {}).get(i, []):
+                items_queue.put(neighbor_to_item(neighbor))
+
+
+def merge_found_items(found_items: list[Any]) -> list[Any]:
+    """Merges the items found by the queries (first hit of each id, above the threshold)"""
     id_dict = {}
     items = []
-    while items_queue.qsize() > 0:
-        item = items_queue.get()
+    for item in found_items:
         if item["id"] not in id_dict:
             items.append(item)
             id_dict[item["id"]] = item
 
     # filter with dist threshold if sparse_dist isn't available
-    items = [
+    return [
         f
         for f in items
         if f["dense_dist"] > DENSE_DIST_THRESHOLD
         or (f["sparse_dist"] and f["sparse_dist"] > 0)
     ]
 
-    # fetch feature values
-    items = fetch_feature_values(items, feature_names)
+
+def run_queries(
+    query_list: list[str],
+    feature_names: list[str],
+    query_rows: int,
+    deadline: Deadline = None,
+) -> list[Any]:
+    """
+    Find items from the e-commerce site with the list of queries (the items found and
+    fetched before the deadline)
+    """
+    deadline = deadline or Deadline()
+
+    # A list for collecting all results
+    items_queue = queue.Queue()
+    with deadline.stage("search"):
+        if VVS_BATCH_QUERIES:
+            run_batched_vector_search(query_list, items_queue, query_rows, deadline)
+        else:
+            run_threaded_vector_search(query_list, items_queue, query_rows, deadline)
+
+    # merge results
+    found_items = []
+    while items_queue.qsize() > 0:
+        found_items.append(items_queue.get())
+    items = merge_found_items(found_items)
+
+    # prefetch the board images, and fetch feature values meanwhile
+    prefetch_item_images(items, deadline)
+    with deadline.stage("features"):
+        items = fetch_feature_values(
+            items, feature_names, deadline.child(limit=FEATURE_FETCH_TIMEOUT)
+        )
 
     # return the results
     return items
@@ -395,163 +903,179 @@ def run_queries(
 GEMINI_MODEL = "gemini-2.0-flash"
 gemini_client = genai.Client(vertexai=True, project=PROJECT_ID, location=LOCATION)
 
+# Image board of a Gemini call ("<columns>x<rows>@<tile px>q<quality>" with an optional
+# "/<encoding>") and the items per call, up to the board capacity (compare the layouts with
+# shop_bench.bench_board_layout)
+MM_BOARD_LAYOUT = BoardLayout.parse(os.environ.get("MM_BOARD_LAYOUT", str(DEFAULT_BOARD_LAYOUT)))
+MM_BATCH_SIZE = min(
+    int(os.environ.get("MM_BATCH_SIZE", MM_BOARD_LAYOUT.capacity)), MM_BOARD_LAYOUT.capacity
+)
 
-class ItemSelectionResult(BaseModel):
-    """Schema for item selection result"""
-
-    item_numbers: list[str]
-#    reasons: list[str]
-
-
-def multimodal_filtering_25items(user_intent, item_category, items, user_uploaded_image, queue):
-    """Multimodal filtering for 25 items"""
-
-    # Generate image board
-    items, item_image_board = generate_item_image_board(items)
-
-    # Convert image_board to bytearray
-    item_image_board_data = image_to_bytes(item_image_board)
-
-    # Item list with item number, title and description
-    item_listing = ""
-    for item in items:
-        item_line = "<item>"
-        item_line += f"<item_number>#{item['item_number']}</item_number>"
-        item_line += f"<item_name>{item['name']}</item_name>"
-        item_line += (
-            f"<item_description>{item['description'][0:200]}</item_description>"
-        )
-        item_line += "</item>"
-        item_listing += f"{item_line}\n"
-
-    # Evaluation prompt
-    eval_prompt_with_user_image = f"""
-
-        Preparation:
-
-        A user is visiting an e-commerce site.  The user's intent is "{user_intent}", and they are
-        searching for "{item_category}" that fits the first image shared by the user. Based on the
-        first image, predict what kind of profile and preference the user would have.
- 
-        Question:
-
-        The second image is the items found on the site. The Item List below has the detail of each
-        item. From these items, select items that best match with the user's preference, the user 
-        intent and item category. Return a list of the selected item numbers 
-        (starting with #). 
-        Do not include any items irrelevant to the user intent or item category.
+# Max retrieved items whose board images are prefetched (0 to disable)
+IMAGE_PREFETCH_MAX = int(os.environ.get("IMAGE_PREFETCH_MAX", 200))
 
-        Item List:
-        {item_listing}
 
-        """
-    eval_prompt_without_user_image = f"""
+def prefetch_item_images(items: list[Any], deadline: Deadline) -> None:
+    """
+    Starts downloading the board images of the retrieved items into the thumbnail cache, while
+    their features are fetched and they are deduped (the boards join the downloads in flight).
+    Records the "prefetch" stage when the downloads finish or the deadline expires.
+    """
+    if IMAGE_PREFETCH_MAX <= 0 or not items:
+        return
+    start_time = time.monotonic()
+    prefetch_future = submit_image_downloads(
+        [item["id"] for item in items[:IMAGE_PREFETCH_MAX]],
+        MM_BOARD_LAYOUT.tile_size,
+        MM_BOARD_LAYOUT.tile_size,
+        deadline.timeout(),
+    )
+    prefetch_future.add_done_callback(lambda _: deadline.record_stage("prefetch", start_time))
 
-        Preparation:
 
-        A user is visiting an e-commerce site.  The user's intent is "{user_intent}", and they are
-        searching for "{item_category}".
+# Cache of the filtering verdicts (refined or repeated searches reuse them)
+MM_VERDICT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+MM_VERDICT_CACHE_TTL = 60 * 60  # secs
 
-        Question:
+mm_verdict_cache = VerdictCache(
+    TTLCache(name="mm_verdict", max_bytes=MM_VERDICT_CACHE_MAX_BYTES, ttl=MM_VERDICT_CACHE_TTL),
+    group_size=MM_BATCH_SIZE,
+)
 
-        The image is the items found on the site. The Item List below has the detail of each
-        item. From these items, select items best match with the user intent and item category. 
-        Return a list of the selected item numbers (starting with #).
-        Do not include any items irrelevant to the user intent or item category.
+MM_FILTER_TIMEOUT = 5.0  # max secs to wait for the Gemini calls
+MM_FILTER_MIN_TIME = 1.0  # min secs left before the reserve to start the Gemini calls
+RERANK_RESERVE = 1.0  # secs left for text_rerank after multimodal filtering
 
-        Item List:
-        {item_listing}
 
-        """
+def multimodal_filtering_batch(
+    user_intent,
+    item_category,
+    items,
+    user_uploaded_image,
+    layout: BoardLayout = None,
+    deadline: Deadline = None,
+):
+    """
+    Multimodal filtering for a batch of up to MM_BATCH_SIZE items on a board of the layout
+    (MM_BOARD_LAYOUT by default). Returns a future of the selected items: the images are
+    downloaded by the image fetcher (until BOARD_IMAGE_TIMEOUT), the board is rendered on the
+    CPU pool (or a render process), and Gemini is called on the I/O pool. The future fails
+    with TimeoutError if the deadline expires before the Gemini call starts.
+    """
+    layout = layout or MM_BOARD_LAYOUT
+    deadline = deadline or Deadline()
 
-    # Prepare contents and prompt
-    if user_uploaded_image:
-        contents = [
-            Part.from_bytes(data=user_uploaded_image, mime_type="image/jpeg"),
-            eval_prompt_with_user_image,
-            Part.from_bytes(data=item_image_board_data, mime_type="image/jpeg"),
-        ]
-    else:
-        contents = [
-            eval_prompt_without_user_image,
-            Part.from_bytes(data=item_image_board_data, mime_type="image/jpeg"),
-        ]
+    # Generate image board
+    start_time = time.monotonic()
+    download_future = submit_item_image_downloads(items, layout)
+    board_future = submit_board_render(items, download_future, layout)
+    board_future.add_done_callback(lambda _: deadline.record_stage("boards", start_time))
 
     # Evaluate with Gemini
-    response = gemini_client.models.generate_content(
-        model=GEMINI_MODEL,
-        contents=contents,
-        config=GenerateContentConfig(
-            response_mime_type="application/json",
-            response_schema=ItemSelectionResult,
-        ),
-    )
-    decoded_response = json.loads(response.text)
-    item_numbers = decoded_response["item_numbers"]
-#    reasons = decoded_response["reasons"]
-#    logging.info("multimodal_filtering_25items(): reasons %s", reasons)
-
-    # Filter and rerank items
-    items_by_number = {item["item_number"]: item for item in items}
-    reranked_items = []
-    for item_number in item_numbers:
-        item_number = (
-            item_number.lstrip("#") if item_number.startswith("#") else item_number
+    def select_with_gemini(results):
+        if deadline.expired():
+            raise TimeoutError("no time left for the Gemini call")
+        contents = build_multimodal_contents(
+            user_intent,
+            item_category,
+            items,
+            results[0],
+            user_uploaded_image,
+            layout.mime_type,
         )
-        if item_number in items_by_number:
-            reranked_items.append(items_by_number[item_number])
-    queue.put(reranked_items)
+        response = gemini_client.models.generate_content(
+            model=GEMINI_MODEL, contents=contents, config=ITEM_SELECTION_CONFIG
+        )
+        return select_items(items, response.text)
 
-    # for debug
-    # generate file name from user intent and item category
-#    filename = f"{user_intent.replace(' ', '_')}_{item_category.replace(' ', '_')}.jpg"
-#    storage_client = storage.Client()
-#    bucket = storage_client.bucket("gcp-samples-ic0-ac")
-#    blob = bucket.blob(filename)
-#    blob.upload_from_string(item_image_board_data, content_type="image/jpeg")
-#    print(f"File {filename} uploaded.")
-#    print(eval_prompt_with_user_image)
-#    print(item_numbers)
+    return then([board_future], io_executor, select_with_gemini)
 
 
-def multimodal_filtering(user_intent, item_category, items, user_uploaded_image):
-    """Multimodal filtering"""
+def multimodal_filtering(
+    user_intent,
+    item_category,
+    items,
+    user_uploaded_image,
+    deadline: Deadline = None,
+    on_filtered: Callable[[list[Any]], None] = None,
+):
+    """
+    Multimodal filtering, until MM_FILTER_TIMEOUT or RERANK_RESERVE secs before the deadline.
+    Skipped if less than MM_FILTER_MIN_TIME is left. Items with cached verdicts aren't sent to
+    Gemini again. If no group finished in time, the items without verdicts are returned
+    unfiltered. on_filtered is called with the items filtered so far each time a group finishes.
+    """
 
     start_time = time.time()
+    filter_deadline = (deadline or Deadline()).child(
+        limit=MM_FILTER_TIMEOUT, reserve=RERANK_RESERVE
+    )
+    if filter_deadline.remaining() < MM_FILTER_MIN_TIME:
+        logging.warning("multimodal_filtering: skipped (deadline): items: %d", len(items))
+        return items
 
-    # Start a thread of multimodal_rerank_25items for 25 items each
-    reranked_queue = queue.Queue()
-    threads = []
-    for i in range(0, len(items), 25):
-        thread = threading.Thread(
-            target=multimodal_filtering_25items,
-            args=(
-                user_intent,
-                item_category,
-                items[i : i + 25],
-                user_uploaded_image,
-                reranked_queue,
-            ),
-        )
-        thread.start()
-        threads.append(thread)
+    # Resolve the items with cached verdicts
+    context = mm_verdict_cache.context_key(user_intent, item_category, user_uploaded_image)
+    cached_items, groups = mm_verdict_cache.plan(context, items)
 
-    # Wait for the threads for upto 5 secs
-    for thread in threads:
-        thread.join(timeout=5)
+    # Start multimodal_filtering_batch for MM_BATCH_SIZE items each
+    reranked_queue = queue.Queue()
 
-    # Collect the results
-    reranked_items = []
-    while not reranked_queue.empty():
-        reranked_items.extend(reranked_queue.get())
+    def on_group_done(group_items, future):
+        if future.cancelled():
+            reranked_queue.put([])
+        elif isinstance(future.exception(), TimeoutError):
+            logging.warning("multimodal_filtering: group skipped: %s", str(future.exception()))
+            reranked_queue.put([])
+        elif future.exception() is not None:
+            logging.error("multimodal_filtering: group failed", exc_info=future.exception())
+            reranked_queue.put([])
+        else:
+            mm_verdict_cache.put(context, group_items, future.result())
+            reranked_queue.put(future.result())
+
+    futures = []
+    for group_items in groups:
+        future = multimodal_filtering_batch(
+            user_intent, item_category, group_items, user_uploaded_image, deadline=filter_deadline
+        )
+        future.add_done_callback(functools.partial(on_group_done, group_items))
+        futures.append(future)
+
+    # Collect the results as the groups finish (until the deadline)
+    reranked_items = list(cached_items)
+    if cached_items and on_filtered:
+        on_filtered(reranked_items)
+    finished_count = 0
+    while finished_count < len(futures):
+        try:
+            group_items = reranked_queue.get(timeout=filter_deadline.timeout())
+        except queue.Empty:
+            break
+        finished_count += 1
+        reranked_items.extend(group_items)
+        if on_filtered:
+            on_filtered(reranked_items)
+    if finished_count < len(futures):
+        # cancel the boards and Gemini calls that haven't started
+        for future in futures:
+            future.cancel()
+        logging.warning(
+            "multimodal_filtering: deadline expired: finished groups: %d/%d",
+            finished_count,
+            len(futures),
+        )
+        if finished_count == 0:
+            reranked_items = cached_items + [item for group in groups for item in group]
 
     # log elapsed time
     elapsed_time = time.time() - start_time
     logging.info(
-        "multimodal_filtering: incoming items: %d, reranked items: %d, elapsed: %.2f sec, ",
+        "multimodal_filtering: incoming items: %d, reranked items: %d, elapsed: %.2f sec, %s",
         len(items),
         len(reranked_items),
         elapsed_time,
+        mm_verdict_cache.stats(),
     )
     return reranked_items
 
@@ -561,24 +1085,50 @@ def filter_and_rerank_items(
     item_category: str,
     items: list[Any],
     user_uploaded_image: Any,
+    deadline: Deadline = None,
+    on_filtered: Callable[[list[Any]], None] = None,
 ) -> list[str]:
-    """Filtering and Reranking on the items"""
+    """
+    Filtering and Reranking on the items (each stage shrinks its work to the deadline).
+    on_filtered is called with the items filtered so far as each multimodal batch finishes.
+    """
+    deadline = deadline or Deadline()
 
     # remove items without product name
     items = [item for item in items if item["name"] and len(item["name"].strip()) > 0]
 
     # dedup items
-    items = dedup_items(items)
+    with deadline.stage("dedup"):
+        items = dedup_items(items)
+        items = dedup_items_by_embeddings(items, deadline)
+
+    # embedding cascade, then multimodal filtering of the uncertain items
+    with deadline.stage("cascade"):
+        accepted_items, items = cascade_items_by_embeddings(
+            user_intent, item_category, items, user_uploaded_image, deadline
+        )
 
-    # multimodal filtering
-    items = multimodal_filtering(user_intent, item_category, items, user_uploaded_image)
+    def on_filtered_with_accepted(filtered_items):
+        on_filtered(accepted_items + filtered_items)
+
+    with deadline.stage("mm_filter"):
+        items = accepted_items + multimodal_filtering(
+            user_intent,
+            item_category,
+            items,
+            user_uploaded_image,
+            deadline,
+            on_filtered_with_accepted if on_filtered else None,
+        )
 
     # text rerank
-    items = text_rerank(
-        f"{user_intent} {item_category}",
-        items,
-        len(items),
-    )
+    with deadline.stage("rerank"):
+        items = text_rerank(
+            f"{user_intent} {item_category}",
+            items,
+            len(items),
+            deadline,
+        )
 
     # remove distances
     for item in items:
@@ -0,0 +1,239 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides a compact, memory-mapped TF-IDF encoder that reproduces the output of
+a fitted scikit-learn TfidfVectorizer (analyzer="word") without loading scikit-learn.
+
+An encoder directory contains:
+    params.json: the vectorizer parameters (token pattern, n-grams, norm, etc.)
+    terms.npy: the UTF-8 bytes of all terms, in column order
+    term_offsets.npy: (vocab_size + 1,) offsets of each term in terms.npy
+    hash_table.npy: an open addressing hash table (crc32 of the term -> column index)
+    idf.npy: (vocab_size,) idf values
+"""
+
+import os
+import re
+import json
+import math
+import zlib
+import logging
+import unicodedata
+from typing import Any
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+
+PARAMS_FILE = "params.json"
+TERMS_FILE = "terms.npy"
+TERM_OFFSETS_FILE = "term_offsets.npy"
+HASH_TABLE_FILE = "hash_table.npy"
+IDF_FILE = "idf.npy"
+
+EMPTY_SLOT = -1
+
+
+def strip_accents_ascii(s: str) -> str:
+    """Same as sklearn's strip_accents_ascii"""
+    nkfd_form = unicodedata.normalize("NFKD", s)
+    return nkfd_form.encode("ASCII", "ignore").decode("ASCII")
+
+
+def strip_accents_unicode(s: str) -> str:
+    """Same as sklearn's strip_accents_unicode"""
+    try:
+        s.encode("ASCII", errors="strict")
+        return s
+    except UnicodeEncodeError:
+        normalized = unicodedata.normalize("NFKD", s)
+        return "".join([c for c in normalized if not unicodedata.combining(c)])
+
+
+#
+# Export
+#
+
+
+def export_vectorizer(vectorizer: Any, encoder_dir: str) -> None:
+    """
+    Exports a fitted TfidfVectorizer to an encoder directory.
+    Raises ValueError for the options that SparseEncoder can't reproduce.
+    """
+    if vectorizer.analyzer != "word":
+        raise ValueError(f"unsupported analyzer: {vectorizer.analyzer}")
+    if vectorizer.input != "content":
+        raise ValueError(f"unsupported input: {vectorizer.input}")
+    if vectorizer.preprocessor is not None or vectorizer.tokenizer is not None:
+        raise ValueError("custom preprocessor or tokenizer is not supported")
+    if vectorizer.strip_accents not in (None, "ascii", "unicode"):
+        raise ValueError(f"unsupported strip_accents: {vectorizer.strip_accents}")
+    os.makedirs(encoder_dir, exist_ok=True)
+
+    # Terms in column order
+    vocab_size = len(vectorizer.vocabulary_)
+    terms = [None] * vocab_size
+    for term, column in vectorizer.vocabulary_.items():
+        terms[column] = term.encode("utf-8")
+    term_offsets = np.zeros(vocab_size + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum([len(term) for term in terms])
+    np.save(
+        os.path.join(encoder_dir, TERMS_FILE),
+        np.frombuffer(b"".join(terms), dtype=np.uint8),
+    )
+    np.save(os.path.join(encoder_dir, TERM_OFFSETS_FILE), term_offsets)
+
+    # Hash table with linear probing (load factor <= 0.5)
+    table_size = 1 << max(1, (2 * vocab_size - 1).bit_length())
+    mask = table_size - 1
+    hash_table = np.full(table_size, EMPTY_SLOT, dtype=np.int32)
+    for column, term in enumerate(terms):
+        slot = zlib.crc32(term) & mask
+        while hash_table[slot] != EMPTY_SLOT:
+            slot = (slot + 1) & mask
+        hash_table[slot] = column
+    np.save(os.path.join(encoder_dir, HASH_TABLE_FILE), hash_table)
+
+    # Idf and params
+    dtype = np.dtype(vectorizer.dtype)
+    if vectorizer.use_idf:
+        np.save(os.path.join(encoder_dir, IDF_FILE), vectorizer.idf_)
+    params = {
+        "lowercase": vectorizer.lowercase,
+        "strip_accents": vectorizer.strip_accents,
+        "token_pattern": vectorizer.token_pattern,
+        "ngram_range": list(vectorizer.ngram_range),
+        "stop_words": sorted(vectorizer.get_stop_words() or []) or None,
+        "binary": vectorizer.binary,
+        "sublinear_tf": vectorizer.sublinear_tf,
+        "use_idf": vectorizer.use_idf,
+        "norm": vectorizer.norm,
+        "dtype": dtype.name,
+        "vocab_size": vocab_size,
+    }
+    with open(os.path.join(encoder_dir, PARAMS_FILE), "w", encoding="utf-8") as f:
+        json.dump(params, f)
+
+
+#
+# Encoding
+#
+
+
+class SparseEncoder:
+    """
+    Encodes texts into TF-IDF sparse vectors identical to TfidfVectorizer.transform().
+    """
+
+    def __init__(self, encoder_dir: str):
+        with open(os.path.join(encoder_dir, PARAMS_FILE), "r", encoding="utf-8") as f:
+            self.params = json.load(f)
+        self.terms = np.load(os.path.join(encoder_dir, TERMS_FILE), mmap_mode="r")
+        self.term_offsets = np.load(
+            os.path.join(encoder_dir, TERM_OFFSETS_FILE), mmap_mode="r"
+        )
+        self.hash_table = np.load(os.path.join(encoder_dir, HASH_TABLE_FILE), mmap_mode="r")
+        self.hash_mask = len(self.hash_table) - 1
+        self.idf = (
+            np.load(os.path.join(encoder_dir, IDF_FILE), mmap_mode="r")
+            if self.params["use_idf"]
+            else None
+        )
+        self.dtype = np.dtype(self.params["dtype"])
+        self.token_pattern = re.compile(self.params["token_pattern"])
+        self.stop_words = (
+            frozenset(self.params["stop_words"]) if self.params["stop_words"] else None
+        )
+        self.strip_accents = {
+            "ascii": strip_accents_ascii,
+            "unicode": strip_accents_unicode,
+        }.get(self.params["strip_accents"])
+        logging.info(
+            "SparseEncoder(): loaded %s: vocab size: %d", encoder_dir, len(self.term_offsets) - 1
+        )
+
+    def analyze(self, doc: str) -> list[str]:
+        """Splits a text into terms (same as the vectorizer's analyzer)"""
+        if self.params["lowercase"]:
+            doc = doc.lower()
+        if self.strip_accents is not None:
+            doc = self.strip_accents(doc)
+        tokens = self.token_pattern.findall(doc)
+        if self.stop_words is not None:
+            tokens = [w for w in tokens if w not in self.stop_words]
+
+        # n-grams
+        min_n, max_n = self.params["ngram_range"]
+        if max_n == 1:
+            return tokens
+        original_tokens = tokens
+        if min_n == 1:
+            tokens = list(original_tokens)
+            min_n += 1
+        else:
+            tokens = []
+        for n in range(min_n, min(max_n + 1, len(original_tokens) + 1)):
+            for i in range(len(original_tokens) - n + 1):
+                tokens.append(" ".join(original_tokens[i : i + n]))
+        return tokens
+
+    def lookup(self, term: str) -> int:
+        """Returns the column index of the term, or -1 if it's not in the vocabulary"""
+        term = term.encode("utf-8")
+        slot = zlib.crc32(term) & self.hash_mask
+        while True:
+            column = int(self.hash_table[slot])
+            if column == EMPTY_SLOT:
+                return -1
+            start, end = self.term_offsets[column], self.term_offsets[column + 1]
+            if end - start == len(term) and self.terms[start:end].tobytes() == term:
+                return column
+            slot = (slot + 1) & self.hash_mask
+
+    def transform(self, docs: list[str]) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Encodes a batch of texts into (sorted column indices, tf-idf values) per text"""
+        columns = {}
+        results = []
+        for doc in docs:
+            # Count terms in the vocabulary (looking up each distinct term once per batch)
+            counts = {}
+            for term in self.analyze(doc):
+                column = columns.get(term)
+                if column is None:
+                    column = columns[term] = self.lookup(term)
+                if column >= 0:
+                    counts[column] = counts.get(column, 0) + 1
+            indices = np.fromiter(sorted(counts), dtype=np.int32, count=len(counts))
+            values = np.array([counts[i] for i in indices.tolist()], dtype=self.dtype)
+
+            # Apply the same steps as TfidfTransformer.transform()
+            if self.params["binary"]:
+                values.fill(1)
+            if self.params["sublinear_tf"]:
+                np.log(values, values)
+                values += 1.0
+            if self.idf is not None:
+                values *= self.idf[indices]
+            if self.params["norm"] in ("l1", "l2"):
+                # Sum in double precision and divide, as sklearn's normalize() does
+                norm = 0.0
+                for v in values:
+                    norm += float(v * v) if self.params["norm"] == "l2" else float(abs(v))
+                if norm != 0.0:
+                    if self.params["norm"] == "l2":
+                        norm = math.sqrt(norm)
+                    values[:] = values.astype(np.float64) / norm
+            results.append((indices, values))
+        return results
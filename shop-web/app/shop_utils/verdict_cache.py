@@ -0,0 +1,147 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+This module provides a cache of the multimodal filtering verdicts (the items Gemini selected
+from a board), so that refined or repeated searches don't send the same candidates again.
+Verdicts are kept per filtering context: the normalized user intent and item category, and a
+hash of the uploaded image.
+
+    batch verdicts: the sorted item ids of a board -> the selected ids (in Gemini's order)
+    item verdicts: an item id -> selected or not, reused when the boards partially overlap
+"""
+
+import hashlib
+import threading
+from typing import Any
+
+from shop_utils.cache import TTLCache
+
+DEFAULT_GROUP_SIZE = 25  # items per board
+
+
+def normalize_text(text: str) -> str:
+    """Lowercases the text and collapses the whitespace"""
+    return " ".join(text.lower().split()) if text else ""
+
+
+def hash_image(image: Any) -> str:
+    """Returns a hash of the uploaded image (bytes or base64 str), or "" without an image"""
+    if not image:
+        return ""
+    data = image if isinstance(image, bytes) else str(image).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+class VerdictCache:
+    """
+    Resolves the items of a multimodal filtering from the cached verdicts, and returns the
+    rest in groups for Gemini. Counts the Gemini calls made and saved.
+    """
+
+    def __init__(self, cache: TTLCache, group_size: int = DEFAULT_GROUP_SIZE):
+        self.cache = cache
+        self.group_size = group_size
+        self.lock = threading.Lock()
+        self.batch_hits = 0
+        self.item_hits = 0
+        self.gemini_calls = 0
+        self.uncached_calls = 0
+
+    def context_key(self, user_intent: str, item_category: str, user_uploaded_image: Any) -> str:
+        """Returns the key of the filtering context"""
+        return "|".join(
+            [
+                normalize_text(user_intent),
+                normalize_text(item_category),
+                hash_image(user_uploaded_image),
+            ]
+        )
+
+    @staticmethod
+    def batch_key(context: str, item_ids: list[str]) -> str:
+        """Returns the key of a board (the order of the items doesn't matter)"""
+        ids_hash = hashlib.sha256("\n".join(sorted(item_ids)).encode("utf-8")).hexdigest()[:32]
+        return f"batch:{context}:{ids_hash}"
+
+    @staticmethod
+    def item_key(context: str, item_id: str) -> str:
+        """Returns the key of an item verdict"""
+        return f"item:{context}:{item_id}"
+
+    def plan(
+        self, context: str, items: list[dict[str, Any]]
+    ) -> tuple[list[dict[str, Any]], list[list[dict[str, Any]]]]:
+        """
+        Returns the selected items resolved from the cache, and the groups of the unresolved
+        items to filter with Gemini.
+        """
+        selected_items = []
+        unresolved_items = []
+        batch_hits = item_hits = 0
+        for i in range(0, len(items), self.group_size):
+            group_items = items[i : i + self.group_size]
+
+            # the same board as before
+            selected_ids = self.cache.get(
+                self.batch_key(context, [item["id"] for item in group_items])
+            )
+            if selected_ids is not None:
+                items_by_id = {item["id"]: item for item in group_items}
+                selected_items.extend(items_by_id[item_id] for item_id in selected_ids)
+                batch_hits += 1
+                continue
+
+            # items seen on other boards
+            for item in group_items:
+                verdict = self.cache.get(self.item_key(context, item["id"]))
+                if verdict is None:
+                    unresolved_items.append(item)
+                    continue
+                item_hits += 1
+                if verdict:
+                    selected_items.append(item)
+
+        groups = [
+            unresolved_items[i : i + self.group_size]
+            for i in range(0, len(unresolved_items), self.group_size)
+        ]
+        with self.lock:
+            self.batch_hits += batch_hits
+            self.item_hits += item_hits
+            self.gemini_calls += len(groups)
+            self.uncached_calls += -(-len(items) // self.group_size)
+        return selected_items, groups
+
+    def put(
+        self, context: str, group_items: list[dict[str, Any]], selected_items: list[dict[str, Any]]
+    ) -> None:
+        """Stores the verdicts of a board filtered by Gemini"""
+        selected_ids = [item["id"] for item in selected_items]
+        self.cache.put(self.batch_key(context, [item["id"] for item in group_items]), selected_ids)
+        selected_id_set = set(selected_ids)
+        for item in group_items:
+            self.cache.put(self.item_key(context, item["id"]), item["id"] in selected_id_set)
+
+    def stats(self) -> dict[str, Any]:
+        """Returns the metrics"""
+        with self.lock:
+            return {
+                "gemini_calls": self.gemini_calls,
+                "saved_calls": self.uncached_calls - self.gemini_calls,
+                "batch_hits": self.batch_hits,
+                "item_hits": self.item_hits,
+                "entries": self.cache.stats()["entries"],
+            }